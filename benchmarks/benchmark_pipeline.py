@@ -0,0 +1,554 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmarks each stage of the sortphotos pipeline on a synthetic library of photos and videos.
+
+The library is generated from a seed, so every run with the same options sorts exactly the same files.  Photos are
+minimal JPEGs with an EXIF DateTimeOriginal and videos are minimal MP4s with QuickTime dates, padded to the requested
+sizes with random data.  Camera style names (IMG_0001.JPG, restarting in every folder), bursts of photos taken in the
+same second and byte for byte duplicates are mixed in at the requested rates, so that name collisions and duplicate
+detection are exercised as well.
+
+Each stage is timed on its own:
+
+- walk: finding the files (iter_all_files)
+- extract: reading the time stamps, natively and (if ExifTool can be found) with ExifTool
+- timestamp: choosing the date of each file from its metadata (get_oldest_timestamp)
+- collisions: working out each destination path and resolving name collisions (DestinationDirectories and
+  DestinationNames, as used by the placement loop of sortPhotos)
+- duplicates: checking each file against the duplicate index
+- transfer_copy and transfer_move: copying and moving the files into place (TransferExecutor)
+- end_to_end: a whole sortPhotos copy into an empty destination
+
+The results are written as JSON, and can be compared with an earlier run with --compare.  Nothing is downloaded, so
+the benchmark runs offline; without perl/ExifTool only the ExifTool extraction is skipped.
+
+    python benchmarks/benchmark_pipeline.py --files 5000 --output results.json
+    python benchmarks/benchmark_pipeline.py --files 5000 --compare results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src import duplicate_index, sortphotos, transfer  # noqa: E402
+
+BENCHMARK_VERSION = 1
+
+# seconds between 1904-01-01 (the QuickTime epoch) and 1970-01-01
+QUICKTIME_EPOCH = 2082844800
+
+# largest payload of a single JPEG segment
+MAX_SEGMENT = 65533
+
+
+def _log(message: str) -> None:
+    """log a progress message or result of the benchmark itself (sortphotos' own logging is silenced)"""
+    logging.getLogger("benchmark").warning(message)
+
+
+def _random_bytes(rng: random.Random, size: int) -> bytes:
+    """get size reproducible random bytes"""
+    return rng.getrandbits(8 * size).to_bytes(size, "little") if size > 0 else b""
+
+
+def make_jpeg(date: datetime, size: int, rng: random.Random) -> bytes:
+    """
+    Builds a minimal JPEG with an EXIF DateTimeOriginal, padded with comment segments to about size bytes.
+
+    :param datetime date: the date the photo was taken
+    :param int size: the size of the file to aim for
+    :param random.Random rng: the source of the padding
+
+    :return: the contents of the file
+    :rtype: bytes
+    """
+    # little endian TIFF: IFD0 (at 8) holds only the pointer to the Exif IFD (at 26), which holds DateTimeOriginal
+    tiff = b"II*\x00" + struct.pack("<I", 8)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x8769, 4, 1, 26) + struct.pack("<I", 0)
+    tiff += struct.pack("<H", 1) + struct.pack("<HHII", 0x9003, 2, 20, 44) + struct.pack("<I", 0)
+    tiff += date.strftime("%Y:%m:%d %H:%M:%S").encode("ascii") + b"\x00"
+    app1 = b"Exif\x00\x00" + tiff
+    data = b"\xff\xd8" + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+    # an 8x8 greyscale frame header and scan header, with no image data
+    frame = b"\xff\xc0" + struct.pack(">HBHHBBBB", 11, 8, 8, 8, 1, 1, 0x11, 0)
+    scan = b"\xff\xda" + struct.pack(">HBBBBBB", 8, 1, 1, 0, 0, 63, 0)
+    remaining = size - len(data) - len(frame) - len(scan) - 2
+    while remaining > 4:
+        chunk = min(MAX_SEGMENT - 2, remaining - 4)
+        data += b"\xff\xfe" + struct.pack(">H", chunk + 2) + _random_bytes(rng, chunk)
+        remaining -= chunk + 4
+    return data + frame + scan + b"\xff\xd9"
+
+
+def make_mp4(date: datetime, size: int, rng: random.Random) -> bytes:
+    """
+    Builds a minimal MP4 with a single track, with the movie, track and media dates all set, padded to about size bytes.
+
+    :param datetime date: the date the video was taken, in UTC
+    :param int size: the size of the file to aim for
+    :param random.Random rng: the source of the media data
+
+    :return: the contents of the file
+    :rtype: bytes
+    """
+
+    def box(kind, payload):
+        return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+    def full_box(kind, payload):
+        return box(kind, struct.pack(">I", 0) + payload)
+
+    t = int((date - datetime(1970, 1, 1)).total_seconds()) + QUICKTIME_EPOCH
+    mvhd = full_box(b"mvhd", struct.pack(">IIII", t, t, 1000, 5000) + b"\x00" * 80)
+    tkhd = full_box(b"tkhd", struct.pack(">IIII", t, t, 1, 0) + b"\x00" * 64)
+    mdhd = full_box(b"mdhd", struct.pack(">IIII", t, t, 1000, 5000) + b"\x00" * 4)
+    moov = box(b"moov", mvhd + box(b"trak", tkhd + box(b"mdia", mdhd)))
+    ftyp = box(b"ftyp", b"isom\x00\x00\x00\x00isommp41")
+    mdat = box(b"mdat", _random_bytes(rng, max(0, size - len(ftyp) - len(moov) - 8)))
+    return ftyp + mdat + moov
+
+
+def generate_corpus(
+    path: str,
+    files: int,
+    depth: int = 2,
+    fanout: int = 4,
+    burst_rate: float = 0.2,
+    duplicate_rate: float = 0.05,
+    video_rate: float = 0.1,
+    photo_size: int = 64 * 1024,
+    video_size: int = 512 * 1024,
+    seed: int = 0,
+) -> dict:
+    """
+    Writes a synthetic library of photos and videos.
+
+    :param str path: the directory to write the library to
+    :param int files: the number of files
+    :param int depth: the depth of the directory tree
+    :param int fanout: the number of sub directories of each directory
+    :param float burst_rate: the fraction of files taken in the same second as the file before
+    :param float duplicate_rate: the fraction of files which are copies of an earlier file
+    :param float video_rate: the fraction of files which are videos
+    :param int photo_size: the size of each photo in bytes
+    :param int video_size: the size of each video in bytes
+    :param int seed: the seed of the random choices, so that the same options always give the same library
+
+    :return: a description of the library, with its parameters and counts
+    :rtype: dict
+    """
+    rng = random.Random(seed)
+    directories = [path]
+    level = [path]
+    for _ in range(depth):
+        level = [os.path.join(d, "dir{:02d}".format(i)) for d in level for i in range(fanout)]
+        directories.extend(level)
+    for d in directories:
+        os.makedirs(d, exist_ok=True)
+
+    counters = dict.fromkeys(directories, 0)
+    written = []
+    date = datetime(2015, 1, 1, 9, 0, 0)
+    counts = {"photos": 0, "videos": 0, "bursts": 0, "duplicates": 0, "bytes": 0}
+    for _ in range(files):
+        directory = rng.choice(directories)
+        counters[directory] += 1
+        if written and rng.random() < duplicate_rate:
+            original, ext = rng.choice(written)
+            name = "IMG_{:04d}{}".format(counters[directory], ext)
+            shutil.copyfile(original, os.path.join(directory, name))
+            counts["duplicates"] += 1
+            counts["bytes"] += os.path.getsize(original)
+            continue
+        if written and rng.random() < burst_rate:
+            counts["bursts"] += 1
+        else:
+            date += timedelta(seconds=rng.randint(60, 6 * 3600))
+        if rng.random() < video_rate:
+            ext = ".MP4"
+            data = make_mp4(date, video_size, rng)
+            counts["videos"] += 1
+        else:
+            ext = ".JPG"
+            data = make_jpeg(date, photo_size, rng)
+            counts["photos"] += 1
+        name = os.path.join(directory, "IMG_{:04d}{}".format(counters[directory], ext))
+        with open(name, "wb") as f:
+            f.write(data)
+        written.append((name, ext))
+        counts["bytes"] += len(data)
+
+    return {
+        "files": files,
+        "depth": depth,
+        "fanout": fanout,
+        "directories": len(directories),
+        "burst_rate": burst_rate,
+        "duplicate_rate": duplicate_rate,
+        "video_rate": video_rate,
+        "photo_size": photo_size,
+        "video_size": video_size,
+        "seed": seed,
+        "counts": counts,
+    }
+
+
+def measure(run, repeat: int, setup=None) -> dict:
+    """
+    Times a stage.
+
+    :param run: does the work of the stage, given the result of setup, and returns the number of items processed
+    :param int repeat: the number of times to run the stage
+    :param setup: if given, called (untimed) before each run
+
+    :return: the number of items and the times taken (in seconds) and items per second
+    :rtype: dict
+    """
+    times = []
+    items = 0
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        items = run(state)
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        "items": items,
+        "repeat": repeat,
+        "seconds": {
+            "min": best,
+            "median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "max": max(times),
+        },
+        "items_per_second": items / best if best > 0 else None,
+    }
+
+
+def find_exiftool() -> str:
+    """
+    Finds ExifTool, adding the copy bundled with sortphotos to the PATH if there is none installed.
+
+    :return: the version of ExifTool, or None if it can't be run
+    :rtype: str
+    """
+    if shutil.which("exiftool") is None:
+        os.environ["PATH"] = os.path.dirname(sortphotos.exiftool_location) + os.pathsep + os.environ.get("PATH", "")
+    try:
+        return (
+            subprocess.run(
+                ["exiftool", "-ver"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, timeout=60
+            )
+            .stdout.decode()
+            .strip()
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _git_commit() -> str:
+    """get the commit being benchmarked, if this is a git checkout"""
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+            )
+            .stdout.decode()
+            .strip()
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmarks(args, src_dir: str, work_dir: str, exiftool_version: str) -> dict:
+    """
+    Times each stage on the library in src_dir.
+
+    :param args: the parsed command line arguments
+    :param str src_dir: the library to sort
+    :param str work_dir: a directory for destinations, which is emptied as required
+    :param str exiftool_version: the version of ExifTool, or None to skip the stages which need it
+
+    :return: the results of each stage, by name
+    :rtype: dict
+    """
+    stages = {}
+    params = ["-time:all"]
+    dest_dir = os.path.join(work_dir, "dest")
+    files = list(sortphotos.iter_all_files(src_dir, recursive=True))
+
+    def report(name, result):
+        stages[name] = result
+        _log(
+            "{:<16} {:>10.4f} s {:>12.1f} items/s".format(
+                name, result["seconds"]["min"], result["items_per_second"] or 0
+            )
+        )
+
+    report(
+        "walk",
+        measure(
+            lambda _: sum(1 for _ in sortphotos.iter_all_files(src_dir, recursive=True, threads=args.walk_threads)),
+            args.repeat,
+        ),
+    )
+
+    metadata = []
+
+    def extract(reader):
+        def run(_):
+            with sortphotos.ExifToolPool(jobs=args.jobs, params=params, reader=reader) as pool:
+                metadata[:] = sortphotos.extract_metadata(files, pool)
+            return len(metadata)
+
+        return run
+
+    report("extract_native", measure(extract(sortphotos.make_native_reader()), args.repeat))
+    if exiftool_version is not None:
+        report("extract_exiftool", measure(extract(None), args.repeat))
+
+    chosen = []
+
+    def choose(_):
+        chosen[:] = [sortphotos.get_oldest_timestamp(data, ["File"], []) for data in metadata]
+        return len(chosen)
+
+    report("timestamp", measure(choose, args.repeat))
+
+    placements = []
+
+    def place(_):
+        # the naming steps of the placement loop in sortPhotos, without any reads of the files or the destination
+        directories = sortphotos.DestinationDirectories(dest_dir, args.sort, create=False)
+        names = sortphotos.DestinationNames()
+        placements.clear()
+        for src_file, date, _ in chosen:
+            if not date:
+                continue
+            filename = os.path.basename(src_file)
+            if args.rename is not None:
+                filename = date.strftime(args.rename) + os.path.splitext(filename)[1].lower()
+            dest_file = os.path.join(directories.directory_for(date), filename)
+            if names.exists(dest_file):
+                dest_file = names.next_free(*os.path.splitext(dest_file))
+            names.add(dest_file)
+            placements.append((src_file, dest_file))
+        return len(placements)
+
+    report("collisions", measure(place, args.repeat))
+
+    def find_duplicates(_):
+        index_path = os.path.join(work_dir, "no-such-directory", "duplicates.sqlite")
+        with duplicate_index.DuplicateIndex(index_path, persist=False) as index:
+            for f in files:
+                if index.find_duplicate(f) is None:
+                    index.add(f)
+        return len(files)
+
+    report("duplicates", measure(find_duplicates, args.repeat))
+
+    def empty_destination():
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        directories = sortphotos.DestinationDirectories(dest_dir, None)
+        directories.create_all(os.path.dirname(dest_file) for _, dest_file in placements)
+
+    def copy_into_place(_):
+        with transfer.TransferExecutor(args.io_jobs) as transfers:
+            for src_file, dest_file in placements:
+                transfers.submit(src_file, dest_file, True)
+        return len(placements)
+
+    report("transfer_copy", measure(copy_into_place, args.repeat, setup=empty_destination))
+
+    staging_dir = os.path.join(work_dir, "staging")
+
+    def stage_sources():
+        # a copy of the library on the same file system as the destination, so that moves are renames
+        empty_destination()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        shutil.copytree(src_dir, staging_dir)
+        return [(os.path.join(staging_dir, os.path.relpath(s, src_dir)), d) for s, d in placements]
+
+    def move_into_place(staged):
+        with transfer.TransferExecutor(args.io_jobs) as transfers:
+            for src_file, dest_file in staged:
+                transfers.submit(src_file, dest_file, False)
+        return len(staged)
+
+    report("transfer_move", measure(move_into_place, args.repeat, setup=stage_sources))
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def sort_all(_):
+        # progress bars are written to stderr, which is kept for the results table
+        with contextlib.redirect_stderr(io.StringIO()):
+            sortphotos.sortPhotos(
+                src_dir,
+                dest_dir,
+                args.sort,
+                args.rename,
+                recursive=True,
+                copy_files=True,
+                jobs=args.jobs,
+                use_cache=False,
+                io_jobs=args.io_jobs,
+                walk_threads=args.walk_threads,
+                native=True,
+            )
+        return len(files)
+
+    report("end_to_end", measure(sort_all, args.repeat, setup=lambda: shutil.rmtree(dest_dir, ignore_errors=True)))
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    return stages
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """
+    Logs the change in speed of each stage against an earlier run.
+
+    :param dict results: the results of this run
+    :param dict baseline: the results of the earlier run
+
+    :return: None
+    :rtype: None
+    """
+    if results["corpus"] != baseline.get("corpus"):
+        _log("The libraries of the two runs were generated with different options.")
+    for name, result in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None:
+            continue
+        old, new = before["seconds"]["min"], result["seconds"]["min"]
+        _log(
+            "{:<16} {:>10.4f} s -> {:>10.4f} s  ({:+.1f}%)".format(
+                name, old, new, 100 * (new - old) / old if old else 0
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of sortphotos on a synthetic library")
+    parser.add_argument("--files", type=int, default=1000, help="number of files in the library")
+    parser.add_argument("--depth", type=int, default=2, help="depth of the directory tree")
+    parser.add_argument("--fanout", type=int, default=4, help="sub directories in each directory")
+    parser.add_argument(
+        "--burst-rate", type=float, default=0.2, help="fraction of photos taken in the same second as the one before"
+    )
+    parser.add_argument("--duplicate-rate", type=float, default=0.05, help="fraction of files which are duplicates")
+    parser.add_argument("--video-rate", type=float, default=0.1, help="fraction of files which are videos")
+    parser.add_argument("--photo-size", type=int, default=64 * 1024, help="size of each photo in bytes")
+    parser.add_argument("--video-size", type=int, default=512 * 1024, help="size of each video in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="seed used to generate the library")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times each stage is run (the best is kept)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of metadata workers")
+    parser.add_argument("--io-jobs", type=int, default=1, help="number of files copied or moved at once")
+    parser.add_argument("--walk-threads", type=int, default=1, help="number of threads used to walk the library")
+    parser.add_argument("--sort", type=str, default="%Y/%m-%b", help="destination folder structure")
+    parser.add_argument(
+        "--rename",
+        type=str,
+        default="%Y%m%d-%H%M%S",
+        help="rename format, so that bursts collide (use '' to keep names)",
+    )
+    parser.add_argument(
+        "--work-dir", type=str, default=None, help="where to write the library and destinations (default: a temp dir)"
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the library in --work-dir, and reuse it if it is already there"
+    )
+    parser.add_argument("--no-exiftool", action="store_true", help="skip extraction with ExifTool")
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="write the results to this file (default stdout)"
+    )
+    parser.add_argument("--compare", type=str, default=None, help="results of an earlier run to compare with")
+    args = parser.parse_args()
+    args.rename = args.rename or None
+
+    # the results table goes to stderr through logging; sortphotos itself is kept quiet
+    logging.basicConfig(format="%(message)s", level=logging.WARNING)
+    logging.getLogger().setLevel(logging.CRITICAL)
+    logging.getLogger("benchmark").setLevel(logging.WARNING)
+
+    exiftool_version = None if args.no_exiftool else find_exiftool()
+    with contextlib.ExitStack() as stack:
+        work_dir = args.work_dir
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="sortphotos-benchmark-"))
+        src_dir = os.path.join(work_dir, "library")
+        corpus_file = os.path.join(work_dir, "library.json")
+        corpus_options = dict(
+            files=args.files,
+            depth=args.depth,
+            fanout=args.fanout,
+            burst_rate=args.burst_rate,
+            duplicate_rate=args.duplicate_rate,
+            video_rate=args.video_rate,
+            photo_size=args.photo_size,
+            video_size=args.video_size,
+            seed=args.seed,
+        )
+        corpus = None
+        if args.keep and os.path.exists(corpus_file):
+            with open(corpus_file) as f:
+                corpus = json.load(f)
+            if any(corpus.get(k) != v for k, v in corpus_options.items()):
+                corpus = None
+        if corpus is None:
+            shutil.rmtree(src_dir, ignore_errors=True)
+            _log("Generating a library of {} files in {}".format(args.files, src_dir))
+            corpus = generate_corpus(src_dir, **corpus_options)
+            with open(corpus_file, "w") as f:
+                json.dump(corpus, f)
+
+        stages = run_benchmarks(args, src_dir, work_dir, exiftool_version)
+        if args.work_dir is not None and not args.keep:
+            shutil.rmtree(src_dir, ignore_errors=True)
+            os.unlink(corpus_file)
+
+    results = {
+        "benchmark_version": BENCHMARK_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "exiftool": exiftool_version,
+        "options": {
+            "repeat": args.repeat,
+            "jobs": args.jobs,
+            "io_jobs": args.io_jobs,
+            "walk_threads": args.walk_threads,
+            "sort": args.sort,
+            "rename": args.rename,
+        },
+        "corpus": corpus,
+        "stages": stages,
+    }
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Benchmarks how long the sortphotos command takes to start, which matters when it is run for every single upload.
+
+Each command is run in a fresh interpreter a number of times, and the best and median times are kept:
+
+- interpreter: python doing nothing, the floor for everything else
+- version: the sortphotos command printing its version, which should cost little more than the interpreter
+- import: importing sortphotos, as is done before any files are sorted
+- help: the sortphotos command printing its help, which builds the whole command line
+
+The slowest imports of sortphotos (from python -X importtime) are listed too, to show what to look at if it gets
+slower.  The sources are compiled first, so that every run reads the same bytecode.  The results are written as JSON,
+and can be compared with an earlier run with --compare, which fails if any command is more than --max-slowdown percent
+slower.
+
+    python benchmarks/benchmark_startup.py --output before.json
+    python benchmarks/benchmark_startup.py --compare before.json
+"""
+
+import argparse
+import compileall
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARK_VERSION = 1
+
+COMMANDS = {
+    "interpreter": "pass",
+    "version": "from src.cli import main; main(['--version'])",
+    "import": "import src.sortphotos",
+    "help": "from src.cli import main; main(['--help'])",
+}
+
+
+def _log(message: str) -> None:
+    """log a progress message or result of the benchmark"""
+    logging.getLogger("benchmark").warning(message)
+
+
+def time_command(code: str, repeat: int) -> dict:
+    """
+    Runs python -c code in a fresh interpreter repeat times.
+
+    :param str code: the Python code to run
+    :param int repeat: the number of times to run it
+
+    :return: the times taken (in seconds)
+    :rtype: dict
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+        )
+        times.append(time.perf_counter() - start)
+    return {
+        "repeat": repeat,
+        "seconds": {
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "max": max(times),
+        },
+    }
+
+
+def slowest_imports(count: int) -> list:
+    """
+    Finds the modules which take longest to import (including what they import) when sortphotos is imported.
+
+    :param int count: the number of modules to list
+
+    :return: a list of [module, seconds] pairs, slowest first
+    :rtype: list
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", COMMANDS["import"]],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    # each line is "import time: self [us] | cumulative | imported package", indented by two spaces for each level of
+    # nesting, with the modules a module imports listed before it
+    children = []
+    for line in result.stderr.decode().splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        _, cumulative, module = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 0:
+            if module.strip() == "src.sortphotos":
+                break
+            children = []
+        elif depth == 1:
+            # only the modules imported by sortphotos directly, as the times of nested imports are already included
+            children.append([module.strip(), int(cumulative) / 1e6])
+    children.sort(key=lambda item: item[1], reverse=True)
+    return children[:count]
+
+
+def compare(results: dict, baseline: dict, max_slowdown: float) -> bool:
+    """
+    Logs the change in the best time of each command against an earlier run.
+
+    :param dict results: the results of this run
+    :param dict baseline: the results of the earlier run
+    :param float max_slowdown: the largest slowdown allowed, in percent
+
+    :return: true if no command slowed down by more than max_slowdown
+    :rtype: bool
+    """
+    passed = True
+    for name, result in results["commands"].items():
+        before = baseline.get("commands", {}).get(name)
+        if before is None:
+            continue
+        old, new = before["seconds"]["min"], result["seconds"]["min"]
+        change = 100 * (new - old) / old if old else 0
+        flag = ""
+        if change > max_slowdown:
+            flag = "  slower than allowed"
+            passed = False
+        _log("{:<12} {:>8.1f} ms -> {:>8.1f} ms  ({:+.1f}%){}".format(name, 1000 * old, 1000 * new, change, flag))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the start up time of the sortphotos command")
+    parser.add_argument("--repeat", type=int, default=20, help="number of times each command is run")
+    parser.add_argument("--imports", type=int, default=10, help="number of the slowest imports to list")
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="write the results to this file (default stdout)"
+    )
+    parser.add_argument("--compare", type=str, default=None, help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--max-slowdown",
+        type=float,
+        default=20.0,
+        help="with --compare, exit with an error if any command is more than this percent slower",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(format="%(message)s")
+
+    compileall.compile_dir(os.path.join(ROOT, "src"), quiet=1)
+    commands = {}
+    for name, code in COMMANDS.items():
+        commands[name] = time_command(code, args.repeat)
+        seconds = commands[name]["seconds"]
+        _log("{:<12} {:>8.1f} ms  (median {:.1f} ms)".format(name, 1000 * seconds["min"], 1000 * seconds["median"]))
+    imports = slowest_imports(args.imports)
+    _log("slowest imports of sortphotos:")
+    for module, seconds in imports:
+        _log("  {:<30} {:>8.1f} ms".format(module, 1000 * seconds))
+
+    results = {
+        "benchmark_version": BENCHMARK_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "commands": commands,
+        "slowest_imports": imports,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_slowdown):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import re
+
 from setuptools import setup, find_packages
 
+# the version is kept in the package, where the command can read it without importing anything else
+with open("src/__init__.py") as f:
+    version = re.search(r'__version__ = "(.*)"', f.read()).group(1)
+
 setup(
     name="sortphotos",
-    version="1.0",
+    version=version,
     description="Organizes photos and videos into folders using date/time information ",
     author="Andrew Ning",
     packages=find_packages(),
@@ -13,7 +19,7 @@ setup(
     license="MIT License",
     entry_points={
         "console_scripts": [
-            "sortphotos = src.sortphotos:main",
+            "sortphotos = src.cli:main",
         ]
     },
 )
@@ -0,0 +1,277 @@
+"""
+Catalog of the files sortphotos has placed in a destination tree: where each came from, the date it was sorted by and
+the tags that date was taken from, its size and (where known) its content hash.
+
+The catalog is updated as each transfer finishes.  It lets a run skip files it has already copied into the destination
+with a lookup rather than reading their metadata again, and lets other programs find the files taken between two dates
+without walking the destination.
+"""
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+from datetime import datetime
+
+# bump this when the layout of the table changes, older catalogs are then started again
+SCHEMA_VERSION = 1
+
+# the format of the local (wall clock) dates stored, which sort in date order as text
+LOCAL_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def default_catalog_path(dest_dir: str) -> str:
+    """
+    Gets the location of the catalog for a destination tree.
+
+    :param str dest_dir: the destination directory
+
+    :return: the path to the catalog file
+    :rtype: str
+    """
+    return os.path.join(dest_dir, ".sortphotos", "catalog.sqlite")
+
+
+class Catalog(object):
+    """
+    Keeps a record of each file placed in a destination tree in a SQLite database.
+    """
+
+    def __init__(self, path: str, persist: bool = True):
+        """
+        :param str path: the path to the SQLite database
+        :param bool persist: if false, the catalog is read but never changed on disk (e.g. for test runs)
+        """
+        self.path = path
+        self.persist = persist
+        self._connection = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self) -> None:
+        """
+        Opens (and if required creates) the catalog.
+
+        :return: None
+        :rtype: None
+        """
+        if not self.persist:
+            # changes to the schema are committed as soon as they are made, so work on a copy in memory rather than risk
+            # changing the catalog on disk (and nothing is left behind if there was no catalog)
+            self._connection = sqlite3.connect(":memory:")
+            if os.path.exists(self.path):
+                with contextlib.closing(sqlite3.connect(self.path)) as on_disk:
+                    on_disk.backup(self._connection)
+        else:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._connection = sqlite3.connect(self.path)
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS files")
+            self._connection.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "dest TEXT PRIMARY KEY, source TEXT, source_size INTEGER, source_mtime_ns INTEGER, copied INTEGER, "
+            "date TEXT, local_date TEXT, tags TEXT, size INTEGER, hash TEXT)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_source ON files (source)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_local_date ON files (local_date)")
+
+    def flush(self) -> None:
+        """
+        Saves the changes so far, unless persist is false.
+
+        :return: None
+        :rtype: None
+        """
+        if self.persist:
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Saves (unless persist is false) and closes the catalog.
+
+        :return: None
+        :rtype: None
+        """
+        if self._connection is None:
+            return
+        if self.persist:
+            self._connection.commit()
+        else:
+            self._connection.rollback()
+        self._connection.close()
+        self._connection = None
+
+    def add(
+        self,
+        dest: str,
+        source: str,
+        source_stat: os.stat_result,
+        date,
+        tags: list,
+        copied: bool,
+        content_hash: str = None,
+    ) -> None:
+        """
+        Records a file which has been placed in the destination tree.
+
+        :param str dest: the path of the file in the destination tree
+        :param str source: the file it was copied or moved from
+        :param os.stat_result source_stat: the result of os.stat on source, taken before it was placed
+        :param datetime date: the date the file was sorted by
+        :param list tags: the tags the date was taken from
+        :param bool copied: true if the file was copied, so source is still there
+        :param str content_hash: the BLAKE2 hash of the file's contents (see duplicate_index.hash_file), if known
+
+        :return: None
+        :rtype: None
+        """
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files (dest, source, source_size, source_mtime_ns, copied, date, local_date, tags, "
+            "size, hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(dest),
+                os.path.abspath(source),
+                source_stat.st_size,
+                source_stat.st_mtime_ns,
+                int(copied),
+                date.isoformat(),
+                date.strftime(LOCAL_DATE_FORMAT),
+                json.dumps(list(tags)),
+                source_stat.st_size,
+                content_hash,
+            ),
+        )
+
+    def contains(self, dest: str) -> bool:
+        """
+        Checks if a file in the destination tree has been recorded.
+
+        :param str dest: the path of the file in the destination tree
+
+        :return: true if it is in the catalog
+        :rtype: bool
+        """
+        row = self._connection.execute("SELECT 1 FROM files WHERE dest = ?", (os.path.abspath(dest),)).fetchone()
+        return row is not None
+
+    def already_placed(self, source: str, source_stat: os.stat_result = None) -> str:
+        """
+        Checks if a file has already been copied into the destination tree, and is unchanged since.
+
+        Only copies are found: once a file has been moved, a file at its old path is a different one.
+
+        :param str source: the file to look for
+        :param os.stat_result source_stat: the result of os.stat on source, if already known
+
+        :return: the path of the copy in the destination tree, or None if it hasn't been copied, has changed since, or
+            the copy has gone
+        :rtype: str
+        """
+        source = os.path.abspath(source)
+        rows = self._connection.execute(
+            "SELECT dest, source_size, source_mtime_ns FROM files WHERE source = ? AND copied = 1", (source,)
+        ).fetchall()
+        if not rows:
+            return None
+        try:
+            if source_stat is None:
+                source_stat = os.stat(source)
+        except OSError:
+            return None
+        for dest, size, mtime_ns in rows:
+            if size != source_stat.st_size or mtime_ns != source_stat.st_mtime_ns:
+                continue
+            try:
+                if os.stat(dest).st_size == size:
+                    return dest
+            except OSError:
+                pass
+        return None
+
+    def between(self, start: datetime = None, end: datetime = None):
+        """
+        Finds the files taken between two dates, in date order.  Dates are compared as they are on the camera's clock
+        (the same way files are sorted into folders), so any time zone on start or end is ignored.
+
+        :param datetime start: the earliest date, or None for no limit
+        :param datetime end: the date to stop before, or None for no limit
+
+        :return: a list of dicts for each file, with the keys dest, source, date (an ISO 8601 string, with the time zone
+            if there was one), tags, size and hash (None if it isn't known)
+        :rtype: list
+        """
+        query = "SELECT dest, source, date, tags, size, hash FROM files"
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("local_date >= ?")
+            params.append(start.strftime(LOCAL_DATE_FORMAT))
+        if end is not None:
+            conditions.append("local_date < ?")
+            params.append(end.strftime(LOCAL_DATE_FORMAT))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY local_date, dest"
+        return [
+            {"dest": dest, "source": source, "date": date, "tags": json.loads(tags), "size": size, "hash": content_hash}
+            for dest, source, date, tags, size, content_hash in self._connection.execute(query, params)
+        ]
+
+    def forget_missing(self) -> int:
+        """
+        Removes the files which are no longer in the destination tree (e.g. which have been deleted or moved by hand).
+
+        :return: the number of files removed from the catalog
+        :rtype: int
+        """
+        missing = [
+            (dest,) for (dest,) in self._connection.execute("SELECT dest FROM files") if not os.path.exists(dest)
+        ]
+        self._connection.executemany("DELETE FROM files WHERE dest = ?", missing)
+        logging.info("Removed {} missing files from {}.".format(len(missing), self.path))
+        return len(missing)
+
+
+def main():
+    import argparse
+
+    # setup command line parsing
+    parser = argparse.ArgumentParser(description="Lists the files sortphotos has placed in a directory, by date.")
+    parser.add_argument("dest_dir", type=str, help="destination directory sortphotos was run with")
+    parser.add_argument("--start", type=str, default=None, help="earliest date to list, e.g. 2012-05-17")
+    parser.add_argument("--end", type=str, default=None, help="date to stop before, e.g. 2012-05-18")
+    parser.add_argument("--json", action="store_true", help="print every field of each file as a line of JSON")
+    parser.add_argument(
+        "--forget-missing", action="store_true", help="first remove files which are no longer there from the catalog"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="output logging information", dest="verbose")
+    args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(20)
+    else:
+        logging.getLogger().setLevel(40)
+    path = default_catalog_path(args.dest_dir)
+    if not os.path.exists(path):
+        raise IOError("No catalog exists at {}.".format(path))
+    start = datetime.fromisoformat(args.start) if args.start is not None else None
+    end = datetime.fromisoformat(args.end) if args.end is not None else None
+    with Catalog(path) as catalog:
+        if args.forget_missing:
+            catalog.forget_missing()
+        for entry in catalog.between(start, end):
+            if args.json:
+                print(json.dumps(entry, ensure_ascii=False))
+            else:
+                print(entry["dest"])
+
+
+if __name__ == "__main__":
+    main()
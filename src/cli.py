@@ -0,0 +1,29 @@
+"""
+The sortphotos command.
+
+Only what is needed to read the command line is imported up front, so that --version returns straight away.
+Everything else, including sortphotos itself, is imported once there are files to sort.
+"""
+import sys
+
+try:
+    from . import __version__
+except ImportError:
+    from __init__ import __version__
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv in (["--version"], ["-V"]):
+        print("sortphotos {}".format(__version__))
+        return
+    try:
+        from . import sortphotos
+    except ImportError:
+        import sortphotos
+    sys.argv[1:] = argv
+    sortphotos.main()
+
+
+if __name__ == "__main__":
+    main()
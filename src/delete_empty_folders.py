@@ -1,18 +1,126 @@
 """
 Deletes empty folders in a directory
 """
+import heapq
 import logging
+import os
 import pathlib
 
+# files left behind by file browsers, which can be removed along with a folder holding nothing else
+JUNK_FILES = frozenset({".DS_Store", "Thumbs.db", "desktop.ini"})
 
-def remove_empty_folder(path: pathlib.Path) -> None:
-    for i in path.iterdir():
-        if i.is_dir():
-            remove_empty_folder(i)
-            try:
-                i.rmdir()
-            except IOError:
-                logging.info("Directory at {} is not empty.".format(i))
+
+class _Folder(object):
+    """a folder being visited, with the number of its entries which are still there"""
+
+    def __init__(self, path: str, parent=None):
+        self.path = path
+        self.parent = parent
+        self.subfolders = []
+        self.junk = []
+        self.remaining = 0
+
+
+def _scan(path: str, parent=None, remove_junk: bool = False) -> _Folder:
+    """list a folder's sub folders and count its entries, leaving out junk files if they are to be removed"""
+    folder = _Folder(path, parent)
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folder.subfolders.append(entry.path)
+                elif remove_junk and entry.name in JUNK_FILES:
+                    folder.junk.append(entry.path)
+                    continue
+                folder.remaining += 1
+    except OSError as e:
+        # a folder which can't be read is left alone
+        logging.error("Could not read {}: {}".format(path, e))
+        folder.remaining += 1
+    return folder
+
+
+def _remove(folder: _Folder) -> bool:
+    """remove a folder which holds nothing but junk files"""
+    try:
+        for junk in folder.junk:
+            os.unlink(junk)
+        os.rmdir(folder.path)
+    except OSError as e:
+        logging.info("Directory at {} could not be removed: {}".format(folder.path, e))
+        return False
+    logging.info("Removed {}.".format(folder.path))
+    return True
+
+
+def remove_empty_folder(path: pathlib.Path, remove_junk: bool = False, keep_root: bool = False) -> int:
+    """
+    Removes the empty folders in path, and path itself if it ends up empty.
+
+    Each folder is listed once, and its sub folders visited before it, so a folder is only removed once everything in it
+    has been.
+
+    :param pathlib.Path path: the directory to remove empty folders from
+    :param bool remove_junk: if true, folders holding nothing but junk files (see JUNK_FILES) are removed too, along
+        with the junk files
+    :param bool keep_root: if true, path itself is never removed
+
+    :return: the number of folders removed
+    :rtype: int
+    """
+    removed = 0
+    stack = [_scan(os.fspath(path), remove_junk=remove_junk)]
+    while stack:
+        folder = stack[-1]
+        if folder.subfolders:
+            stack.append(_scan(folder.subfolders.pop(), folder, remove_junk))
+            continue
+        stack.pop()
+        if folder.remaining or (keep_root and folder.parent is None):
+            continue
+        if _remove(folder):
+            removed += 1
+            if folder.parent is not None:
+                folder.parent.remaining -= 1
+    return removed
+
+
+def remove_empty_parents(folders, stop: str, remove_junk: bool = False) -> int:
+    """
+    Removes each of folders if it is empty, and then each of their parents as they become empty, up to (but not
+    including) stop.  After files have been moved out of a tree, this only lists the folders they came from, rather than
+    the whole tree.
+
+    :param folders: the folders to check
+    :param str stop: the folder to stop at, which is never removed.  Folders outside it are ignored
+    :param bool remove_junk: if true, folders holding nothing but junk files (see JUNK_FILES) are removed too, along
+        with the junk files
+
+    :return: the number of folders removed
+    :rtype: int
+    """
+    stop = os.path.abspath(stop)
+    seen = set()
+    pending = []
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        if folder not in seen and folder != stop and os.path.commonpath([folder, stop]) == stop:
+            seen.add(folder)
+            pending.append((-folder.count(os.sep), folder))
+    # deepest first, so that a folder is only checked once any of its sub folders which can go have gone
+    heapq.heapify(pending)
+    removed = 0
+    while pending:
+        _, path = heapq.heappop(pending)
+        folder = _scan(path, remove_junk=remove_junk)
+        if folder.remaining or not _remove(folder):
+            continue
+        removed += 1
+        parent = os.path.dirname(path)
+        if parent not in seen and parent != stop:
+            seen.add(parent)
+            heapq.heappush(pending, (-parent.count(os.sep), parent))
+    return removed
 
 
 def main():
@@ -22,6 +130,12 @@ def main():
     parser = argparse.ArgumentParser(description="Deletes empty folders in a directory.")
     parser.add_argument("src_dir", type=str, help="source directory")
     parser.add_argument("-v", "--verbose", action="store_true", help="output logging information", dest="verbose")
+    parser.add_argument(
+        "--remove-junk",
+        action="store_true",
+        help="also delete folders holding nothing but {}, along with those files".format(", ".join(sorted(JUNK_FILES))),
+    )
+    parser.add_argument("--keep-root", action="store_true", help="never delete src_dir itself, even if it is empty")
     args = parser.parse_args()
     if args.verbose:
         logging.getLogger().setLevel(20)
@@ -30,7 +144,7 @@ def main():
     path = pathlib.Path(args.src_dir)
     if not path.exists():
         raise IOError("Path does not exist at {}.".format(path))
-    remove_empty_folder(path)
+    remove_empty_folder(path, remove_junk=args.remove_junk, keep_root=args.keep_root)
 
 
 if __name__ == "__main__":
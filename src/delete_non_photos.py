@@ -1,11 +1,156 @@
 """
 Deletes files in a directory that is not a photo.
+
+Most files can be told apart from the first few bytes: files starting with the signature of a common image format are
+kept (even if they are damaged), and empty files, text files and files starting with the signature of a common
+non-image format (archives, documents, executables, audio and video) are removed, without either being opened by
+Pillow.  Only the files left over are opened with Pillow, which decides as it always has.  Files are checked on a pool
+of threads.
 """
+import collections
 import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 import pathlib
 
+# the number of bytes read from the start of each file to decide what it is
+HEADER_SIZE = 4096
+
+# the number of files checked by a thread at a time
+BATCH_SIZE = 256
+
+# signatures of formats which Pillow opens
+IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF87a",
+    b"GIF89a",
+    b"II*\x00",  # TIFF, and TIFF based raw files
+    b"MM\x00*",
+    b"8BPS",  # Photoshop
+)
+
+# signatures of formats which Pillow doesn't open
+NON_IMAGE_SIGNATURES = (
+    b"PK\x03\x04",  # zip, and the formats built on it (docx, jar, apk...)
+    b"PK\x05\x06",
+    b"%PDF",
+    b"\x1f\x8b",  # gzip
+    b"BZh",
+    b"\xfd7zXZ\x00",
+    b"7z\xbc\xaf\x27\x1c",
+    b"Rar!\x1a\x07",
+    b"\x7fELF",
+    b"MZ",  # Windows executables
+    b"\xca\xfe\xba\xbe",  # Java classes and Mach-O
+    b"\xcf\xfa\xed\xfe",
+    b"SQLite format 3\x00",
+    b"ID3",  # MP3
+    b"OggS",
+    b"fLaC",
+    b"\x1a\x45\xdf\xa3",  # Matroska and WebM
+    b"FLV\x01",
+    b"wOFF",
+    b"wOF2",
+)
+
+# major brands of ISO media files (in their ftyp box) which are video or audio, rather than HEIF or AVIF images
+VIDEO_BRANDS = (
+    b"isom",
+    b"iso2",
+    b"iso4",
+    b"iso5",
+    b"iso6",
+    b"mp41",
+    b"mp42",
+    b"qt  ",
+    b"M4V ",
+    b"M4A ",
+    b"M4B ",
+    b"3gp4",
+    b"3gp5",
+    b"3gp6",
+    b"3g2a",
+    b"avc1",
+    b"dash",
+    b"f4v ",
+)
+
+# the start of text files which Pillow may still open (PPM, XPM, EPS, FITS and others)
+TEXT_IMAGE_PREFIXES = (
+    b"P0",
+    b"P1",
+    b"P2",
+    b"P3",
+    b"P4",
+    b"P5",
+    b"P6",
+    b"P7",
+    b"Pf",
+    b"Py",
+    b"/* XPM */",
+    b"%!PS",
+    b"SIMPLE",
+    b"BM",
+    b"BLP",
+    b"BUFR",
+    b"ZCZC",
+    b"DDS ",
+    b"GRIB",
+    b"DanM",
+    b"LinS",
+    b"qoif",
+    b"FTEX",
+    b"icns",
+)
+
+# bytes found in text files: printable characters, whitespace and the escape character (anything from 0x80 up is
+# allowed, for UTF-8 and other 8-bit encodings)
+_TEXT_BYTES = bytes({7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x7F)) | set(range(0x80, 0x100)))
+
+# the first line of an IM file, which has a text header of "key: value" lines
+_IM_LINE = re.compile(rb"[A-Za-z][^:\n]*:")
+
+
+def classify_header(header: bytes):
+    """
+    Decides from the start of a file whether it is an image, if that can be done without Pillow.
+
+    :param bytes header: the first HEADER_SIZE bytes of the file (or all of it, if shorter)
+
+    :return: true if the file is an image, false if it is not, or None if it has to be opened with Pillow to tell
+    :rtype: bool
+    """
+    if not header:
+        return False
+    if header.startswith(IMAGE_SIGNATURES):
+        return True
+    if header.startswith(b"RIFF"):
+        if header[8:12] == b"WEBP":
+            return True
+        if header[8:12] in (b"AVI ", b"WAVE"):
+            return False
+        return None
+    if header[4:8] == b"ftyp":
+        return False if header[8:12] in VIDEO_BRANDS else None
+    if header.startswith(NON_IMAGE_SIGNATURES):
+        return False
+    if header.translate(None, _TEXT_BYTES):
+        # binary data of some other format
+        return None
+    if header.startswith(TEXT_IMAGE_PREFIXES) or header.lstrip().startswith(b"#define"):
+        return None
+    first_line = header[:100].split(b"\n", 1)
+    if len(first_line) == 2 and _IM_LINE.match(first_line[0]):
+        return None
+    if b"pixel n8" in header:
+        # an IFUNC (IMT) image
+        return None
+    return False
+
 
 def check_image_with_pil(path: pathlib.Path) -> bool:
     """
@@ -19,31 +164,106 @@ def check_image_with_pil(path: pathlib.Path) -> bool:
     try:
         with Image.open(path) as image:
             pass
+    except Image.DecompressionBombError:
+        # too large for Pillow to decode safely, but an image nonetheless
+        return True
     except IOError:
         return False
     return True
 
 
-def remove_file_if_image(path: pathlib.Path, test: bool = False) -> None:
+def iter_files(path: str):
+    """
+    Yields the path of every file in a directory and its sub directories, without following links to directories.
+
+    :param str path: the directory, or a single file
+
+    :return: a generator of the file paths
+    :rtype: generator
+    """
+    if not os.path.isdir(path):
+        yield path
+        return
+    directories = [path]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    else:
+                        yield entry.path
+        except OSError as e:
+            logging.error("Could not read {}: {}".format(directory, e))
+
+
+def remove_file_if_image(path: pathlib.Path, test: bool = False, jobs: int = 8) -> collections.Counter:
     """
     Removes files in the path recursively, if they are not images.
 
     :param pathlib.Path path: the path to the file or directory
     :param bool test: if true, does not delete the files.
+    :param int jobs: the number of threads checking files
 
-    :return: None
-    :rtype: None
+    :return: the number of files checked ("files"), kept as images ("images"), checked with Pillow ("pillow"), removed
+        (or which would be removed in a test) ("removed", and "removed_bytes") and which could not be checked or
+        removed ("errors")
+    :rtype: collections.Counter
     """
-    if path.is_dir():
-        for file in path.iterdir():
-            remove_file_if_image(file, test=test)
-    else:
-        if not check_image_with_pil(path):
+    summary = collections.Counter()
+    jobs = max(1, int(jobs))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        batch = []
+        for file in iter_files(os.fspath(path)):
+            batch.append(file)
+            if len(batch) >= BATCH_SIZE:
+                pending.append(executor.submit(_remove_batch, batch, test))
+                batch = []
+                # keep a bounded number of batches waiting, so that huge trees aren't all held in memory
+                if len(pending) > 2 * jobs:
+                    summary += pending.popleft().result()
+        if batch:
+            pending.append(executor.submit(_remove_batch, batch, test))
+        while pending:
+            summary += pending.popleft().result()
+    return summary
+
+
+def _remove_batch(files: list, test: bool) -> collections.Counter:
+    """check a batch of files, removing those which aren't images"""
+    summary = collections.Counter()
+    for file in files:
+        summary["files"] += 1
+        try:
+            with open(file, "rb") as f:
+                header = f.read(HEADER_SIZE)
+            is_image = classify_header(header)
+            if is_image is None:
+                summary["pillow"] += 1
+                is_image = check_image_with_pil(file)
+        except Exception as e:
+            logging.error("Could not check {}: {}".format(file, e))
+            summary["errors"] += 1
+            continue
+        if is_image:
+            summary["images"] += 1
+            continue
+        try:
+            size = os.lstat(file).st_size
             if test:
-                logging.info("Would remove {}.".format(path))
+                logging.info("Would remove {}.".format(file))
             else:
-                logging.info("Removing {}.".format(path))
-                path.unlink()
+                logging.info("Removing {}.".format(file))
+                os.unlink(file)
+        except OSError as e:
+            logging.error("Could not remove {}: {}".format(file, e))
+            summary["errors"] += 1
+            continue
+        summary["removed"] += 1
+        summary["removed_bytes"] += size
+    return summary
 
 
 def main():
@@ -54,6 +274,7 @@ def main():
     parser.add_argument("src_dir", type=str, help="source directory")
     parser.add_argument("-t", "--test", action="store_true", help="run a test of the removal", dest="test")
     parser.add_argument("-v", "--verbose", action="store_true", help="output logging information", dest="verbose")
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="number of files to check at once.  default is 8")
     args = parser.parse_args()
     if args.verbose:
         logging.getLogger().setLevel(20)
@@ -62,7 +283,18 @@ def main():
     path = pathlib.Path(args.src_dir)
     if not path.exists():
         raise IOError("Path does not exist at {}.".format(path))
-    remove_file_if_image(path, test=args.test)
+    summary = remove_file_if_image(path, test=args.test, jobs=args.jobs)
+    print(
+        "Checked {} files ({} with Pillow): kept {} images, {} {} others ({:.1f} MB), {} errors.".format(
+            summary["files"],
+            summary["pillow"],
+            summary["images"],
+            "would remove" if args.test else "removed",
+            summary["removed"],
+            summary["removed_bytes"] / 1e6,
+            summary["errors"],
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""
+Groups files by the device they are stored on, and limits how many are read from each device at once.
+
+Reading many files at once from a single SD card or hard disk makes it seek between them and slows every read down,
+while other devices sit idle.  A DeviceLimiter lets each device be read with its own small number of readers, so that
+several devices can be read at full speed together.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+
+
+def device_of(path: str) -> int:
+    """
+    Gets the device a file or directory is stored on.
+
+    :param str path: the path of the file or directory
+
+    :return: the device number (st_dev), or None if path can't be read
+    :rtype: int
+    """
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def group_by_device(paths) -> collections.OrderedDict:
+    """
+    Groups paths by the device they are stored on, keeping the order they were given in.
+
+    :param paths: the paths to group
+
+    :return: the paths on each device, by device number, with the devices in the order they were first seen
+    :rtype: collections.OrderedDict
+    """
+    groups = collections.OrderedDict()
+    for path in paths:
+        groups.setdefault(device_of(path), []).append(path)
+    return groups
+
+
+class DeviceLimiter(object):
+    """
+    Limits the number of readers of each device at once.  Threads wanting to read a device beyond the limit wait for
+    one of its readers to finish.
+
+    The device of each directory is looked up once, so files are not stat'd for it.
+    """
+
+    def __init__(self, per_device: int):
+        """
+        :param int per_device: the most readers of a single device at once
+        """
+        self.per_device = max(1, int(per_device))
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._devices = {}
+
+    def device(self, path: str) -> int:
+        """
+        Gets the device a file is stored on, from the device of its directory.
+
+        :param str path: the path of the file
+
+        :return: the device number, or None if it can't be found
+        :rtype: int
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        dev = self._devices.get(directory)
+        if dev is None:
+            dev = device_of(directory)
+            with self._lock:
+                self._devices[directory] = dev
+        return dev
+
+    @contextlib.contextmanager
+    def reading(self, path: str):
+        """
+        Waits until the device path is on can take another reader, and holds its place while the block runs.
+
+        :param str path: the file to be read (for a batch of files, any one of them)
+        """
+        dev = self.device(path)
+        with self._lock:
+            semaphore = self._semaphores.get(dev)
+            if semaphore is None:
+                semaphore = self._semaphores[dev] = threading.BoundedSemaphore(self.per_device)
+        with semaphore:
+            yield
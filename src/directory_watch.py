@@ -0,0 +1,386 @@
+"""
+Watches a source directory for new files, for running sortphotos continuously rather than sweeping on a schedule.
+
+On Linux inotify is used (through ctypes), elsewhere, or if inotify is not available, the tree is polled.  Either way
+files are only reported once their size and modification time have stopped changing, so files which are still being
+uploaded or copied are left alone until they are complete.
+"""
+import collections
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# file contents are not watched (IN_MODIFY), as files are stat'd until they settle anyway
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct("iIII")
+_READ_SIZE = 64 * 1024
+
+# the most files whose reported versions are remembered; in copy mode files stay in the source and are never removed
+MAX_REPORTED = 100000
+
+
+def _load_libc():
+    """get the C library if it provides inotify, or None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1") or not hasattr(libc, "inotify_add_watch"):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class InotifyBackend(object):
+    """
+    Reports changes to a tree of directories from inotify events, adding a watch for each directory in the tree.
+    """
+
+    def __init__(self, path: str, scan, wanted, libc):
+        """
+        :param str path: the directory to watch
+        :param scan: called with a directory, returns a tuple of the wanted files and sub directories in it
+        :param wanted: called with the path of a file, returns true if it should be reported
+        :param libc: the C library, from _load_libc
+        """
+        self.path = path
+        self.scan = scan
+        self.wanted = wanted
+        self._libc = libc
+        self._fd = None
+        self._directories = {}
+
+    def start(self) -> None:
+        """
+        Starts watching, raising OSError if inotify can't be used.
+
+        :return: None
+        :rtype: None
+        """
+        fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._fd = fd
+        try:
+            self._add_tree(self.path)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """
+        Stops watching.
+
+        :return: None
+        :rtype: None
+        """
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._directories = {}
+
+    def changes(self, timeout: float = None) -> tuple:
+        """
+        Waits for changes.
+
+        :param float timeout: the longest to wait in seconds, or None to wait until there is a change
+
+        :return: a tuple of the files which have been added or changed, and of the files which have been removed
+        :rtype: tuple
+        """
+        changed = []
+        removed = []
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed, removed
+        try:
+            data = os.read(self._fd, _READ_SIZE)
+        except BlockingIOError:
+            return changed, removed
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, pos)
+            name = os.fsdecode(data[pos + _EVENT.size : pos + _EVENT.size + length].rstrip(b"\x00"))
+            pos += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                logging.error("Too many changes to {} at once, searching it again.".format(self.path))
+                changed.extend(self._add_tree(self.path))
+                continue
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                if not mask & IN_ISDIR:
+                    removed.append(path)
+            elif mask & IN_ISDIR:
+                # only follow directories which the walk would search (e.g. not the destination, or hidden ones)
+                if path in self.scan(directory)[1]:
+                    changed.extend(self._add_tree(path))
+            elif self.wanted(path):
+                changed.append(path)
+        return changed, removed
+
+    def _add_tree(self, path: str) -> list:
+        """watch path and every directory below it, returning the files found in them"""
+        files = []
+        pending = collections.deque([path])
+        while pending:
+            directory = pending.popleft()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if directory == path == self.path or err == errno.ENOSPC:
+                    raise OSError(err, "Could not watch {}: {}".format(directory, os.strerror(err)))
+                logging.error("Could not watch {}: {}".format(directory, os.strerror(err)))
+                continue
+            self._directories[wd] = directory
+            dir_files, subdirs = self.scan(directory)
+            files.extend(dir_files)
+            pending.extend(subdirs)
+        return files
+
+
+class PollingBackend(object):
+    """
+    Reports changes to a tree of directories by searching it at a fixed interval and comparing the sizes and
+    modification times of the files found.
+    """
+
+    def __init__(self, path: str, scan, interval: float = 10.0):
+        """
+        :param str path: the directory to watch
+        :param scan: called with a directory, returns a tuple of the wanted files and sub directories in it
+        :param float interval: seconds between searches
+        """
+        self.path = path
+        self.scan = scan
+        self.interval = interval
+        self._files = {}
+        self._next_poll = 0.0
+
+    def start(self) -> None:
+        """
+        Takes the first snapshot of the tree.
+
+        :return: None
+        :rtype: None
+        """
+        self._files = self._snapshot()
+        self._next_poll = time.monotonic() + self.interval
+
+    def close(self) -> None:
+        """
+        Forgets the snapshot.
+
+        :return: None
+        :rtype: None
+        """
+        self._files = {}
+
+    def changes(self, timeout: float = None) -> tuple:
+        """
+        Waits for the next search (or the timeout, if sooner) and compares it with the last one.
+
+        :param float timeout: the longest to wait in seconds, or None to wait for the next search
+
+        :return: a tuple of the files which have been added or changed, and of the files which have been removed
+        :rtype: tuple
+        """
+        wait = self._next_poll - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(max(0.0, timeout))
+            return [], []
+        time.sleep(max(0.0, wait))
+        self._next_poll = time.monotonic() + self.interval
+        files = self._snapshot()
+        changed = [f for f, signature in files.items() if self._files.get(f) != signature]
+        removed = [f for f in self._files if f not in files]
+        self._files = files
+        return changed, removed
+
+    def _snapshot(self) -> dict:
+        """get the size and modification time of every file in the tree"""
+        files = {}
+        pending = collections.deque([self.path])
+        while pending:
+            dir_files, subdirs = self.scan(pending.popleft())
+            pending.extend(subdirs)
+            for f in dir_files:
+                try:
+                    st = os.stat(f)
+                except OSError:
+                    continue
+                files[f] = (st.st_size, st.st_mtime_ns)
+        return files
+
+
+class DirectoryWatcher(object):
+    """
+    Reports files below a directory which are new or have changed, once they have settled: their size and modification
+    time have not changed for a while.  Each version of a file is only reported once.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        scan,
+        wanted,
+        settle: float = 2.0,
+        poll_interval: float = 10.0,
+        use_inotify: bool = True,
+        max_reported: int = MAX_REPORTED,
+    ):
+        """
+        :param str path: the directory to watch
+        :param scan: called with a directory, returns a tuple of the wanted files and sub directories in it (only
+            directories which should be watched, so none if the search is not recursive)
+        :param wanted: called with the path of a file, returns true if it should be reported
+        :param float settle: seconds a file must stay unchanged before it is reported
+        :param float poll_interval: seconds between searches of the tree, if inotify can't be used
+        :param bool use_inotify: false to always poll
+        :param int max_reported: the most files to remember the reported version of.  The least recently reported are
+            forgotten first, and are reported again if the backend reports them as changed
+        """
+        self.path = path
+        self.settle = settle
+        self.max_reported = max_reported
+        libc = _load_libc() if use_inotify else None
+        self._backend = None
+        if libc is not None:
+            self._backend = InotifyBackend(path, scan, wanted, libc)
+        self._polling = PollingBackend(path, scan, poll_interval)
+        self._candidates = {}
+        self._reported = collections.OrderedDict()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self) -> None:
+        """
+        Starts watching, falling back to polling if inotify is not available.
+
+        :return: None
+        :rtype: None
+        """
+        if self._backend is not None:
+            try:
+                self._backend.start()
+                logging.info("Watching {} with inotify.".format(self.path))
+                return
+            except OSError as e:
+                logging.error("Could not use inotify ({}), polling {} instead.".format(e, self.path))
+        self._backend = self._polling
+        self._backend.start()
+        logging.info("Polling {} every {} seconds.".format(self.path, self._polling.interval))
+
+    def close(self) -> None:
+        """
+        Stops watching.
+
+        :return: None
+        :rtype: None
+        """
+        if self._backend is not None:
+            self._backend.close()
+
+    def existing_files(self, files):
+        """
+        Yields the files which have already settled out of files (e.g. the files found when starting), and remembers
+        the rest so they are reported by wait() once they have settled.
+
+        :param files: iterable of file paths
+
+        :return: generator of file paths
+        """
+        for f in files:
+            signature = self._signature(f)
+            if signature is None:
+                continue
+            if time.time() - signature[1] / 1e9 >= self.settle:
+                if self._report(f, signature):
+                    yield f
+            else:
+                self._candidates[f] = (signature, time.monotonic())
+
+    def wait(self) -> list:
+        """
+        Waits until at least one new or changed file has settled.
+
+        :return: the files, in sorted order
+        :rtype: list
+        """
+        while True:
+            timeout = self.settle / 2 if self._candidates else None
+            changed, removed = self._backend.changes(timeout)
+            now = time.monotonic()
+            for f in removed:
+                self._candidates.pop(f, None)
+                self._reported.pop(f, None)
+            for f in changed:
+                signature = self._signature(f)
+                if signature is not None and self._candidates.get(f, (None,))[0] != signature:
+                    self._candidates[f] = (signature, now)
+            ready = self._settled(now)
+            if ready:
+                return ready
+
+    def _settled(self, now: float) -> list:
+        """check each candidate again, returning those which have not changed for the settle time"""
+        ready = []
+        for f, (signature, since) in list(self._candidates.items()):
+            current = self._signature(f)
+            if current is None:
+                del self._candidates[f]
+            elif current != signature:
+                self._candidates[f] = (current, now)
+            elif now - since >= self.settle:
+                del self._candidates[f]
+                if self._report(f, current):
+                    ready.append(f)
+        return sorted(ready)
+
+    def _report(self, path: str, signature: tuple) -> bool:
+        """remember that this version of the file has been reported, returning false if it already had been"""
+        if self._reported.get(path) == signature:
+            return False
+        self._reported[path] = signature
+        self._reported.move_to_end(path)
+        while len(self._reported) > self.max_reported:
+            self._reported.popitem(last=False)
+        return True
+
+    @staticmethod
+    def _signature(path: str) -> tuple:
+        """get the size and modification time of the file, or None if it has gone"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
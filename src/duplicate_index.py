@@ -0,0 +1,346 @@
+"""
+Index of the files in a destination tree by their content, used to find duplicates whatever their name or date folder.
+
+Files are compared by size first, then by a hash of the start of the file, and only then by a hash of the full file.
+Hashes are computed lazily and stored, so most files are only ever stat'd.
+"""
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+
+# bump this when the layout of the table changes, older indexes are then rebuilt
+SCHEMA_VERSION = 1
+
+PARTIAL_HASH_BYTES = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def default_index_path(dest_dir: str) -> str:
+    """
+    Gets the location of the duplicate index for a destination tree.
+
+    :param str dest_dir: the destination directory
+
+    :return: the path to the index file
+    :rtype: str
+    """
+    return os.path.join(dest_dir, ".sortphotos", "duplicates.sqlite")
+
+
+def new_hash():
+    """
+    Starts a hash of the kind hash_file computes, for contents which are read elsewhere (e.g. while being copied).
+
+    :return: the hash object, to update with the contents
+    :rtype: hashlib.blake2b
+    """
+    return hashlib.blake2b(digest_size=20)
+
+
+def hash_file(path: str, limit: int = None) -> str:
+    """
+    Hashes the contents of the file with BLAKE2.
+
+    :param str path: the path to the file
+    :param int limit: if provided, only the first limit bytes are hashed
+
+    :return: the hex digest
+    :rtype: str
+    """
+    digest = new_hash()
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+class DuplicateIndex(object):
+    """
+    Keeps the size and (lazily computed) content hashes of each file in a destination tree in a SQLite database.
+    """
+
+    def __init__(self, path: str, persist: bool = True, rebuild: bool = False):
+        """
+        :param str path: the path to the SQLite database
+        :param bool persist: if false, the index is read but never changed on disk (e.g. for test runs)
+        :param bool rebuild: if true, all existing entries are discarded
+        """
+        self.path = path
+        self.persist = persist
+        self.rebuild = rebuild
+        self.is_new = False
+        self._connection = None
+        self._source_hashes = {}
+        self._in_flight = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self) -> None:
+        """
+        Opens (and if required creates) the index.
+
+        :return: None
+        :rtype: None
+        """
+        if not self.persist:
+            # changes to the schema are committed as soon as they are made, so work on a copy in memory rather than risk
+            # changing the index on disk (and nothing is left behind if there was no index)
+            self._connection = sqlite3.connect(":memory:")
+            if os.path.exists(self.path):
+                with contextlib.closing(sqlite3.connect(self.path)) as on_disk:
+                    on_disk.backup(self._connection)
+        else:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._connection = sqlite3.connect(self.path)
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if self.rebuild or version != SCHEMA_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS files")
+            self._connection.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+            self.is_new = True
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, partial_hash TEXT, full_hash TEXT)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS files_size ON files (size)")
+
+    def flush(self) -> None:
+        """
+        Saves the changes so far, unless persist is false.
+
+        :return: None
+        :rtype: None
+        """
+        if self.persist:
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Saves (unless persist is false) and closes the index.
+
+        :return: None
+        :rtype: None
+        """
+        if self._connection is None:
+            return
+        if self.persist:
+            self._connection.commit()
+        else:
+            self._connection.rollback()
+        self._connection.close()
+        self._connection = None
+
+    def build(self, files) -> None:
+        """
+        Adds every file to the index, recording only the size. Used to index an existing destination tree.
+
+        :param files: iterable of file paths
+
+        :return: None
+        :rtype: None
+        """
+        count = 0
+        for f in files:
+            self.add(f)
+            count += 1
+        logging.info("Indexed {} existing files in {}.".format(count, self.path))
+
+    def add(self, path: str, source: str = None) -> str:
+        """
+        Records a file which has been placed in the destination tree.
+
+        :param str path: the path of the file in the destination tree (or, for test runs, the file that would be placed)
+        :param str source: the file it was copied or moved from; any hashes already computed for it are reused
+
+        :return: the full hash of the file, if it had already been computed, otherwise None
+        :rtype: str
+        """
+        hashes = self._source_hashes.pop(source if source is not None else path, {})
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            if source is None:
+                return None
+            # the transfer is still in progress, so read the source until placed() is called
+            try:
+                st = os.stat(source)
+            except OSError:
+                return None
+            self._in_flight[path] = source
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, partial_hash, full_hash) VALUES (?, ?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, hashes.get("partial"), hashes.get("full")),
+        )
+        return hashes.get("full")
+
+    def placed(self, path: str, full_hash: str = None) -> None:
+        """
+        Marks the transfer of a file previously passed to add() as finished, so it is read from its new location.
+
+        The modification time recorded by add() was the source's, which the destination's file system may have rounded
+        (FAT and exFAT cards, and many network shares, keep only 2 seconds), so the file's own time is recorded instead.
+
+        :param str path: the path of the file in the destination tree
+        :param str full_hash: the hash of the file's full contents, if it was computed while the file was copied
+
+        :return: None
+        :rtype: None
+        """
+        path = os.path.abspath(path)
+        self._in_flight.pop(path, None)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        self._connection.execute("UPDATE files SET mtime_ns = ? WHERE path = ?", (mtime_ns, path))
+        if full_hash is not None:
+            self._connection.execute("UPDATE files SET full_hash = ? WHERE path = ?", (full_hash, path))
+
+    def taken(self, path: str, new_path: str = None) -> None:
+        """
+        Records that a file previously passed to add() could not be placed at path, as another file was found there.
+        The file at path is indexed as it is, and the one passed to add() is moved to new_path, if it is being placed
+        there instead.
+
+        :param str path: the path of the file in the destination tree
+        :param str new_path: where the file is being placed instead, or None if it isn't being placed
+
+        :return: None
+        :rtype: None
+        """
+        path = os.path.abspath(path)
+        source = self._in_flight.pop(path, None)
+        if new_path is not None:
+            new_path = os.path.abspath(new_path)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, partial_hash, full_hash) "
+                "SELECT ?, size, mtime_ns, partial_hash, full_hash FROM files WHERE path = ?",
+                (new_path, path),
+            )
+            if source is not None:
+                self._in_flight[new_path] = source
+        self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.add(path)
+
+    def find_duplicate(self, path: str) -> str:
+        """
+        Looks for a file in the index with exactly the same content.
+
+        :param str path: the file to look for
+
+        :return: the path of the identical file, or None if there is none
+        :rtype: str
+        """
+        size = self._source_hash(path, "size")
+        if size is None:
+            return None
+        rows = self._connection.execute(
+            "SELECT path, mtime_ns, partial_hash, full_hash FROM files WHERE size = ?", (size,)
+        ).fetchall()
+        if not rows:
+            return None
+        partial = self._source_hash(path, "partial")
+        for other, mtime_ns, other_partial, other_full in rows:
+            if self._is_same_path(path, other):
+                continue
+            if other_partial is None:
+                other_partial = self._update_hash(other, size, mtime_ns, "partial")
+            if other_partial is None or other_partial != partial:
+                continue
+            if other_full is None:
+                other_full = self._update_hash(other, size, mtime_ns, "full")
+            if other_full is not None and other_full == self._source_hash(path, "full"):
+                # the file won't be placed, so its hashes are no longer needed
+                self._source_hashes.pop(path, None)
+                return other
+        return None
+
+    def same_content(self, path: str, other: str) -> bool:
+        """
+        Checks if two files have exactly the same content, using the sizes and then the full hashes.
+
+        :param str path: the file being placed
+        :param str other: the existing file
+
+        :return: true if the files are identical
+        :rtype: bool
+        """
+        other = os.path.abspath(other)
+        try:
+            other_size = os.stat(self._readable(other)).st_size
+        except OSError:
+            return False
+        if self._source_hash(path, "size") != other_size:
+            return False
+        row = self._connection.execute(
+            "SELECT mtime_ns, full_hash FROM files WHERE path = ? AND size = ?", (other, other_size)
+        ).fetchone()
+        if row is not None and row[1] is not None:
+            other_full = row[1]
+        elif row is not None:
+            other_full = self._update_hash(other, other_size, row[0], "full")
+        else:
+            other_full = hash_file(self._readable(other))
+        identical = other_full is not None and other_full == self._source_hash(path, "full")
+        if identical:
+            self._source_hashes.pop(path, None)
+        return identical
+
+    def _source_hash(self, path: str, kind: str):
+        """get the size, partial or full hash of a file being placed, computing it at most once"""
+        hashes = self._source_hashes.setdefault(path, {})
+        if kind not in hashes:
+            try:
+                if kind == "size":
+                    hashes[kind] = os.stat(path).st_size
+                elif kind == "partial":
+                    hashes[kind] = hash_file(path, PARTIAL_HASH_BYTES)
+                else:
+                    hashes[kind] = hash_file(path)
+            except OSError:
+                hashes[kind] = None
+        return hashes[kind]
+
+    def _update_hash(self, path: str, size: int, mtime_ns: int, kind: str) -> str:
+        """compute and store the partial or full hash of an indexed file, dropping it if it has gone or changed"""
+        readable = self._readable(path)
+        try:
+            st = os.stat(readable)
+            if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                raise OSError("{} has changed since it was indexed".format(path))
+            value = hash_file(readable, PARTIAL_HASH_BYTES if kind == "partial" else None)
+        except OSError:
+            self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            return None
+        self._connection.execute("UPDATE files SET {}_hash = ? WHERE path = ?".format(kind), (value, path))
+        return value
+
+    def _readable(self, path: str) -> str:
+        """get the path to read the contents of an indexed file from, which is the source while it is in transit"""
+        source = self._in_flight.get(path)
+        if source is not None and os.path.exists(source):
+            return source
+        return path
+
+    @staticmethod
+    def _is_same_path(path: str, other: str) -> bool:
+        """check if both paths refer to the same file, which is not a duplicate of itself"""
+        try:
+            return os.path.samefile(path, other)
+        except OSError:
+            return False
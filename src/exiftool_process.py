@@ -0,0 +1,409 @@
+"""
+Runs ExifTool in -stay_open mode, with a time limit on each file, and works out which file is to blame when a batch
+hangs or ExifTool dies.
+
+ExifTool is asked for -progress, which makes it name each file on stderr as it starts reading it (and flush its
+output as it goes).  A batch is only stopped when a single file has taken longer than the time limit, and the file being
+read at the time is the one reported as failed.  The files read before it are kept, and the rest are passed to a fresh
+ExifTool.  If the file can't be identified the batch is split in half until it can.
+
+Batches are sized by BatchSizer, which learns how long each type of file takes to read and splits the files into
+batches expected to take about the same time, with a limit on the total bytes in each batch.
+"""
+import collections
+import json
+import logging
+import os
+import queue
+import re
+import select
+import subprocess
+import threading
+import time
+
+# added to the metadata of a file that couldn't be read because ExifTool hung or died on it, so that it isn't cached
+FAILED_KEY = "SortPhotos:Failed"
+
+# the line ExifTool writes to stderr (with -progress) as it starts each file
+_PROGRESS = re.compile(rb"^======== (.*) \[(\d+)/(\d+)\]\r?$")
+
+# the time ExifTool is given to exit before it is killed
+_TERMINATE_TIMEOUT = 5.0
+
+
+class _FileFailed(Exception):
+    """raised when ExifTool hangs or dies while reading a batch"""
+
+    def __init__(self, message, index=None, partial=None):
+        """
+        :param str message: what went wrong
+        :param int index: the position in the batch of the file being read at the time, if known
+        :param list partial: the metadata ExifTool had finished writing before it failed
+        """
+        super().__init__(message)
+        self.index = index
+        self.partial = partial or []
+
+
+class ExifToolProcess(object):
+    """
+    A single long-lived ExifTool process, which reads the metadata of a batch of files at a time.
+    """
+
+    def __init__(self, command: list, common_args=("-G", "-n")):
+        """
+        :param list command: the command that runs ExifTool, e.g. ["exiftool"] or ["perl", "/path/to/exiftool"]
+        :param tuple common_args: arguments passed with every batch
+        """
+        self.command = list(command)
+        self.common_args = list(common_args)
+        self.reports_progress = False
+        self._process = None
+        self._output = None
+        self._count = 0
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """
+        Starts ExifTool.
+
+        :return: None
+        :rtype: None
+        """
+        self._process = subprocess.Popen(
+            self.command + ["-stay_open", "True", "-@", "-", "-common_args"] + self.common_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # pipes can be waited on with select except on Windows, where each pipe is read on its own thread instead
+        self._output = None
+        if os.name != "posix":
+            self._output = queue.Queue()
+            for name, pipe in (("stdout", self._process.stdout), ("stderr", self._process.stderr)):
+                reader = threading.Thread(target=self._read_pipe, args=(name, pipe, self._output), daemon=True)
+                reader.start()
+
+    def terminate(self) -> None:
+        """
+        Asks ExifTool to exit, killing it if it doesn't.
+
+        :return: None
+        :rtype: None
+        """
+        if self._process is None:
+            return
+        try:
+            if self._process.poll() is None:
+                self._process.stdin.write(b"-stay_open\nFalse\n")
+                self._process.stdin.flush()
+            self._process.wait(timeout=_TERMINATE_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired):
+            self.kill()
+        self._close_pipes()
+        self._process = None
+
+    def kill(self) -> None:
+        """
+        Kills ExifTool straight away.
+
+        :return: None
+        :rtype: None
+        """
+        if self._process is None:
+            return
+        try:
+            self._process.kill()
+            self._process.wait()
+        except OSError:
+            pass
+        self._close_pipes()
+        self._process = None
+
+    def get_metadata_batch(self, files: list, params: list, file_timeout: float = None) -> list:
+        """
+        Reads the metadata of a batch of files.
+
+        :param list files: the files to read
+        :param list params: the arguments to ExifTool, e.g. the tags to read
+        :param float file_timeout: the most time, in seconds, that ExifTool may spend on a single file, or None for no
+            limit
+
+        :return: a list of dicts of metadata (as from exiftool -j), with the file in "SourceFile".  Files ExifTool
+            doesn't report on (e.g. where none of the requested tags were found) are left out.
+        :rtype: list
+        :raises _FileFailed: if ExifTool takes too long over a file or dies.  The process is killed.
+        """
+        if not self.running:
+            self.start()
+        self._count += 1
+        ready = "{{ready{}}}".format(self._count).encode()
+        args = ["-j", "-progress"] + list(params) + list(files) + ["-execute{}".format(self._count)]
+        self._process.stdin.write(b"\n".join(os.fsencode(a) for a in args) + b"\n")
+        self._process.stdin.flush()
+
+        positions = {os.fsencode(f): i for i, f in enumerate(files)}
+        stdout = bytearray()
+        stderr = bytearray()
+        index = None
+        # until ExifTool shows it reports progress, the limit is on the batch as a whole
+        limit = None
+        if file_timeout is not None:
+            limit = file_timeout if self.reports_progress else file_timeout * max(1, len(files))
+        deadline = time.monotonic() + limit if limit is not None else None
+        # only the end of the output is checked, as with -progress ExifTool writes it in many small pieces
+        while not stdout[-64:].rstrip().endswith(ready):
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            received = self._read_output(timeout)
+            if received is None:
+                self.kill()
+                raise _FileFailed("took longer than {} seconds".format(limit), index, self._partial_results(stdout))
+            name, chunk = received
+            if chunk is None:
+                self.kill()
+                raise _FileFailed("exited while reading", index, self._partial_results(stdout))
+            if name == "stdout":
+                stdout += chunk
+                continue
+            stderr += chunk
+            *lines, rest = stderr.split(b"\n")
+            stderr = bytearray(rest)
+            for line in lines:
+                match = _PROGRESS.match(line)
+                if match is not None:
+                    # a new file has been started, so it gets the full time limit.  The count in the progress line
+                    # skips files which don't exist, so the file is found by its name
+                    index = positions.get(match.group(1), int(match.group(2)) - 1)
+                    self.reports_progress = True
+                    if file_timeout is not None:
+                        limit = file_timeout
+                        deadline = time.monotonic() + limit
+        output = bytes(stdout.rstrip()[: -len(ready)]).strip()
+        if not output:
+            return []
+        try:
+            return json.loads(output.decode("utf-8"))
+        except UnicodeDecodeError:
+            return json.loads(output.decode("latin-1"))
+
+    @staticmethod
+    def _partial_results(stdout: bytearray) -> list:
+        """get the metadata of each file ExifTool had finished writing out when it was stopped"""
+        text = bytes(stdout).decode("utf-8", "replace").lstrip()
+        if not text.startswith("["):
+            return []
+        decoder = json.JSONDecoder()
+        results = []
+        position = 1
+        while True:
+            while position < len(text) and text[position] in ", \r\n\t":
+                position += 1
+            try:
+                data, position = decoder.raw_decode(text, position)
+            except ValueError:
+                return results
+            results.append(data)
+
+    def _read_output(self, timeout: float) -> tuple:
+        """
+        wait up to timeout seconds for output from ExifTool, returning the name of the pipe it came from and what was
+        read (None once the pipe is closed), or None if there was no output in time
+        """
+        if self._output is not None:
+            try:
+                return self._output.get(timeout=timeout)
+            except queue.Empty:
+                return None
+        readable, _, _ = select.select([self._process.stdout, self._process.stderr], [], [], timeout)
+        if not readable:
+            return None
+        pipe = readable[0]
+        chunk = os.read(pipe.fileno(), 65536)
+        return "stdout" if pipe is self._process.stdout else "stderr", chunk or None
+
+    @staticmethod
+    def _read_pipe(name, pipe, output) -> None:
+        """pass everything read from pipe to output, followed by None when it is closed"""
+        try:
+            while True:
+                chunk = os.read(pipe.fileno(), 65536)
+                if not chunk:
+                    break
+                output.put((name, chunk))
+        except (OSError, ValueError):
+            pass
+        output.put((name, None))
+
+    def _close_pipes(self) -> None:
+        """close our ends of the pipes to ExifTool"""
+        for pipe in (self._process.stdin, self._process.stdout, self._process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+def read_isolated(
+    tool: ExifToolProcess, files: list, params: list, file_timeout: float = None, on_failure=None
+) -> list:
+    """
+    Reads the metadata of a batch of files, so that a file ExifTool hangs or dies on only loses that file.
+
+    :param ExifToolProcess tool: the ExifTool to use, which is restarted as required
+    :param list files: the files to read
+    :param list params: the arguments to ExifTool
+    :param float file_timeout: the most time, in seconds, that ExifTool may spend on a single file, or None for no limit
+    :param on_failure: if given, called with each file that couldn't be read and the reason
+
+    :return: the metadata of each file ExifTool reported on, as from ExifToolProcess.get_metadata_batch.  Files that
+        couldn't be read have "ExifTool:Error" (and FAILED_KEY) set.
+    :rtype: list
+    """
+    results = []
+    pending = collections.deque([list(files)])
+    while pending:
+        batch = pending.popleft()
+        if not batch:
+            continue
+        try:
+            results.extend(tool.get_metadata_batch(batch, params, file_timeout))
+            continue
+        except _FileFailed as e:
+            failure = e
+        except ValueError as e:
+            # the output wasn't valid JSON, which doesn't say which file was to blame
+            failure = _FileFailed("gave unreadable output ({})".format(e))
+        if len(batch) == 1:
+            failure.index = 0
+        if failure.index is None:
+            # split the batch in half, until the file to blame can be found
+            middle = len(batch) // 2
+            pending.extendleft([batch[middle:], batch[:middle]])
+            continue
+        # the files before the bad one are kept if ExifTool had written them out, and otherwise read again
+        before = batch[: failure.index]
+        recovered = [data for data in failure.partial if data.get("SourceFile") in set(before)]
+        results.extend(recovered)
+        done = {data["SourceFile"] for data in recovered}
+        bad = batch[failure.index]
+        if on_failure is not None:
+            on_failure(bad, str(failure))
+        results.append({"SourceFile": bad, "ExifTool:Error": "ExifTool {}".format(failure), FAILED_KEY: True})
+        pending.extendleft([batch[failure.index + 1 :], [f for f in before if f not in done]])
+    return results
+
+
+class BatchSizer(object):
+    """
+    Splits files into batches for ExifTool, learning how long each type of file takes to read.
+
+    Each batch is cut when its estimated time reaches target_seconds, its total size reaches max_bytes, or it has
+    max_files files.  After each batch the estimates for the file types in it are moved towards the time it actually
+    took.  All methods can be called from any thread.
+    """
+
+    # the estimated seconds per file for a type that hasn't been seen yet
+    DEFAULT_SECONDS = 0.01
+
+    def __init__(
+        self, target_seconds: float = 2.0, max_bytes: int = 512 * 1024 * 1024, max_files: int = 100, alpha: float = 0.3
+    ):
+        """
+        :param float target_seconds: the time each batch should take
+        :param int max_bytes: the most bytes in a batch (unless a single file is larger)
+        :param int max_files: the most files in a batch
+        :param float alpha: how far each observed batch moves the estimates (0 to 1)
+        """
+        self.target_seconds = target_seconds
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.alpha = alpha
+        self._seconds = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def kind(path: str) -> str:
+        """
+        Gets the type of a file, by its extension.
+
+        :param str path: the path to the file
+
+        :return: the lower case extension
+        :rtype: str
+        """
+        return os.path.splitext(path)[1].lower()
+
+    def estimate(self, path: str) -> float:
+        """
+        Estimates how long ExifTool will take to read a file.
+
+        :param str path: the path to the file
+
+        :return: the estimated time in seconds
+        :rtype: float
+        """
+        with self._lock:
+            return self._seconds.get(self.kind(path), self.DEFAULT_SECONDS)
+
+    def split(self, files: list) -> list:
+        """
+        Splits files into batches, keeping their order.
+
+        :param list files: the files to split
+
+        :return: a list of lists of files
+        :rtype: list
+        """
+        batches = []
+        batch = []
+        seconds = 0.0
+        size = 0
+        for f in files:
+            try:
+                file_size = os.stat(f).st_size
+            except OSError:
+                file_size = 0
+            estimate = self.estimate(f)
+            if batch and (
+                seconds + estimate > self.target_seconds
+                or size + file_size > self.max_bytes
+                or len(batch) >= self.max_files
+            ):
+                batches.append(batch)
+                batch, seconds, size = [], 0.0, 0
+            batch.append(f)
+            seconds += estimate
+            size += file_size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def observe(self, files: list, seconds: float) -> None:
+        """
+        Updates the estimates from the time a batch took.
+
+        The time is shared between the files in proportion to their estimates, and the estimate for each type is moved
+        towards its share.
+
+        :param list files: the files in the batch
+        :param float seconds: the time it took
+
+        :return: None
+        :rtype: None
+        """
+        if not files:
+            return
+        with self._lock:
+            estimates = [self._seconds.get(self.kind(f), self.DEFAULT_SECONDS) for f in files]
+            ratio = seconds / sum(estimates)
+            shares = collections.defaultdict(list)
+            for f, estimate in zip(files, estimates):
+                shares[self.kind(f)].append(estimate * ratio)
+            for kind, kind_shares in shares.items():
+                observed = sum(kind_shares) / len(kind_shares)
+                current = self._seconds.get(kind)
+                self._seconds[kind] = observed if current is None else current + self.alpha * (observed - current)
+                logging.debug("ExifTool takes about {:.3f} seconds per {} file.".format(self._seconds[kind], kind))
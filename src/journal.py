@@ -0,0 +1,275 @@
+"""
+A write-ahead journal of the moves and copies made by a run, so that a run which is killed part way can be resumed.
+
+The journal is a JSON Lines file kept in the destination tree.  The first line is a header, then each transfer is
+recorded with a "start" line (written, and synced to disk, before the transfer begins) and a "done" line once it has
+finished.  A transfer whose destination was taken by another file has a "renamed" line (synced before it is placed
+anywhere else) giving its new destination, or null if it was left where it is.  Syncing every line would cost a disk
+flush per file, so transfers are queued and their start lines synced together, in batches, before any of them are
+begun.  The journal is deleted when a run finishes cleanly.
+"""
+import json
+import os
+import time
+
+JOURNAL_VERSION = 1
+
+SYNC_EVERY = 256
+SYNC_INTERVAL = 1.0
+
+
+def default_journal_path(dest_dir: str) -> str:
+    """
+    Gets the location of the journal for a destination tree.
+
+    :param str dest_dir: the destination directory
+
+    :return: the path to the journal file
+    :rtype: str
+    """
+    return os.path.join(dest_dir, ".sortphotos", "journal.jsonl")
+
+
+def read_journal(path: str) -> tuple:
+    """
+    Reads the journal left by an earlier run.
+
+    :param str path: the path to the journal file
+
+    :return: a tuple of the header (a dict, or None if there is no journal), the transfers which were started but not
+        recorded as done (a dict of start records by destination) and the transfers which finished (a dict of start
+        records by source)
+    :rtype: tuple
+    """
+    if not os.path.exists(path):
+        return None, {}, {}
+    started = {}
+    finished = {}
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            raise IOError("{} is not a sortphotos journal".format(path))
+        if header.get("journal_version") != JOURNAL_VERSION:
+            raise IOError("{} is a journal of an unsupported version ({})".format(path, header.get("journal_version")))
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line may have been cut short by the crash
+                break
+            if record["op"] == "start":
+                started[record["dest"]] = record
+            elif record["op"] == "renamed":
+                start = started.pop(record["dest"], None)
+                if start is not None and record["to"] is not None:
+                    start["dest"] = record["to"]
+                    started[record["to"]] = start
+            elif record["op"] == "done":
+                start = started.pop(record["dest"], None)
+                if start is not None:
+                    finished[start["src"]] = start
+            elif record["op"] == "finished":
+                finished[record["src"]] = record
+    return header, started, finished
+
+
+class JournaledTransfers(object):
+    """
+    Wraps a transfer.TransferExecutor, journalling each transfer before it is begun.
+
+    Has the same submit and drain methods as the executor.  Transfers are held back until their start records
+    have been synced, which happens once SYNC_EVERY transfers are waiting or (checked as each transfer is submitted)
+    the oldest has waited SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self, executor, path: str, copy: bool, finished=None):
+        """
+        :param executor: the transfer.TransferExecutor to run the transfers on
+        :param str path: the path to the journal file
+        :param bool copy: true if files are copied rather than moved
+        :param dict finished: transfers finished by an earlier, interrupted run (start records by source, see
+            read_journal), kept in the journal so that they are still skipped if this run is interrupted too
+        """
+        self.executor = executor
+        self.path = path
+        self.copy = copy
+        self.finished = finished or {}
+        self._file = None
+        self._queued = []
+        self._queued_since = None
+
+    def __enter__(self):
+        self.executor.__enter__()
+        try:
+            self.open()
+        except BaseException:
+            self.executor.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.drain()
+            else:
+                # queued transfers have not begun, and are left for a resumed run to do
+                self._queued = []
+        finally:
+            try:
+                self.executor.__exit__(exc_type, exc_value, traceback)
+            finally:
+                self.close(delete=exc_type is None)
+
+    def open(self) -> None:
+        """
+        Creates the journal, replacing any earlier one.
+
+        :return: None
+        :rtype: None
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._write_header()
+        self.sync()
+
+    def close(self, delete: bool = False) -> None:
+        """
+        Syncs and closes the journal.
+
+        :param bool delete: if true, the journal is deleted, as there is nothing left to resume
+
+        :return: None
+        :rtype: None
+        """
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+        if delete:
+            os.unlink(self.path)
+
+    def submit(self, src: str, dest: str, copy: bool, callback=None, details=None, on_exists=None) -> None:
+        """
+        Records and queues a transfer (see transfer.TransferExecutor.submit).
+
+        :param str src: the file to transfer
+        :param str dest: the path to transfer to
+        :param bool copy: if true, copy rather than move
+        :param callback: called once the transfer has finished, with where the file was placed and its hash if the copy
+            was verified
+        :param dict details: more about the file (e.g. its date and tags), kept in its start record so that a resumed
+            run can still catalog it
+        :param on_exists: called with the destination if another file is found there, returning another to use or None
+
+        :return: None
+        :rtype: None
+        """
+        st = os.stat(src)
+        record = {
+            "op": "start",
+            "src": os.path.abspath(src),
+            "dest": os.path.abspath(dest),
+            "action": "copy" if copy else "move",
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if details:
+            record.update(details)
+        self._write(record)
+        if not self._queued:
+            self._queued_since = time.monotonic()
+        self._queued.append((src, dest, copy, callback, on_exists))
+        if len(self._queued) >= SYNC_EVERY or time.monotonic() - self._queued_since >= SYNC_INTERVAL:
+            self._begin_queued()
+
+    def drain(self) -> None:
+        """
+        Begins any queued transfers and waits for them all to finish.
+
+        :return: None
+        :rtype: None
+        """
+        self._begin_queued()
+        self.executor.drain()
+        self.sync()
+
+    def checkpoint(self) -> None:
+        """
+        Starts the journal again once every transfer has finished, so that it doesn't grow without limit when watching.
+
+        :return: None
+        :rtype: None
+        """
+        self.drain()
+        self.finished = {}
+        self._file.seek(0)
+        self._file.truncate()
+        self._write_header()
+        self.sync()
+
+    def sync(self) -> None:
+        """
+        Writes the journal through to disk.
+
+        :return: None
+        :rtype: None
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _begin_queued(self) -> None:
+        """sync the start records of the queued transfers, then pass them to the executor"""
+        if not self._queued:
+            return
+        self.sync()
+        queued, self._queued = self._queued, []
+        for src, dest, copy, callback, on_exists in queued:
+            self.executor.submit(
+                src, dest, copy, callback=self._finished(callback), on_exists=self._renaming(on_exists)
+            )
+
+    def _finished(self, callback):
+        """get the callback recording that a transfer has finished"""
+
+        def done(dest, content_hash=None):
+            # done records are synced with the next batch; losing them only means the transfer is checked on resume
+            self._write({"op": "done", "dest": os.path.abspath(dest)})
+            if callback is not None:
+                callback(dest, content_hash)
+
+        return done
+
+    def _renaming(self, on_exists):
+        """get the on_exists recording that a transfer was given another destination, before it is placed there"""
+        if on_exists is None:
+            return None
+
+        def renamed(dest):
+            new_dest = on_exists(dest)
+            # a transfer given up on is recorded as renamed to None, so that a resumed run doesn't try it again
+            to = os.path.abspath(new_dest) if new_dest is not None else None
+            self._write({"op": "renamed", "dest": os.path.abspath(dest), "to": to})
+            self.sync()
+            return new_dest
+
+        return renamed
+
+    def _write_header(self) -> None:
+        """write the header, and the sources finished by an earlier run"""
+        header = {
+            "journal_version": JOURNAL_VERSION,
+            "copy": self.copy,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        self._write(header)
+        for src in sorted(self.finished):
+            self._write(dict(self.finished[src], op="finished"))
+
+    def _write(self, record: dict) -> None:
+        """write a single line of the journal"""
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
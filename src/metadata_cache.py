@@ -0,0 +1,216 @@
+"""
+Persistent cache of the time stamp metadata extracted by ExifTool.
+
+Entries are keyed by the absolute path of the file and the ExifTool arguments used to read it, and are only used while
+the size, modification time and inode of the file are unchanged.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+# bump this when the layout of the table changes, older caches are then discarded
+SCHEMA_VERSION = 2
+
+DEFAULT_MAX_ENTRIES = 1000000
+
+
+def default_cache_path() -> str:
+    """
+    Gets the default location of the cache file, following the XDG base directory conventions.
+
+    :return: the path to the cache file
+    :rtype: str
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "sortphotos", "metadata.sqlite")
+
+
+def is_time_tag(key: str) -> bool:
+    """
+    Checks if the tag could hold a time stamp, or records an ExifTool error, and so needs to be kept in the cache.
+
+    :param str key: the tag name, including the group
+
+    :return: true if the tag should be cached
+    :rtype: bool
+    """
+    lower_key = key.lower()
+    return "date" in lower_key or "time" in lower_key or key == "ExifTool:Error"
+
+
+class MetadataCache(object):
+    """
+    Stores the time stamp tags of each file in a SQLite database so that ExifTool does not need to be called again for
+    files which have not changed since the last run.
+    """
+
+    def __init__(
+        self, path: str = None, max_entries: int = DEFAULT_MAX_ENTRIES, rebuild: bool = False, query: str = ""
+    ):
+        """
+        :param str path: the path to the SQLite database, defaults to the user cache directory
+        :param int max_entries: the maximum number of files to remember. The least recently used are evicted first.
+        :param bool rebuild: if true, all existing entries are discarded
+        :param str query: the ExifTool arguments used to extract the tags, as different arguments return different tags
+        """
+        self.path = path if path is not None else default_cache_path()
+        self.query = query
+        self.max_entries = max_entries
+        self.rebuild = rebuild
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pending_puts = []
+        self._pending_touches = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self) -> None:
+        """
+        Opens (and if required creates) the cache database.
+
+        :return: None
+        :rtype: None
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        if self.rebuild or version != SCHEMA_VERSION:
+            if version != 0:
+                logging.info("Rebuilding metadata cache at {}.".format(self.path))
+            self._connection.execute("DROP TABLE IF EXISTS metadata")
+            self._connection.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS metadata (path TEXT, query TEXT, size INTEGER, mtime_ns INTEGER, "
+            "inode INTEGER, tags TEXT, last_used REAL, PRIMARY KEY (path, query))"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS metadata_last_used ON metadata (last_used)")
+        self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Writes any pending entries, evicts old entries and closes the database.
+
+        :return: None
+        :rtype: None
+        """
+        if self._connection is None:
+            return
+        self.flush()
+        self.evict()
+        self._connection.close()
+        self._connection = None
+        logging.info("Metadata cache: {} hits, {} misses.".format(self.hits, self.misses))
+
+    def get(self, path: str, stat_result: os.stat_result = None) -> dict:
+        """
+        Gets the cached metadata for the file, if the file has not changed since it was cached.
+
+        :param str path: the path to the file
+        :param os.stat_result stat_result: the result of os.stat for the file, if already known
+
+        :return: the metadata in the same form as returned from ExifTool, or None if the file is not in the cache
+        :rtype: dict
+        """
+        key = self._file_key(path, stat_result)
+        if key is None:
+            self.misses += 1
+            return None
+        row = self._connection.execute(
+            "SELECT size, mtime_ns, inode, tags FROM metadata WHERE path = ? AND query = ?", (key[0], self.query)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != key[1:]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pending_touches.append((time.time(), key[0], self.query))
+        data = json.loads(row[3])
+        data["SourceFile"] = path
+        return data
+
+    def put(self, path: str, data: dict, stat_result: os.stat_result = None) -> None:
+        """
+        Adds the metadata for the file to the cache. Only tags that could contain time stamps are stored.
+
+        :param str path: the path to the file
+        :param dict data: the metadata from ExifTool
+        :param os.stat_result stat_result: the result of os.stat for the file, if already known
+
+        :return: None
+        :rtype: None
+        """
+        key = self._file_key(path, stat_result)
+        if key is None:
+            return
+        tags = {k: v for k, v in data.items() if is_time_tag(k)}
+        self._pending_puts.append(key + (self.query, json.dumps(tags), time.time()))
+        if len(self._pending_puts) >= 1000:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes any pending changes to the database.
+
+        :return: None
+        :rtype: None
+        """
+        if self._pending_puts:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metadata (path, size, mtime_ns, inode, query, tags, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._pending_puts,
+            )
+            self._pending_puts = []
+        if self._pending_touches:
+            self._connection.executemany(
+                "UPDATE metadata SET last_used = ? WHERE path = ? AND query = ?", self._pending_touches
+            )
+            self._pending_touches = []
+        self._connection.commit()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache holds at most max_entries files.
+
+        :return: None
+        :rtype: None
+        """
+        count = self._connection.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            logging.info("Evicting {} entries from the metadata cache.".format(excess))
+            self._connection.execute(
+                "DELETE FROM metadata WHERE rowid IN (SELECT rowid FROM metadata ORDER BY last_used ASC LIMIT ?)",
+                (excess,),
+            )
+            self._connection.commit()
+
+    @staticmethod
+    def _file_key(path: str, stat_result: os.stat_result = None) -> tuple:
+        """
+        Gets the key identifying this version of the file.
+
+        :param str path: the path to the file
+        :param os.stat_result stat_result: the result of os.stat for the file, if already known
+
+        :return: tuple of the absolute path, size, modification time in ns and inode, or None if the file is missing
+        :rtype: tuple
+        """
+        if stat_result is None:
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                return None
+        return os.path.abspath(path), stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
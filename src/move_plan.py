@@ -0,0 +1,187 @@
+"""
+Reads and writes move plans: the list of moves and copies a run would make, saved so that they can be applied later.
+
+A plan is a JSON Lines file.  The first line is a header with the plan version and the destination directory, and each
+following line is one file, with its source and destination, the date chosen and the tags it came from.  Files which
+were found to be duplicates have no destination, only the identical file they duplicate.
+"""
+import json
+import os
+import time
+
+PLAN_VERSION = 1
+
+# states of a planned entry, as found by entry_state
+PENDING = "pending"
+DONE = "done"
+SKIPPED = "skipped"
+CONFLICT = "conflict"
+MISSING = "missing"
+CHANGED = "changed"
+
+# how far the modification time of a placed file may be from its source's, as file systems like FAT and exFAT (on
+# memory cards) and some network shares only store times to the nearest 2 seconds
+MTIME_TOLERANCE_NS = 2 * 1000 * 1000 * 1000
+
+
+class PlanWriter(object):
+    """
+    Writes a move plan, one entry at a time.
+    """
+
+    def __init__(self, path: str, dest_dir: str, copy: bool):
+        """
+        :param str path: the path of the plan file
+        :param str dest_dir: the destination directory of the run
+        :param bool copy: true if files are to be copied rather than moved
+        """
+        self.path = path
+        self.dest_dir = dest_dir
+        self.copy = copy
+        self.entries = 0
+        self._file = None
+        self._planned = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self) -> None:
+        """
+        Creates the plan file and writes the header.
+
+        :return: None
+        :rtype: None
+        """
+        self._file = open(self.path, "w", encoding="utf-8")
+        header = {
+            "plan_version": PLAN_VERSION,
+            "dest_dir": os.path.abspath(self.dest_dir),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        self._write(header)
+
+    def close(self) -> None:
+        """
+        Closes the plan file.
+
+        :return: None
+        :rtype: None
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def add(self, src: str, dest: str, date, tags: list, duplicate_of: str = None) -> None:
+        """
+        Adds a file to the plan.
+
+        :param str src: the file to move or copy
+        :param str dest: where to put it, or None if it is a duplicate and will be left where it is
+        :param datetime date: the date chosen for the file
+        :param list tags: the tags the date was taken from
+        :param str duplicate_of: the identical file already in the destination (or earlier in the plan), if any
+
+        :return: None
+        :rtype: None
+        """
+        st = os.stat(src)
+        src = os.path.abspath(src)
+        if dest is not None:
+            dest = os.path.abspath(dest)
+            self._planned[src] = dest
+        if duplicate_of is not None:
+            # nothing has been placed yet, so a duplicate of a file planned earlier is a duplicate of where it will go
+            duplicate_of = self._planned.get(os.path.abspath(duplicate_of), duplicate_of)
+        entry = {
+            "src": src,
+            "dest": dest,
+            "action": "skip" if dest is None else ("copy" if self.copy else "move"),
+            "date": date.isoformat() if date is not None else None,
+            "tags": tags,
+            "duplicate_of": duplicate_of,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        self._write(entry)
+        self.entries += 1
+
+    def _write(self, record: dict) -> None:
+        """write a single line of the plan"""
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        self._file.write("\n")
+
+
+def read_plan(path: str) -> tuple:
+    """
+    Opens a move plan.
+
+    :param str path: the path of the plan file
+
+    :return: a tuple of the header (a dict) and a generator of the entries (dicts), read lazily
+    :rtype: tuple
+    """
+    f = open(path, "r", encoding="utf-8")
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        f.close()
+        raise IOError("{} is not a move plan".format(path))
+    if header.get("plan_version") != PLAN_VERSION:
+        f.close()
+        raise IOError("{} is a move plan of an unsupported version ({})".format(path, header.get("plan_version")))
+
+    def entries():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, entries()
+
+
+def entry_state(entry: dict) -> str:
+    """
+    Works out whether a planned entry still needs to be applied, so that applying a plan can be resumed.
+
+    A copied or moved file keeps the size and modification time of the source, so an entry is done if the destination
+    matches the planned source (with its time allowed to be rounded by the destination's file system).  A move is also
+    done if the source has gone and the destination is there.
+
+    :param dict entry: the entry from the plan
+
+    :return: one of PENDING, DONE, SKIPPED (for duplicates), CONFLICT (the destination holds some other file), MISSING
+        (the source has gone) or CHANGED (the source has changed since it was planned)
+    :rtype: str
+    """
+    if entry["action"] == "skip":
+        return SKIPPED
+    signature = (entry["size"], entry["mtime_ns"])
+    src = _signature(entry["src"])
+    dest = _signature(entry["dest"])
+    if dest is not None:
+        if _placed_from(dest, signature) and (src is None or src == signature):
+            return DONE
+        return CONFLICT
+    if src is None:
+        return MISSING
+    if src != signature:
+        return CHANGED
+    return PENDING
+
+
+def _placed_from(dest: tuple, signature: tuple) -> bool:
+    """check if a destination's size and modification time are those of the source, allowing for rounded times"""
+    return dest[0] == signature[0] and abs(dest[1] - signature[1]) <= MTIME_TOLERANCE_NS
+
+
+def _signature(path: str) -> tuple:
+    """get the size and modification time of the file, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
@@ -0,0 +1,391 @@
+"""
+Reads the time stamps of common photo and video formats straight from their headers, without starting ExifTool.
+
+JPEG (the EXIF APP1 segment), TIFF based raw files and ISO base media files (HEIC/HEIF/AVIF through their Exif item,
+MP4/MOV through the mvhd, tkhd and mdhd boxes) are understood.  Files are memory mapped, so only the pages holding the
+headers are read, even when the movie header is at the end of a large video.  Tags are named and formatted as ExifTool
+reports them (run with -G -n), so they can be used in place of its output.
+"""
+import mmap
+import os
+import re
+import struct
+import sys
+from datetime import datetime, timedelta
+
+# seconds from the QuickTime epoch (1904-01-01) to the Unix epoch
+QUICKTIME_EPOCH_OFFSET = (66 * 365 + 17) * 24 * 3600
+
+_EXIF_IFD_POINTER = 0x8769
+_DATE_TIME_ORIGINAL = 0x9003
+_ASCII = 2
+_LONG = 4
+_IFD = 13
+
+# the size of a value of each TIFF format
+_FORMAT_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+_UNSIGNED = {2: ">H", 4: ">I", 8: ">Q"}
+
+# ExifTool reports a malformed DateTimeOriginal differently (e.g. as a number), and it can't be used anyway
+_EXIF_DATE = re.compile(r"\d{4}:\d\d:\d\d \d\d:\d\d:\d\d\Z")
+
+# boxes which ExifTool reads no time stamps from, anything else in a movie means ExifTool may report more tags
+_PLAIN_TOP_LEVEL_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide"}
+_PLAIN_MOVIE_BOXES = {b"mvhd", b"trak", b"iods", b"mvex", b"udta", b"free", b"skip"}
+_PLAIN_TRACK_BOXES = {b"tkhd", b"mdia", b"edts", b"tref", b"udta", b"free", b"skip"}
+_PLAIN_USER_DATA_BOXES = {b"\xa9xyz", b"free", b"skip"}
+
+
+class _UnsupportedFile(Exception):
+    """raised while parsing when a file holds something the native readers can't reproduce ExifTool's output for"""
+
+
+def read_time_tags(path: str) -> tuple:
+    """
+    Reads the time stamp tags of a JPEG, TIFF, HEIC or MP4/MOV file.
+
+    Photos only have EXIF:DateTimeOriginal read, so their tags are incomplete (other segments such as XMP are skipped).
+    Plain movies have every time stamp ExifTool would report read, including the File group.
+
+    :param str path: the path to the file
+
+    :return: a tuple of the tags (as a dict, without SourceFile) and true if they are every time stamp ExifTool would
+        report.  The tags are None if the file is not understood.
+    :rtype: tuple
+    """
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_size < 8:
+                return None, False
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[:2] == b"\xff\xd8":
+                    return _date_time_original(_read_jpeg(buf)), False
+                if buf[:4] in (b"II*\x00", b"MM\x00*"):
+                    return _date_time_original(_read_tiff(buf, 0, len(buf))), False
+                if buf[4:8] in _PLAIN_TOP_LEVEL_BOXES or buf[4:8] == b"meta":
+                    return _read_isobmff(buf, st)
+    except (OSError, ValueError, IndexError, OverflowError, struct.error, _UnsupportedFile):
+        pass
+    return None, False
+
+
+def _date_time_original(value: str) -> dict:
+    """wrap the value of DateTimeOriginal as ExifTool names it"""
+    if value is None or not _EXIF_DATE.match(value):
+        return None
+    return {"EXIF:DateTimeOriginal": value}
+
+
+def _read_jpeg(buf) -> str:
+    """find the EXIF APP1 segment before the image data and read DateTimeOriginal from it"""
+    pos = 2
+    while pos + 4 <= len(buf):
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # markers without a length
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image or start of scan, so there are no more headers
+            return None
+        (length,) = struct.unpack_from(">H", buf, pos + 2)
+        if marker == 0xE1 and buf[pos + 4 : pos + 10] == b"Exif\x00\x00":
+            if not _next_segment_complete(buf, pos + 2 + length):
+                return None
+            return _read_tiff(buf, pos + 10, pos + 2 + length)
+        pos += 2 + length
+    return None
+
+
+def _next_segment_complete(buf, pos: int) -> bool:
+    """check the segment at pos is all there, as ExifTool reads each segment of a JPEG only once it has the next one"""
+    if pos >= len(buf) or buf[pos] != 0xFF:
+        return False
+    # skip any fill bytes
+    while pos < len(buf) and buf[pos] == 0xFF:
+        pos += 1
+    if pos >= len(buf):
+        return False
+    marker = buf[pos]
+    if marker == 0x01 or 0xD0 <= marker <= 0xDA:
+        return True
+    if marker in (0x00, 0x4F, 0x92, 0x93) or 0x30 <= marker <= 0x3F:
+        # markers ExifTool reads differently, which real photos don't have here
+        return False
+    if pos + 3 > len(buf):
+        return False
+    (length,) = struct.unpack_from(">H", buf, pos + 1)
+    return length >= 2 and pos + 1 + length <= len(buf)
+
+
+def _read_tiff(buf, start: int, end: int) -> str:
+    """read DateTimeOriginal from the EXIF IFD of the TIFF structure between start and end"""
+    byte_order = buf[start : start + 2]
+    if byte_order == b"II":
+        endian = "<"
+    elif byte_order == b"MM":
+        endian = ">"
+    else:
+        return None
+    magic, ifd0 = struct.unpack_from(endian + "HI", buf, start + 2)
+    if magic != 42:
+        return None
+    entry = _read_ifd(buf, start, end, ifd0, endian).get(_EXIF_IFD_POINTER)
+    if entry is None:
+        return None
+    entry_type, count, value_pos = entry
+    if entry_type not in (_LONG, _IFD) or count != 1:
+        raise _UnsupportedFile("unusual EXIF IFD pointer")
+    (exif_ifd,) = struct.unpack_from(endian + "I", buf, value_pos)
+    entry = _read_ifd(buf, start, end, exif_ifd, endian).get(_DATE_TIME_ORIGINAL)
+    if entry is None:
+        return None
+    entry_type, count, value_pos = entry
+    if entry_type != _ASCII:
+        return None
+    # ExifTool stops at the first null
+    return buf[value_pos : value_pos + count].split(b"\x00", 1)[0].decode("utf-8", "replace")
+
+
+def _read_ifd(buf, start: int, end: int, offset: int, endian: str) -> dict:
+    """
+    get the type, count and position of the value of each entry of the IFD at offset, checking every entry as ExifTool
+    does, as it reads nothing more from an IFD once an entry's value is missing
+    """
+    ifd = start + offset
+    (count,) = struct.unpack_from(endian + "H", buf, ifd)
+    ifd_end = ifd + 2 + 12 * count
+    if ifd_end > end:
+        raise _UnsupportedFile("truncated IFD")
+    entries = {}
+    for pos in range(ifd + 2, ifd_end, 12):
+        tag, entry_type, entry_count = struct.unpack_from(endian + "HHI", buf, pos)
+        if entry_type not in _FORMAT_SIZES:
+            raise _UnsupportedFile("bad IFD entry format")
+        size = entry_count * _FORMAT_SIZES[entry_type]
+        value_pos = pos + 8
+        if size > 4:
+            (value_offset,) = struct.unpack_from(endian + "I", buf, value_pos)
+            value_pos = start + value_offset
+            # ExifTool also skips values pointing into the TIFF header or the IFD itself
+            if value_offset < 8 or value_pos + size > end or (value_pos < ifd_end and value_pos + size > ifd):
+                raise _UnsupportedFile("bad IFD entry offset")
+        if tag in entries:
+            raise _UnsupportedFile("repeated IFD entry")
+        entries[tag] = (entry_type, entry_count, value_pos)
+    return entries
+
+
+def _boxes(buf, start: int, end: int):
+    """yield the type, start of the contents and end of each ISO base media box between start and end"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", buf, pos + 8)
+            header = 16
+        elif size == 0:
+            # ExifTool stops at a box running to the end of the file (or its parent), and reads nothing from it
+            return
+        if size < header or pos + size > end:
+            raise _UnsupportedFile("truncated {} box".format(box_type))
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def _read_isobmff(buf, st: os.stat_result) -> tuple:
+    """read a HEIC/HEIF file through its Exif item, or a movie through its movie, track and media headers"""
+    top_level = {}
+    for box_type, contents, end in _boxes(buf, 0, len(buf)):
+        if box_type in top_level and box_type in (b"meta", b"moov"):
+            raise _UnsupportedFile("more than one {} box".format(box_type))
+        top_level[box_type] = (contents, end)
+    if b"meta" in top_level:
+        tags = _date_time_original(_read_heif_exif(buf, *top_level[b"meta"]))
+        if tags is not None:
+            return tags, False
+    if b"moov" not in top_level or any(box_type not in _PLAIN_TOP_LEVEL_BOXES for box_type in top_level):
+        return None, False
+    tags = _file_tags(st)
+    tags.update(_read_movie(buf, *top_level[b"moov"]))
+    return tags, True
+
+
+def _read_heif_exif(buf, start: int, end: int) -> str:
+    """find the Exif item of a HEIF file from its item information and locations and read DateTimeOriginal from it"""
+    exif_id = None
+    locations = {}
+    # meta is a full box, so skip the version and flags
+    for box_type, contents, box_end in _boxes(buf, start + 4, end):
+        version = buf[contents]
+        if box_type == b"iinf":
+            first = contents + (6 if version == 0 else 8)
+            for item_type, item, _ in _boxes(buf, first, box_end):
+                item_version = buf[item]
+                if item_type != b"infe" or item_version < 2:
+                    continue
+                if item_version == 2:
+                    item_id, protection = struct.unpack_from(">HH", buf, item + 4)
+                    type_pos = item + 8
+                else:
+                    item_id, protection = struct.unpack_from(">IH", buf, item + 4)
+                    type_pos = item + 10
+                # ExifTool doesn't read protected items
+                if buf[type_pos : type_pos + 4] == b"Exif" and protection == 0:
+                    exif_id = item_id
+        elif box_type == b"iloc":
+            locations = _read_item_locations(buf, contents, version)
+    location = locations.get(exif_id)
+    if location is None:
+        return None
+    item_start, item_end = location
+    # the item starts with the offset to the TIFF header, usually past an "Exif\0\0" prefix
+    (tiff_offset,) = struct.unpack_from(">I", buf, item_start)
+    return _read_tiff(buf, item_start + 4 + tiff_offset, item_end)
+
+
+def _read_item_locations(buf, pos: int, version: int) -> dict:
+    """get the start and end in the file of each item stored there in a single extent, keyed by item id"""
+    sizes = buf[pos + 4]
+    offset_size, length_size = sizes >> 4, sizes & 0x0F
+    sizes = buf[pos + 5]
+    base_offset_size = sizes >> 4
+    index_size = sizes & 0x0F if version in (1, 2) else 0
+    if any(size not in (0, 4, 8) for size in (offset_size, length_size, base_offset_size, index_size)):
+        raise _UnsupportedFile("invalid item location sizes")
+    pos += 6
+
+    def read(size):
+        nonlocal pos
+        value = 0
+        if size:
+            (value,) = struct.unpack_from(_UNSIGNED[size], buf, pos)
+        pos += size
+        return value
+
+    id_size = 2 if version < 2 else 4
+    locations = {}
+    for _ in range(read(id_size)):
+        item_id = read(id_size)
+        # only items held in the file (rather than in an idat box or another file) are supported
+        in_file = version not in (1, 2) or read(2) & 0x0F == 0
+        in_file = read(2) == 0 and in_file  # data reference index
+        base_offset = read(base_offset_size)
+        extents = read(2)
+        for _ in range(extents):
+            read(index_size)
+            extent_offset = read(offset_size)
+            extent_length = read(length_size)
+            # (a length of 0, meaning the rest of the file, isn't read by ExifTool)
+            if extents == 1 and in_file and extent_length:
+                start = base_offset + extent_offset
+                locations[item_id] = (start, start + extent_length)
+    return locations
+
+
+def _read_movie(buf, start: int, end: int) -> dict:
+    """read the dates of the movie header and of the track and media headers, which must be the same in every track"""
+    movie_dates = None
+    track_dates = set()
+    for box_type, contents, box_end in _boxes(buf, start, end):
+        if box_type not in _PLAIN_MOVIE_BOXES:
+            raise _UnsupportedFile("{} box in movie".format(box_type))
+        if box_type == b"mvhd":
+            if movie_dates is not None:
+                raise _UnsupportedFile("more than one movie header")
+            movie_dates = _header_dates(buf, contents, box_end)
+        elif box_type == b"trak":
+            track_dates.add(_read_track(buf, contents, box_end))
+        elif box_type == b"udta":
+            _check_user_data(buf, contents, box_end)
+    if movie_dates is None:
+        raise _UnsupportedFile("no movie header")
+    if len(track_dates) > 1:
+        # ExifTool picks the dates of different tracks for different tags
+        raise _UnsupportedFile("tracks with different dates")
+    tags = {"QuickTime:CreateDate": movie_dates[0], "QuickTime:ModifyDate": movie_dates[1]}
+    if track_dates:
+        track_create, track_modify, media_create, media_modify = track_dates.pop()
+        if track_create is not None:
+            tags["QuickTime:TrackCreateDate"] = track_create
+            tags["QuickTime:TrackModifyDate"] = track_modify
+        if media_create is not None:
+            tags["QuickTime:MediaCreateDate"] = media_create
+            tags["QuickTime:MediaModifyDate"] = media_modify
+    return tags
+
+
+def _read_track(buf, start: int, end: int) -> tuple:
+    """get the create and modify dates from the track header and the media header of a track"""
+    track_dates = (None, None)
+    media_dates = (None, None)
+    for box_type, contents, box_end in _boxes(buf, start, end):
+        if box_type not in _PLAIN_TRACK_BOXES:
+            raise _UnsupportedFile("{} box in track".format(box_type))
+        if box_type == b"tkhd":
+            track_dates = _header_dates(buf, contents, box_end)
+        elif box_type == b"mdia":
+            for media_type, media_contents, media_end in _boxes(buf, contents, box_end):
+                if media_type == b"mdhd":
+                    # ExifTool reads the version of a media header together with its flags
+                    media_dates = _header_dates(buf, media_contents, media_end, version_size=4)
+        elif box_type == b"udta":
+            _check_user_data(buf, contents, box_end)
+    return track_dates + media_dates
+
+
+def _check_user_data(buf, start: int, end: int) -> None:
+    """make sure a user data box holds nothing ExifTool could read a date from"""
+    for box_type, _, _ in _boxes(buf, start, end):
+        if box_type not in _PLAIN_USER_DATA_BOXES:
+            raise _UnsupportedFile("{} box in user data".format(box_type))
+
+
+def _header_dates(buf, pos: int, end: int, version_size: int = 1) -> tuple:
+    """get the creation and modification dates from a movie, track or media header, which are 64 bit unless version 0"""
+    version = buf[pos] if version_size == 1 else struct.unpack_from(">I", buf, pos)[0]
+    date_format = ">QQ" if version else ">II"
+    if pos + 4 + struct.calcsize(date_format) > end:
+        raise _UnsupportedFile("truncated header")
+    created, modified = struct.unpack_from(date_format, buf, pos + 4)
+    return _quicktime_date(created), _quicktime_date(modified)
+
+
+def _quicktime_date(value: int) -> str:
+    """format a QuickTime time stamp (seconds since 1904, in UTC) as ExifTool does"""
+    # like ExifTool, assume that software writing dates before 1970 used the Unix epoch by mistake
+    if value >= QUICKTIME_EPOCH_OFFSET:
+        value -= QUICKTIME_EPOCH_OFFSET
+    if value == 0:
+        return "0000:00:00 00:00:00"
+    return (datetime(1970, 1, 1) + timedelta(seconds=value)).strftime("%Y:%m:%d %H:%M:%S")
+
+
+def _file_tags(st: os.stat_result) -> dict:
+    """get the File group time stamps ExifTool reports from the file system"""
+    if sys.platform == "darwin":
+        # ExifTool may also report the creation date from the Mac file system, which can't be matched here
+        raise _UnsupportedFile("file dates on macOS")
+    change_tag = "File:FileCreateDate" if sys.platform == "win32" else "File:FileInodeChangeDate"
+    return {
+        "File:FileModifyDate": _local_date(st.st_mtime),
+        "File:FileAccessDate": _local_date(st.st_atime),
+        change_tag: _local_date(st.st_ctime),
+    }
+
+
+def _local_date(timestamp: float) -> str:
+    """format a file system time stamp in local time, with the time zone, as ExifTool does"""
+    date = datetime.fromtimestamp(int(timestamp)).astimezone()
+    offset = int(date.utcoffset().total_seconds()) // 60
+    sign = "-" if offset < 0 else "+"
+    return "{}{}{:02d}:{:02d}".format(date.strftime("%Y:%m:%d %H:%M:%S"), sign, abs(offset) // 60, abs(offset) % 60)
@@ -0,0 +1,270 @@
+"""
+Counters and timers for each stage of a run, written as a JSON report at the end and, optionally, as a Prometheus
+textfile (for the node_exporter textfile collector) while the run goes on.
+
+Stages are timed by the time spent in them, summed over all the threads which run them, so a stage's rate is the number
+of items it handled per busy second.  The time of the run as a whole is kept separately.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+# upper bounds (in seconds) of the buckets of the ExifTool batch and transfer latency histograms
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+
+class Histogram(object):
+    """
+    Counts observations in fixed buckets, in the same (cumulative) way as a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param tuple buckets: the upper bound of each bucket, in increasing order, ending with infinity
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Adds an observation.
+
+        :param float value: the value observed
+
+        :return: None
+        :rtype: None
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Gets the number of observations less than or equal to each bucket's upper bound.
+
+        :return: a list of (upper bound, count) tuples
+        :rtype: list
+        """
+        result = []
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class RunStats(object):
+    """
+    Collects the counters, stage timers and latency histograms of a run.  All methods can be called from any thread.
+    """
+
+    def __init__(self, prometheus_file: str = None, prometheus_interval: float = 15.0):
+        """
+        :param str prometheus_file: if given, the metrics are written to this file every prometheus_interval seconds
+            (when maybe_write is called) and at the end of the run
+        :param float prometheus_interval: the least time between writes of the Prometheus file, in seconds
+        """
+        self.prometheus_file = prometheus_file
+        self.prometheus_interval = prometheus_interval
+        self.counters = collections.Counter()
+        self.stage_seconds = collections.Counter()
+        self.stage_items = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._sources = []
+        self._last_write = time.monotonic()
+
+    def count(self, name: str, n: int = 1) -> None:
+        """
+        Adds n to a counter.
+
+        :param str name: the name of the counter
+        :param int n: the amount to add
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self.counters[name] += n
+
+    def add_time(self, stage: str, seconds: float, items: int = 1) -> None:
+        """
+        Records time spent in a stage.
+
+        :param str stage: the name of the stage
+        :param float seconds: the time spent
+        :param int items: the number of items (files, or batches) handled in that time
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_items[stage] += items
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        Adds an observation to a histogram.
+
+        :param str name: the name of the histogram
+        :param float value: the value observed
+
+        :return: None
+        :rtype: None
+        """
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def add_source(self, source) -> None:
+        """
+        Adds counters kept elsewhere (e.g. the hits of the metadata cache), which are read whenever a report is made.
+
+        :param source: called with no arguments, returning a dict of counter values
+
+        :return: None
+        :rtype: None
+        """
+        self._sources.append(source)
+
+    def timed_iter(self, stage: str, iterable):
+        """
+        Yields the items of iterable, recording the time spent producing each one against stage.
+
+        :param str stage: the name of the stage
+        :param iterable: the items, e.g. a generator doing the work of the stage
+
+        :return: a generator of the items
+        :rtype: generator
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start, 0)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def report(self) -> dict:
+        """
+        Gets a summary of the run so far.
+
+        :return: the counters, and the time, items and rate of each stage and of the whole run
+        :rtype: dict
+        """
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            counters = dict(self.counters)
+            for source in self._sources:
+                counters.update(source())
+            stages = {
+                stage: {
+                    "seconds": seconds,
+                    "items": self.stage_items[stage],
+                    "items_per_second": self.stage_items[stage] / seconds if seconds > 0 else None,
+                }
+                for stage, seconds in self.stage_seconds.items()
+            }
+            histograms = {
+                name: {
+                    "count": histogram.count,
+                    "sum": histogram.total,
+                    "buckets": [["+Inf" if bound == float("inf") else bound, n] for bound, n in histogram.cumulative()],
+                }
+                for name, histogram in self.histograms.items()
+            }
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+            "seconds": elapsed,
+            "files_per_second": counters.get("files_found", 0) / elapsed if elapsed > 0 else None,
+            "bytes_per_second": counters.get("bytes_placed", 0) / elapsed if elapsed > 0 else None,
+            "counters": counters,
+            "stages": stages,
+            "histograms": histograms,
+        }
+
+    def write_report(self, path: str) -> None:
+        """
+        Writes the summary of the run as JSON.
+
+        :param str path: the file to write
+
+        :return: None
+        :rtype: None
+        """
+        _write_atomically(path, json.dumps(self.report(), indent=2) + "\n")
+
+    def maybe_write(self) -> None:
+        """
+        Writes the Prometheus file if one was asked for and it was last written more than prometheus_interval seconds ago.
+        Cheap enough to call for every file.
+
+        :return: None
+        :rtype: None
+        """
+        if self.prometheus_file is not None and time.monotonic() - self._last_write >= self.prometheus_interval:
+            self.write_prometheus()
+
+    def write_prometheus(self, path: str = None) -> None:
+        """
+        Writes the metrics in the Prometheus text format.  The file is replaced in one step, as the textfile collector
+        requires.
+
+        :param str path: the file to write, by default prometheus_file
+
+        :return: None
+        :rtype: None
+        """
+        path = path or self.prometheus_file
+        self._last_write = time.monotonic()
+        report = self.report()
+        lines = [
+            "# HELP sortphotos_run_start_timestamp_seconds When the run started.",
+            "# TYPE sortphotos_run_start_timestamp_seconds gauge",
+            "sortphotos_run_start_timestamp_seconds {}".format(self.started),
+            "# HELP sortphotos_run_seconds How long the run has been going.",
+            "# TYPE sortphotos_run_seconds gauge",
+            "sortphotos_run_seconds {}".format(report["seconds"]),
+        ]
+        for name, value in sorted(report["counters"].items()):
+            metric = "sortphotos_{}_total".format(name)
+            lines += ["# TYPE {} counter".format(metric), "{} {}".format(metric, value)]
+        lines += [
+            "# HELP sortphotos_stage_seconds_total Time spent in each stage, summed over threads.",
+            "# TYPE sortphotos_stage_seconds_total counter",
+        ]
+        for stage, result in sorted(report["stages"].items()):
+            lines.append('sortphotos_stage_seconds_total{{stage="{}"}} {}'.format(stage, result["seconds"]))
+        lines += [
+            "# HELP sortphotos_stage_items_total Items handled by each stage.",
+            "# TYPE sortphotos_stage_items_total counter",
+        ]
+        for stage, result in sorted(report["stages"].items()):
+            lines.append('sortphotos_stage_items_total{{stage="{}"}} {}'.format(stage, result["items"]))
+        for name, histogram in sorted(report["histograms"].items()):
+            metric = "sortphotos_{}".format(name)
+            lines.append("# TYPE {} histogram".format(metric))
+            for bound, n in histogram["buckets"]:
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, n))
+            lines += ["{}_sum {}".format(metric, histogram["sum"]), "{}_count {}".format(metric, histogram["count"])]
+        _write_atomically(path, "\n".join(lines) + "\n")
+
+
+def _write_atomically(path: str, text: str) -> None:
+    """write text to path through a temporary file, so that readers never see half of it"""
+    directory, name = os.path.split(os.path.abspath(path))
+    temporary = os.path.join(directory, ".{}.tmp".format(name))
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temporary, path)
@@ -0,0 +1,413 @@
+"""
+A library interface to sortphotos, for programs which sort files as part of a longer running service.
+
+A Sorter keeps ExifTool, the metadata cache and the duplicate index and catalog of each destination open between calls,
+so that sorting a handful of files costs no more than reading them.  Each call takes its own SortOptions and returns a
+sortphotos.SortResult for each file.  Calls can be made directly, or awaited from asyncio:
+
+    with Sorter(jobs=2) as sorter:
+        results = sorter.sort_files(["upload.jpg"], "/photos", SortOptions(copy_files=True))
+
+    async with Sorter() as sorter:
+        results = await sorter.sort_directory_async("/incoming", "/photos")
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from . import catalog, duplicate_index, journal, metadata_cache, run_stats, sortphotos, transfer
+except ImportError:
+    import catalog
+    import duplicate_index
+    import journal
+    import metadata_cache
+    import run_stats
+    import sortphotos
+    import transfer
+
+
+class SortOptions(object):
+    """
+    How the files in a single call to a Sorter are sorted.  The defaults are those of the command line.
+    """
+
+    def __init__(
+        self,
+        sort_format: str = "%Y/%m-%b",
+        rename_format: str = None,
+        copy_files: bool = False,
+        test: bool = False,
+        remove_duplicates: bool = False,
+        day_begins: int = 0,
+        ignore_groups: list = None,
+        ignore_tags: list = None,
+        keep_filename: bool = False,
+        io_jobs: int = 1,
+        resume: bool = False,
+        verify: str = None,
+    ):
+        """
+        :param str sort_format: date format code of the directories files are sorted into, with forward slashes
+            separating sub directories
+        :param str rename_format: if given, the date format code files are renamed with
+        :param bool copy_files: if true, files are copied rather than moved
+        :param bool test: if true, nothing is moved or copied, and the results give where files would have gone
+        :param bool remove_duplicates: if true, files identical to one already in the destination are skipped
+        :param int day_begins: the hour (0-23) the day begins at, so that early morning photos can be grouped with the
+            day before
+        :param list ignore_groups: the tag groups ignored when choosing a date (by default "File")
+        :param list ignore_tags: the tags ignored when choosing a date
+        :param bool keep_filename: if true, a file renamed to avoid a collision keeps its original name as a suffix
+        :param int io_jobs: the number of files moved or copied at once
+        :param bool resume: if true, a run into the destination which was interrupted is finished first, rather than
+            raising an exception
+        :param str verify: transfer.VERIFY_FSYNC or transfer.VERIFY_READBACK to hash each file as it is copied and
+            verify the copy (see transfer.copy_file), or None not to
+        """
+        self.sort_format = sort_format
+        self.rename_format = rename_format
+        self.copy_files = copy_files
+        self.test = test
+        self.remove_duplicates = remove_duplicates
+        self.day_begins = day_begins
+        self.ignore_groups = ["File"] if ignore_groups is None else list(ignore_groups)
+        self.ignore_tags = [] if ignore_tags is None else list(ignore_tags)
+        self.keep_filename = keep_filename
+        self.io_jobs = io_jobs
+        self.resume = resume
+        self.verify = verify
+
+
+class Sorter(object):
+    """
+    Sorts files with ExifTool, the metadata cache, and duplicate indexes and catalogs kept open between calls.
+
+    Calls are run one at a time, in the order they were made, on a thread belonging to the Sorter.  A Sorter can
+    therefore be shared between threads, and awaited without blocking the event loop.  Every transfer has finished
+    when a call returns.  The counters and timings of every call so far are kept in stats (a run_stats.RunStats).
+    """
+
+    def __init__(
+        self,
+        jobs: int = 1,
+        use_only_groups: list = None,
+        use_only_tags: list = None,
+        fast: int = 0,
+        native: bool = True,
+        use_cache: bool = True,
+        cache_file: str = None,
+        cache_size: int = metadata_cache.DEFAULT_MAX_ENTRIES,
+        exiftool_timeout: float = 60.0,
+    ):
+        """
+        :param int jobs: the number of ExifTool processes
+        :param list use_only_groups: if given, only dates in these tag groups are used
+        :param list use_only_tags: if given, only dates in these tags are used
+        :param int fast: 1 or 2 to pass -fast or -fast2 to ExifTool
+        :param bool native: if false, every file is read with ExifTool rather than common formats being read directly
+        :param bool use_cache: if false, the metadata cache isn't used
+        :param str cache_file: the metadata cache to use, by default metadata_cache.default_cache_path()
+        :param int cache_size: the most files the metadata cache remembers
+        :param float exiftool_timeout: the most seconds ExifTool may spend reading a single file, or None for no limit
+        """
+        self.jobs = jobs
+        self.use_only_groups = use_only_groups
+        self.use_only_tags = use_only_tags
+        self.fast = fast
+        self.native = native
+        self.use_cache = use_cache
+        self.cache_file = cache_file
+        self.cache_size = cache_size
+        self.exiftool_timeout = exiftool_timeout
+        self.stats = run_stats.RunStats()
+        self._worker = None
+        self._pool = None
+        self._cache = None
+        self._indexes = {}
+        self._catalogs = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def __aenter__(self):
+        await self._run_async(self._open)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._run_async(self._close)
+        self._shutdown()
+
+    def start(self) -> None:
+        """
+        Starts ExifTool and opens the metadata cache, so that the first call is as quick as the rest.
+
+        :return: None
+        :rtype: None
+        """
+        self._run(self._open)
+
+    def close(self) -> None:
+        """
+        Stops ExifTool, and saves and closes the metadata cache, duplicate indexes and catalogs.
+
+        :return: None
+        :rtype: None
+        """
+        if self._worker is None:
+            return
+        try:
+            self._run(self._close)
+        finally:
+            self._shutdown()
+
+    def sort_files(self, files, dest_dir: str, options: SortOptions = None) -> list:
+        """
+        Sorts files into dest_dir.
+
+        :param files: the paths of the files to sort
+        :param str dest_dir: the directory to sort them into
+        :param SortOptions options: how to sort them, by default SortOptions()
+
+        :return: a sortphotos.SortResult for each file, in the same order (leaving out any which an interrupted run
+            had already placed, if options.resume is set)
+        :rtype: list
+        """
+        return self._run(self._sort, files, dest_dir, options)
+
+    def sort_directory(
+        self,
+        src_dir: str,
+        dest_dir: str,
+        options: SortOptions = None,
+        recursive: bool = False,
+        extensions: list = None,
+        ignore_extensions: list = None,
+    ) -> list:
+        """
+        Sorts the files in src_dir into dest_dir.  Hidden files are skipped, as is dest_dir if it is inside src_dir.
+
+        :param str src_dir: the directory to sort the files of
+        :param str dest_dir: the directory to sort them into
+        :param SortOptions options: how to sort them, by default SortOptions()
+        :param bool recursive: if true, the files in sub directories of src_dir are sorted too
+        :param list extensions: if given, only files with these extensions (case insensitive) are sorted
+        :param list ignore_extensions: files with these extensions (case insensitive) are left where they are
+
+        :return: a sortphotos.SortResult for each file found
+        :rtype: list
+        """
+        return self._run(self._sort_directory, src_dir, dest_dir, options, recursive, extensions, ignore_extensions)
+
+    async def sort_files_async(self, files, dest_dir: str, options: SortOptions = None) -> list:
+        """
+        Sorts files into dest_dir, as sort_files.
+
+        :param files: the paths of the files to sort
+        :param str dest_dir: the directory to sort them into
+        :param SortOptions options: how to sort them, by default SortOptions()
+
+        :return: a sortphotos.SortResult for each file, in the same order
+        :rtype: list
+        """
+        return await self._run_async(self._sort, files, dest_dir, options)
+
+    async def sort_directory_async(
+        self,
+        src_dir: str,
+        dest_dir: str,
+        options: SortOptions = None,
+        recursive: bool = False,
+        extensions: list = None,
+        ignore_extensions: list = None,
+    ) -> list:
+        """
+        Sorts the files in src_dir into dest_dir, as sort_directory.
+
+        :param str src_dir: the directory to sort the files of
+        :param str dest_dir: the directory to sort them into
+        :param SortOptions options: how to sort them, by default SortOptions()
+        :param bool recursive: if true, the files in sub directories of src_dir are sorted too
+        :param list extensions: if given, only files with these extensions (case insensitive) are sorted
+        :param list ignore_extensions: files with these extensions (case insensitive) are left where they are
+
+        :return: a sortphotos.SortResult for each file found
+        :rtype: list
+        """
+        return await self._run_async(
+            self._sort_directory, src_dir, dest_dir, options, recursive, extensions, ignore_extensions
+        )
+
+    def _submit(self, function, *args):
+        """run function on the Sorter's thread, returning a concurrent.futures.Future"""
+        if self._worker is None:
+            # everything is run on the one thread, as the SQLite connections of the cache and indexes can only be used
+            # on the thread which opened them
+            self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sorter")
+        return self._worker.submit(function, *args)
+
+    def _run(self, function, *args):
+        """run function on the Sorter's thread and wait for its result"""
+        return self._submit(function, *args).result()
+
+    async def _run_async(self, function, *args):
+        """run function on the Sorter's thread, without blocking the event loop"""
+        return await asyncio.wrap_future(self._submit(function, *args))
+
+    def _shutdown(self) -> None:
+        """stop the Sorter's thread"""
+        if self._worker is not None:
+            self._worker.shutdown(wait=True)
+            self._worker = None
+
+    def _open(self) -> None:
+        """start ExifTool and open the metadata cache, if they aren't already"""
+        if self._pool is not None:
+            return
+        params = sortphotos.exiftool_params(self.use_only_groups, self.use_only_tags, self.fast)
+        if self.use_cache:
+            self._cache = metadata_cache.MetadataCache(
+                self.cache_file, max_entries=self.cache_size, query=" ".join(params)
+            )
+            self._cache.open()
+            self.stats.add_source(lambda: {"cache_hits": self._cache.hits, "cache_misses": self._cache.misses})
+        reader = sortphotos.make_native_reader(self.use_only_groups, self.use_only_tags) if self.native else None
+        self._pool = sortphotos.ExifToolPool(
+            jobs=self.jobs, params=params, reader=reader, stats=self.stats, file_timeout=self.exiftool_timeout
+        )
+        self._pool.__enter__()
+        self._pool.start_tools()
+
+    def _close(self) -> None:
+        """stop ExifTool, and close the metadata cache, duplicate indexes and catalogs"""
+        try:
+            if self._pool is not None:
+                self._pool.__exit__(None, None, None)
+        finally:
+            self._pool = None
+            indexes, self._indexes = self._indexes, {}
+            catalogs, self._catalogs = self._catalogs, {}
+            for index in list(indexes.values()) + list(catalogs.values()):
+                index.close()
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+    def _duplicate_index(self, dest_dir: str) -> duplicate_index.DuplicateIndex:
+        """get the open duplicate index of dest_dir, opening (and if need be building) it the first time"""
+        key = os.path.abspath(dest_dir)
+        index = self._indexes.get(key)
+        if index is None:
+            index = duplicate_index.DuplicateIndex(duplicate_index.default_index_path(dest_dir))
+            index.open()
+            if index.is_new:
+                index.build(sortphotos.iter_all_files(dest_dir, recursive=True))
+            self._indexes[key] = index
+        return index
+
+    def _catalog(self, dest_dir: str) -> catalog.Catalog:
+        """get the open catalog of dest_dir, opening it the first time"""
+        key = os.path.abspath(dest_dir)
+        dest_catalog = self._catalogs.get(key)
+        if dest_catalog is None:
+            dest_catalog = catalog.Catalog(catalog.default_catalog_path(dest_dir))
+            dest_catalog.open()
+            self._catalogs[key] = dest_catalog
+        return dest_catalog
+
+    def _sort_directory(self, src_dir, dest_dir, options, recursive, extensions, ignore_extensions) -> list:
+        """find the files in src_dir and sort them"""
+        if not os.path.exists(src_dir):
+            raise Exception("Source directory does not exist")
+        files = sortphotos.iter_all_files(
+            src_dir,
+            recursive=recursive,
+            exclude=dest_dir,
+            extensions=extensions,
+            ignore_extensions=ignore_extensions,
+        )
+        return self._sort(files, dest_dir, options)
+
+    def _sort(self, files, dest_dir: str, options: SortOptions = None) -> list:
+        """sort files into dest_dir, on the Sorter's thread"""
+        options = options or SortOptions()
+        self._open()
+        ignore_groups, ignore_tags = options.ignore_groups, options.ignore_tags
+        if self.use_only_tags is not None:
+            ignore_groups, ignore_tags = [], []
+        elif self.use_only_groups is not None:
+            ignore_groups = []
+
+        started, finished = {}, {}
+        if not options.test:
+            os.makedirs(dest_dir, exist_ok=True)
+            started, finished = sortphotos.read_interrupted_run(dest_dir, options.copy_files, options.resume)
+
+        dup_index = None
+        if options.remove_duplicates:
+            if options.test:
+                # a test adds the files it would have placed, so it works on a copy of the saved index in memory
+                dup_index = duplicate_index.DuplicateIndex(duplicate_index.default_index_path(dest_dir), persist=False)
+                dup_index.open()
+                if dup_index.is_new and os.path.exists(dest_dir):
+                    dup_index.build(sortphotos.iter_all_files(dest_dir, recursive=True))
+            else:
+                dup_index = self._duplicate_index(dest_dir)
+        dest_catalog = None if options.test else self._catalog(dest_dir)
+
+        # photos read natively (or cached from a native read) may only have EXIF:DateTimeOriginal, which is no use if
+        # it is ignored, so then every file is read by ExifTool
+        cache = self._cache
+        reader = self._pool.reader
+        if not sortphotos.TimestampSelector(ignore_groups, ignore_tags).prefers_original:
+            cache = None
+            if self.native:
+                self._pool.reader = sortphotos.make_native_reader(
+                    self.use_only_groups, self.use_only_tags, prefers_original=False
+                )
+        try:
+            if started:
+                finished.update(sortphotos.finish_interrupted_transfers(started, options.verify))
+            sortphotos.record_interrupted_transfers(finished, dup_index, dest_catalog)
+
+            transfers = transfer.TransferExecutor(options.io_jobs, stats=self.stats, verify=options.verify)
+            if not options.test:
+                transfers = journal.JournaledTransfers(
+                    transfers, journal.default_journal_path(dest_dir), options.copy_files, finished=finished
+                )
+            results = []
+            with transfers:
+                placer = sortphotos.FilePlacer(
+                    dest_dir,
+                    options.sort_format,
+                    options.rename_format,
+                    copy_files=options.copy_files,
+                    test=options.test,
+                    day_begins=options.day_begins,
+                    ignore_groups=ignore_groups,
+                    ignore_tags=ignore_tags,
+                    keep_filename=options.keep_filename,
+                    transfers=transfers,
+                    dup_index=dup_index,
+                    stats=self.stats,
+                    catalog=dest_catalog,
+                )
+                files = (f for f in files if os.path.abspath(f) not in finished)
+                for data in sortphotos.extract_metadata(files, self._pool, cache):
+                    results.append(placer.place(data))
+        finally:
+            self._pool.reader = reader
+            if options.test and dup_index is not None:
+                dup_index.close()
+            elif dup_index is not None:
+                dup_index.flush()
+            if dest_catalog is not None:
+                dest_catalog.flush()
+            if self._cache is not None:
+                self._cache.flush()
+        return results
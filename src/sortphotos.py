@@ -13,37 +13,124 @@ Updated by Sam Thompson
 from __future__ import print_function
 from __future__ import with_statement
 
+import collections
+import contextlib
+import functools
+import importlib
 import itertools
 import logging
 import math
 import pathlib
+import signal
 import subprocess
 import os
-import sys
 import shutil
-import exiftool
-import pytz
-from tqdm import tqdm
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+from threading import Event, Thread
 
 try:
     import json
 except:
     import simplejson as json
-import filecmp
-from datetime import datetime, timedelta
-from dateutil import parser
+from datetime import datetime, timedelta, timezone
 import re
 import locale
 
-# Setting locale to the 'local' value
-locale.setlocale(locale.LC_ALL, "")
+try:
+    from . import (
+        __version__,
+        delete_empty_folders,
+        devices,
+        duplicate_index,
+        exiftool_process,
+        native_metadata,
+        transfer,
+    )
+except ImportError:
+    from __init__ import __version__
+    import delete_empty_folders
+    import devices
+    import duplicate_index
+    import exiftool_process
+    import native_metadata
+    import transfer
 
 exiftool_location = os.path.join(os.path.dirname(os.path.realpath(__file__)), "Image-ExifTool", "exiftool")
 
 
+def _submodule(name):
+    """import a module of sortphotos when it is first needed (like tqdm), so that it isn't loaded on every start"""
+    if __package__:
+        return importlib.import_module("." + name, __package__)
+    return importlib.import_module(name)
+
+
+@functools.lru_cache(maxsize=None)
+def use_local_locale():
+    """set the locale to the user's (for the names of months and days in folders), once, when files are first sorted"""
+    locale.setlocale(locale.LC_ALL, "")
+
+
+def exiftool_command():
+    """get the command to run ExifTool: the one installed on the PATH, or else the copy bundled with sortphotos"""
+    installed = shutil.which("exiftool")
+    if installed is not None:
+        return [installed]
+    return ["perl", exiftool_location]
+
+
 # -------- convenience methods -------------
 
 
+# the usual form of EXIF dates, which can be parsed without strptime: YYYY:MM:DD HH:MM:SS[Z|+HH:MM|-HH:MM]
+_EXIF_DATE = re.compile(r"(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})(?:(Z)|([+-])(\d{2}):?([0-5]\d))?\Z")
+
+
+def _parse_date_exif_strptime(date_string):
+    """slow path for parse_date_exif, used for anything that is not in the usual form"""
+    output_date_time = None
+    for f in ["%Y:%m:%d %H:%M:%S", "%Y:%m:%d %H:%M:%S%z"]:
+        try:
+            output_date_time = datetime.strptime(date_string, f)
+        except ValueError:
+            pass
+    return output_date_time
+
+
+@functools.lru_cache(maxsize=65536)
+def _parse_date_exif(date_string):
+    """
+    parse_date_exif, but returning None rather than raising if the date cannot be parsed.
+
+    Results are cached, as burst shots and the different tags of a single file often repeat the same string.
+    """
+    match = _EXIF_DATE.match(date_string)
+    try:
+        if match is None:
+            output_date_time = _parse_date_exif_strptime(date_string)
+        else:
+            year, month, day, hour, minute, second, zulu, sign, tz_hours, tz_minutes = match.groups()
+            tzinfo = None
+            if zulu:
+                tzinfo = timezone.utc
+            elif sign:
+                offset = timedelta(hours=int(tz_hours), minutes=int(tz_minutes))
+                tzinfo = timezone(-offset if sign == "-" else offset)
+            output_date_time = datetime(
+                int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=tzinfo
+            )
+    except ValueError:
+        return None
+    if output_date_time is None:
+        return None
+    if output_date_time.tzinfo is None:
+        output_date_time = output_date_time.replace(tzinfo=timezone.utc)
+    return output_date_time
+
+
 def parse_date_exif(date_string):
     """
     extract date info from EXIF data
@@ -52,95 +139,378 @@ def parse_date_exif(date_string):
     or YYYY:MM:DD HH:MM:SS-HH:MM
     or YYYY:MM:DD HH:MM:SSZ
     """
-    # First 19 chars are year/month/day/hour/min/sec
-    output_date_time = None
-    for f in ["%Y:%m:%d %H:%M:%S", "%Y:%m:%d %H:%M:%S%z"]:
-        try:
-            output_date_time = datetime.strptime(date_string, f)
-        except ValueError:
-            pass
+    output_date_time = _parse_date_exif(date_string)
     if output_date_time is None:
         raise ValueError("Could not parse {}.".format(date_string))
-    if output_date_time.tzinfo is None:
-        output_date_time = pytz.utc.localize(output_date_time)
     return output_date_time
 
 
+class TimestampSelector(object):
+    """
+    Picks the oldest time stamp in the metadata of a file, leaving out the groups and tags to ignore.
+
+    Whether each tag is used is only decided the first time it is seen, as the same few dozen tags come up for every
+    file.  EXIF:DateTimeOriginal, if it is used and can be parsed, takes precedence over every other tag.
+    """
+
+    original_key = "EXIF:DateTimeOriginal"
+
+    def __init__(self, ignore_groups=None, ignore_tags=None, print_all_tags=False):
+        self.ignore_groups = frozenset(["ICC_Profile"] + list(ignore_groups or []))
+        self.ignore_tags = frozenset(["SourceFile", "XMP:HistoryWhen"] + list(ignore_tags or []))
+        self.print_all_tags = print_all_tags
+        self._used = {}
+        self.prefers_original = self.uses(self.original_key)
+
+    def uses(self, key):
+        """check if a tag may give the date of a file"""
+        used = self._used.get(key)
+        if used is None:
+            lower = key.lower()
+            used = self._used[key] = (
+                ("date" in lower or "time" in lower)
+                and "gps" not in lower
+                and key not in self.ignore_tags
+                and key.partition(":")[0] not in self.ignore_groups
+            )
+        return used
+
+    def select(self, data):
+        """get the source file, the oldest date (or None if there is none) and the tags it came from"""
+        src_file = data["SourceFile"]
+        if self.prefers_original and self.original_key in data and not self.print_all_tags:
+            date = _parse_date_exif(str(data[self.original_key]))
+            if date is not None:
+                return src_file, date, [self.original_key]
+
+        oldest_date = None
+        oldest_keys = []
+        original_date = None
+        used = self._used
+        for key, value in data.items():
+            if not (used.get(key) or (key not in used and self.uses(key))):
+                continue
+            if self.print_all_tags:
+                logging.info(str(key) + ", " + str(value))
+            # (rare) check if multiple dates returned in a list, take the first one which is the oldest
+            if isinstance(value, list):
+                value = value[0] if value else ""
+            date = _parse_date_exif(value if isinstance(value, str) else str(value))
+            if date is None:
+                continue
+            if key == self.original_key:
+                original_date = date
+            if oldest_date is None or date < oldest_date:
+                oldest_date = date
+                oldest_keys = [key]
+            elif date == oldest_date:
+                oldest_keys.append(key)
+        if original_date is not None:
+            return src_file, original_date, [self.original_key]
+        return src_file, oldest_date, oldest_keys
+
+
+@functools.lru_cache(maxsize=16)
+def _timestamp_selector(ignore_groups, ignore_tags, print_all_tags):
+    """get the selector for a set of groups and tags to ignore, which is kept so its decisions are remembered"""
+    return TimestampSelector(ignore_groups, ignore_tags, print_all_tags)
+
+
 def get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_ignore, print_all_tags=False):
     """data as dictionary from json.  Should contain only time stamps except SourceFile"""
+    selector = _timestamp_selector(
+        tuple(additional_groups_to_ignore or ()), tuple(additional_tags_to_ignore or ()), print_all_tags
+    )
+    return selector.select(data)
+
+
+def _normalise_extensions(extensions):
+    """lower case the extensions and strip any leading dot, so that jpg, .jpg and JPG are all the same"""
+    if extensions is None:
+        return None
+    return {e.lower().lstrip(".") for e in extensions}
+
+
+def _wanted_extension(name, extensions=None, ignore_extensions=None):
+    """check the extension of a file name against the (normalised) extensions to keep and to ignore"""
+    if extensions is None and ignore_extensions is None:
+        return True
+    ext = os.path.splitext(name)[1][1:].lower()
+    if extensions is not None and ext not in extensions:
+        return False
+    return ignore_extensions is None or ext not in ignore_extensions
 
-    # save only the oldest date
-    date_available = False
-    oldest_date = None
-    oldest_keys = []
 
-    # save src file
-    src_file = data["SourceFile"]
+def wanted_file(path, skip_hidden=True, extensions=None, ignore_extensions=None):
+    """check a single file against the same filters as scan_directory, e.g. for files reported while watching"""
+    name = os.path.basename(path)
+    if skip_hidden and name.startswith("."):
+        return False
+    return _wanted_extension(name, _normalise_extensions(extensions), _normalise_extensions(ignore_extensions))
 
-    # ssetup tags to ignore
-    ignore_groups = ["ICC_Profile"] + additional_groups_to_ignore
-    ignore_tags = ["SourceFile", "XMP:HistoryWhen"] + additional_tags_to_ignore
 
-    # First check if the original key is there
-    date_time_original_key = "EXIF:DateTimeOriginal"
+def _directory_keys(paths):
+    """get the set of (st_dev, st_ino) keys for the directories in paths which exist, for scan_directory to exclude"""
+    keys = set()
+    for d in paths:
+        try:
+            st = os.stat(str(d)) if d is not None else None
+        except OSError:
+            st = None
+        if st is not None:
+            keys.add((st.st_dev, st.st_ino))
+    return keys
+
+
+def scan_directory(path, recursive=False, skip_hidden=True, extensions=None, ignore_extensions=None, exclude=None):
+    """
+    Reads a single directory with os.scandir, using the type information of each entry rather than an extra stat call.
+
+    Returns a tuple of the files which pass the filters and the sub directories to search next.  Sub directories are
+    only returned if recursive is True.  exclude is a set of (st_dev, st_ino) keys for directories to skip.
+    """
+    files = []
+    subdirs = []
     try:
-        oldest_date = parse_date_exif(data[date_time_original_key])
-        oldest_keys = [date_time_original_key]
-        date_available = True
-    except (KeyError, ValueError):
-        for key, date in data.items():
-            if "date" in key.lower() or "time" in key.lower():
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        logging.error("Could not read directory {}: {}".format(path, e))
+        return files, subdirs
+    for entry in entries:
+        if skip_hidden and entry.name.startswith("."):
+            continue
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            continue
+        if is_dir:
+            if not recursive:
+                continue
+            if exclude and (entry.is_symlink() or any(entry.inode() == ino for _, ino in exclude)):
                 try:
-                    exifdate = parse_date_exif(str(date))
-                except ValueError:
+                    st = entry.stat()
+                except OSError:
                     continue
-                if oldest_date is None or exifdate < oldest_date:
-                    oldest_date = exifdate
-                    date_available = True
-                    oldest_keys = [key]
-                elif exifdate == oldest_date:
-                    oldest_keys.append(key)
-
-    #
-    #
-    # for key in data.keys():
-    #     # check if this key needs to be ignored, or is in the set of tags that must be used
-    #     if (key not in ignore_tags) and (key.split(':')[0] not in ignore_groups) and 'GPS' not in key:
-    #         date = data[key]
-    #         if print_all_tags:
-    #             logging.info(str(key) + ', ' + str(date))
-    #         # (rare) check if multiple dates returned in a list, take the first one which is the oldest
-    #         if isinstance(date, list):
-    #             date = date[0]
-    #         try:
-    #             # exifdate = parse_date_exif(date)  # check for poor-formed exif data, but allow continuation
-    #             exifdate = parser.parse(str(date))
-    #             if exifdate.tzinfo is None:
-    #                 exifdate = pytz.utc.localize(exifdate)
-    #         except ValueError as e:
-    #             exifdate = None
-    #         if exifdate:
-    #             if oldest_date is None or exifdate < oldest_date:
-    #                 oldest_date = exifdate
-    #                 date_available = True
-    #                 oldest_keys = [key]
-    #             elif exifdate and exifdate == oldest_date:
-    #                 oldest_keys.append(key)
-
-    if not date_available:
-        oldest_date = None
+                if (st.st_dev, st.st_ino) in exclude:
+                    continue
+                if entry.is_symlink():
+                    # guard against symlinks pointing back up the tree
+                    exclude.add((st.st_dev, st.st_ino))
+            subdirs.append(entry.path)
+        elif _wanted_extension(entry.name, extensions, ignore_extensions):
+            files.append(entry.path)
+    return files, subdirs
+
+
+def iter_all_files(
+    path, recursive=False, exclude=None, skip_hidden=True, extensions=None, ignore_extensions=None, threads=1
+):
+    """
+    Yields the files in path as they are found, walking the tree iteratively (breadth first) with os.scandir.
 
-    return src_file, oldest_date, oldest_keys
+    Hidden files and directories, and files with unwanted extensions, are pruned during the walk so they are never
+    passed to ExifTool.  exclude is a directory to skip (e.g. the destination, if it is inside path), or a list of them.
+    With threads > 1
+    sibling directories are read in parallel, which helps on network file systems; the files are still yielded in the
+    same order as a single threaded walk.
+    """
+    extensions = _normalise_extensions(extensions)
+    ignore_extensions = _normalise_extensions(ignore_extensions)
+    excluded_dirs = _directory_keys((list(exclude) if isinstance(exclude, (list, tuple)) else [exclude]) + [path])
+
+    def scan(directory):
+        return scan_directory(directory, recursive, skip_hidden, extensions, ignore_extensions, excluded_dirs)
+
+    pending = collections.deque([str(path)])
+    if threads <= 1:
+        while pending:
+            files, subdirs = scan(pending.popleft())
+            pending.extend(subdirs)
+            yield from files
+        return
+
+    # directories are submitted and collected in the same (first in, first out) order so the output is deterministic
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        in_flight = collections.deque()
+        while pending or in_flight:
+            while pending and len(in_flight) < 4 * threads:
+                in_flight.append(executor.submit(scan, pending.popleft()))
+            files, subdirs = in_flight.popleft().result()
+            pending.extend(subdirs)
+            yield from files
 
 
 def get_all_files(path: pathlib.Path, recursive=False):
-    paths = []
-    for i in path.iterdir():
-        if i.is_dir() and recursive:
-            paths.extend(get_all_files(i, recursive=recursive))
-        else:
-            paths.append(str(i))
-    return paths
+    return list(iter_all_files(path, recursive=recursive))
+
+
+def iter_batches(iterable, size):
+    """yields lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_device_batches(streams, size):
+    """
+    Yields lists of up to size items, taking a batch from each of streams in turn until they are all exhausted.  Each
+    batch comes from a single stream (e.g. the files on one device), and the streams are interleaved so that they are
+    all read together.
+    """
+    iterators = [iter(stream) for stream in streams]
+    while iterators:
+        for iterator in list(iterators):
+            batch = list(itertools.islice(iterator, size))
+            if batch:
+                yield batch
+            else:
+                iterators.remove(iterator)
+
+
+def prefetch(iterable, maxsize=1000):
+    """
+    Runs iterable in a background thread and yields its items.
+
+    The items are passed through a bounded queue, so the background thread can get at most maxsize items ahead.
+    """
+    queue = Queue(maxsize=maxsize)
+    stop = Event()
+    errors = []
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                while True:
+                    if stop.is_set():
+                        return
+                    try:
+                        queue.put(item, timeout=0.1)
+                        break
+                    except Full:
+                        pass
+        except Exception as e:
+            errors.append(e)
+        finally:
+            if not stop.is_set():
+                queue.put(done)
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
+
+
+# the ExifTool family 0 groups which the native readers produce tags for
+_NATIVE_GROUPS = {"exif", "quicktime", "file"}
+
+
+def exiftool_params(use_only_groups=None, use_only_tags=None, fast=0):
+    """
+    Gets the arguments to pass to ExifTool, so that only the time stamp tags (or the tags or groups asked for) are
+    extracted.  -j and -G are always added by the ExifTool wrapper, and files are passed in batches rather than with -r.
+    """
+    if use_only_tags is not None:
+        args = ["-" + t for t in use_only_tags]
+    elif use_only_groups is not None:
+        args = ["-" + g + ":Time:All" for g in use_only_groups]
+    else:
+        args = ["-time:all"]
+
+    # stop reading at the first IFD (-fast) or skip the maker notes and trailers too (-fast2)
+    if fast:
+        args += ["-fast" if fast == 1 else "-fast2"]
+    return args
+
+
+def read_native_metadata(path, wanted=None, prefers_original=True):
+    """
+    Reads the time stamps of path without ExifTool, returning them in the same form as ExifTool, or None if the file
+    needs to be passed to ExifTool.
+
+    The tags are only used if they are enough to pick the same time stamp that ExifTool's output would give: either
+    EXIF:DateTimeOriginal (which takes precedence, unless prefers_original is False because it is being ignored) was
+    found, or every time stamp ExifTool would report was found.  wanted filters the tags to those ExifTool was asked
+    for.
+    """
+    tags, complete = native_metadata.read_time_tags(path)
+    if tags is None:
+        return None
+    if wanted is not None:
+        tags = {key: value for key, value in tags.items() if wanted(key)}
+    if not complete and (not prefers_original or _parse_date_exif(tags.get("EXIF:DateTimeOriginal", "")) is None):
+        return None
+    data = {"SourceFile": path}
+    data.update(tags)
+    return data
+
+
+def make_native_reader(use_only_groups=None, use_only_tags=None, prefers_original=True):
+    """
+    Gets a function reading the metadata of a file without ExifTool, limited to the tags in use_only_tags or groups in
+    use_only_groups, as ExifTool would be.  prefers_original is False if EXIF:DateTimeOriginal is being ignored (see
+    TimestampSelector), so that photos, for which only that tag is read, are passed to ExifTool.
+
+    Returns None if the options can't be matched by the native readers (e.g. family 1 groups such as ExifIFD, or tag
+    names with wildcards), so that every file is passed to ExifTool.
+    """
+    if use_only_tags is not None:
+        specs = [tuple(t.lower().rpartition(":")[::2]) for t in use_only_tags]
+        if any(name in ("", "all") or "*" in name or "?" in name for _, name in specs):
+            return None
+    elif use_only_groups is not None:
+        specs = [(g.lower(), "") for g in use_only_groups]
+    else:
+        return functools.partial(read_native_metadata, prefers_original=prefers_original)
+    if any(group and group not in _NATIVE_GROUPS for group, _ in specs):
+        return None
+
+    def wanted(key):
+        group, _, name = key.lower().partition(":")
+        return any((not g or g == group) and (not n or n == name) for g, n in specs)
+
+    return functools.partial(read_native_metadata, wanted=wanted, prefers_original=prefers_original)
+
+
+def extract_metadata(files, pool, cache=None, batch_size=100, batched=False):
+    """
+    Yields the metadata for each file in files, in the same order.
+
+    Files are taken from files lazily, batch_size at a time, or if batched is True files is already an iterable of
+    batches (lists of files), which are passed to ExifTool as they are.  Files found in the cache are not passed to
+    ExifTool.
+    """
+    pending = collections.deque()
+
+    def batches():
+        for batch in files if batched else iter_batches(files, batch_size):
+            cached = [cache.get(f) if cache is not None else None for f in batch]
+            pending.append((batch, cached))
+            yield [f for f, data in zip(batch, cached) if data is None]
+
+    for results in pool.map_batches(batches()):
+        batch, cached = pending.popleft()
+        by_source = {os.path.normpath(data.get("SourceFile", "")): data for data in results}
+        for f, data in zip(batch, cached):
+            if data is None:
+                # ExifTool leaves out files where none of the requested tags were found
+                data = by_source.get(os.path.normpath(f), {"SourceFile": f})
+                # files ExifTool hung or died on are tried again next time, in case the problem was elsewhere
+                if cache is not None and exiftool_process.FAILED_KEY not in data:
+                    cache.put(f, data)
+            yield data
 
 
 def check_for_early_morning_photos(date, day_begins):
@@ -153,6 +523,550 @@ def check_for_early_morning_photos(date, day_begins):
     return date
 
 
+class DestinationDirectories(object):
+    """
+    Works out the destination directory for each date and creates it, calling mkdir at most once per directory per run.
+
+    A run only touches a few hundred distinct date folders, so both the path for each formatted date and the set of
+    directories known to exist are remembered.
+    """
+
+    def __init__(self, dest_dir, sort_format, create=True):
+        self.dest_dir = dest_dir
+        self.sort_format = sort_format
+        self.create = create
+        self._paths = {}
+        self._existing = set()
+
+    def directory_for(self, date):
+        """get the directory for date, using the sort format, and create it unless create is False"""
+        dir_structure = date.strftime(self.sort_format)
+        path = self._paths.get(dir_structure)
+        if path is None:
+            # forward slashes separate sub directories, independent of the OS convention
+            path = os.path.join(self.dest_dir, *dir_structure.split("/"))
+            self._paths[dir_structure] = path
+        if self.create:
+            self.ensure(path)
+        return path
+
+    def ensure(self, path):
+        """
+        Creates path, and any missing parents, unless it is already known to exist.
+
+        Returns True if the directory was created.  Parents which are already known are not checked again.
+        """
+        if path in self._existing:
+            return False
+        try:
+            os.mkdir(path)
+            created = True
+        except FileExistsError:
+            created = False
+        except FileNotFoundError:
+            self.ensure(os.path.dirname(path))
+            try:
+                os.mkdir(path)
+                created = True
+            except FileExistsError:
+                created = False
+        self._existing.add(path)
+        return created
+
+    def create_all(self, paths):
+        """create every directory in paths up front, e.g. from a planned set of moves"""
+        for path in sorted(set(paths)):
+            self.ensure(path)
+
+
+class DestinationNames(object):
+    """
+    Index of the file names in each destination directory touched during a run, used to resolve name collisions without
+    a stat call per candidate name.  Each directory is read with a single scandir the first time it is used, and names
+    handed out during the run (including simulated ones in test mode) are added as they are placed.
+
+    On case-insensitive file systems (the defaults on macOS and Windows) names which differ only in case are the same
+    file, so there names are compared case-folded.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._folded = {}
+        self._next_suffix = {}
+
+    def _directory(self, directory):
+        """get the set of names in directory, reading it if it has not been seen yet this run"""
+        names = self._names.get(directory)
+        if names is None:
+            folded = self._folded[directory] = is_case_insensitive(directory)
+            try:
+                with os.scandir(directory) as it:
+                    names = {self._key(entry.name, folded) for entry in it}
+            except OSError:
+                names = set()
+            self._names[directory] = names
+        return names
+
+    @staticmethod
+    def _key(name, folded):
+        """get the form of name which is compared, which is case-folded if the directory ignores case"""
+        if folded:
+            return os.path.normcase(name).casefold()
+        return name
+
+    def exists(self, path):
+        directory, name = os.path.split(path)
+        names = self._directory(directory)
+        return self._key(name, self._folded[directory]) in names
+
+    def add(self, path):
+        directory, name = os.path.split(path)
+        names = self._directory(directory)
+        names.add(self._key(name, self._folded[directory]))
+
+    def next_free(self, root, ext):
+        """
+        Gets the first free path of the form root_N + ext, counting N from 1.
+
+        The last N handed out for each root is remembered, so a burst of files sharing a name costs constant time per
+        file rather than probing every earlier suffix again.
+        """
+        directory, base = os.path.split(root)
+        names = self._directory(directory)
+        folded = self._folded[directory]
+        key = (directory, base, ext)
+        n = self._next_suffix.get(key, 1)
+        while self._key("{}_{}{}".format(base, n, ext), folded) in names:
+            n += 1
+        self._next_suffix[key] = n + 1
+        return os.path.join(directory, "{}_{}{}".format(base, n, ext))
+
+
+def is_case_insensitive(directory):
+    """
+    check if the file system directory is on (or would be created on) ignores the case of names, by looking for the
+    nearest existing directory with a cased name under its other case
+    """
+    path = os.path.abspath(directory)
+    while True:
+        parent, name = os.path.split(path)
+        if name != name.swapcase() and os.path.isdir(path):
+            try:
+                return os.path.samefile(path, os.path.join(parent, name.swapcase()))
+            except OSError:
+                return False
+        if parent == path:
+            # nothing on the way up has a cased name, so go by the platform
+            return os.path.normcase("A") == "a"
+        path = parent
+
+
+# what was done with a file, in a SortResult
+PLACED = "placed"
+DUPLICATE = "duplicate"
+NO_DATE = "no_date"
+UNREADABLE = "unreadable"
+
+
+class SortResult(object):
+    """
+    What was done with a single file: its status (PLACED, DUPLICATE, NO_DATE or UNREADABLE), where it was moved or copied
+    to (or would have been, in a test), the date chosen for it and the tags that date was taken from.  duplicate_of is
+    the identical file a duplicate was skipped for, and renamed is True if the file was renamed to avoid a collision.
+    """
+
+    def __init__(self, source, status, destination=None, date=None, tags=None, duplicate_of=None, renamed=False):
+        self.source = source
+        self.status = status
+        self.destination = destination
+        self.date = date
+        self.tags = tags or []
+        self.duplicate_of = duplicate_of
+        self.renamed = renamed
+
+    def __repr__(self):
+        return "SortResult({!r}, {!r}, destination={!r})".format(self.source, self.status, self.destination)
+
+
+class FilePlacer(object):
+    """
+    Chooses where each file goes from its metadata, and moves or copies it there, or in a test only works out where it
+    would have gone.
+
+    Names handed out are remembered, so that files with the same name are renamed rather than overwritten.  With a
+    dup_index (a duplicate_index.DuplicateIndex) files already in the destination are skipped, and with a plan (a
+    move_plan.PlanWriter) each decision is written to the plan.  Files are handed to transfers (a
+    transfer.TransferExecutor, or anything with the same submit method), so their transfers may still be running when
+    place returns.  With a catalog (a catalog.Catalog) each file is recorded in it once its transfer has finished, along
+    with the hash of its contents if the copy was verified.
+    """
+
+    def __init__(
+        self,
+        dest_dir,
+        sort_format,
+        rename_format=None,
+        copy_files=False,
+        test=False,
+        day_begins=0,
+        ignore_groups=None,
+        ignore_tags=None,
+        keep_filename=False,
+        transfers=None,
+        dup_index=None,
+        plan=None,
+        stats=None,
+        catalog=None,
+    ):
+        self.dest_dir = dest_dir
+        self.sort_format = sort_format
+        self.rename_format = rename_format
+        self.copy_files = copy_files
+        self.test = test
+        self.day_begins = day_begins
+        self.ignore_groups = list(ignore_groups or [])
+        self.ignore_tags = list(ignore_tags or [])
+        self.selector = TimestampSelector(self.ignore_groups, self.ignore_tags)
+        use_local_locale()
+        self.keep_filename = keep_filename
+        self.transfers = transfers
+        self.dup_index = dup_index
+        self.plan = plan
+        self.catalog = catalog
+        self.stats = stats if stats is not None else _submodule("run_stats").RunStats()
+        self.test_files = {}
+        self.reset()
+
+    def reset(self):
+        """forget the directories and names seen in the destination, which other programs may since have changed"""
+        self.directories = DestinationDirectories(self.dest_dir, self.sort_format, create=not self.test)
+        self.names = DestinationNames()
+
+    def place(self, data):
+        """sort a single file from the metadata found for it, returning a SortResult"""
+        stats = self.stats
+        dup_index = self.dup_index
+        plan = self.plan
+        # the per file messages are only built if they will be shown, as at thousands of files a second the formatting
+        # alone is noticeable
+        log_files = logging.getLogger().isEnabledFor(logging.INFO)
+
+        stats.count("files_found")
+        stats.maybe_write()
+        if "ExifTool:Error" in data:
+            stats.count("files_ignored")
+            if log_files:
+                logging.info("Ignoring {}".format(data["SourceFile"]))
+            return SortResult(data["SourceFile"], UNREADABLE)
+
+        # extract timestamp date for photo
+        start = time.perf_counter()
+        src_file, date, keys = self.selector.select(data)
+        stats.add_time("timestamp", time.perf_counter() - start)
+
+        # fixes further errors when using unicode characters like "\u20AC"
+        src_file.encode("utf-8")
+
+        # check if no valid date found
+        if not date:
+            stats.count("files_without_date")
+            if log_files:
+                logging.info("No valid dates were found using the specified tags.  File will remain where it is.")
+            return SortResult(src_file, NO_DATE)
+
+        if log_files:
+            logging.info("Date/Time: {}".format(date))
+            logging.info("Corresponding Tags: " + ", ".join(keys))
+
+        # identical files anywhere in the destination are skipped, whatever their name or date folder
+        if dup_index is not None:
+            start = time.perf_counter()
+            duplicate = dup_index.find_duplicate(src_file)
+            stats.add_time("duplicates", time.perf_counter() - start)
+            if duplicate is not None:
+                stats.count("duplicates")
+                logging.error("Identical file already exists at {}.  Duplicate will be ignored.".format(duplicate))
+                if plan is not None:
+                    plan.add(src_file, None, date, keys, duplicate_of=duplicate)
+                return SortResult(src_file, DUPLICATE, date=date, tags=keys, duplicate_of=duplicate)
+
+        # early morning photos can be grouped with previous day (depending on user setting)
+        start = time.perf_counter()
+        file_date = date
+        date = check_for_early_morning_photos(date, self.day_begins)
+
+        # create folder structure
+        dest_file = self.directories.directory_for(date)
+
+        # rename file if necessary
+        filename = os.path.basename(src_file)
+
+        if self.rename_format is not None and date is not None:
+            _, ext = os.path.splitext(filename)
+            filename = date.strftime(self.rename_format) + ext.lower()
+
+        # setup destination file
+        dest_file = os.path.join(dest_file, filename)
+
+        if log_files:
+            name = "Destination "
+            if self.copy_files:
+                name += "(copy): "
+            else:
+                name += "(move): "
+            logging.info(name + dest_file)
+
+        # check for collisions.  only the original name is compared for identical content, as files elsewhere in the
+        # destination have already been checked by the duplicate index
+        fileIsIdentical = False
+        renamed = False
+        if self.names.exists(dest_file):
+            dest_compare = self.test_files.get(dest_file, dest_file) if self.test else dest_file
+            if dup_index is not None and dup_index.same_content(src_file, dest_compare):
+                fileIsIdentical = True
+                stats.count("duplicates")
+                logging.error("Identical file already exists at {}.  Duplicate will be ignored.".format(dest_file))
+            else:  # name is same, but file is different
+                dest_file = self._next_name(dest_file, src_file)
+                renamed = True
+                stats.count("collisions")
+                logging.error("Same name already exists...renaming to: {}".format(dest_file))
+        if not fileIsIdentical:
+            self.names.add(dest_file)
+        stats.add_time("collisions", time.perf_counter() - start)
+
+        # finally move or copy the file
+        if self.test:
+            self.test_files[dest_file] = src_file
+            if dup_index is not None and not fileIsIdentical:
+                dup_index.add(src_file)
+            if plan is not None:
+                if fileIsIdentical:
+                    plan.add(src_file, None, file_date, keys, duplicate_of=dest_compare)
+                else:
+                    plan.add(src_file, dest_file, file_date, keys)
+
+        if fileIsIdentical:
+            return SortResult(src_file, DUPLICATE, date=file_date, tags=keys, duplicate_of=dest_file)
+        result = SortResult(src_file, PLACED, destination=dest_file, date=file_date, tags=keys, renamed=renamed)
+
+        if not self.test:
+            content_hash = None
+            if dup_index is not None:
+                content_hash = dup_index.add(dest_file, source=src_file)
+            record = None
+            if self.catalog is not None:
+                # the source is stat'd now, as once it has been moved it is gone
+                record = (src_file, os.stat(src_file), file_date, keys, content_hash)
+            self.transfers.submit(
+                src_file,
+                dest_file,
+                self.copy_files,
+                callback=functools.partial(self._placed, record),
+                details={"date": file_date.isoformat(), "tags": list(keys)},
+                on_exists=functools.partial(self._taken, result),
+            )
+        return result
+
+    def _next_name(self, dest_file, src_file):
+        """get a free name for src_file in the directory of dest_file, whose name is taken"""
+        root, ext = os.path.splitext(dest_file)
+        if self.keep_filename:
+            orig_filename = os.path.splitext(os.path.basename(src_file))[0]
+            return self.names.next_free(root + "_" + orig_filename, ext)
+        return self.names.next_free(root, ext)
+
+    def _taken(self, result, dest_file):
+        """
+        choose another name for the file of result (a SortResult), as another program has put a file at dest_file since
+        the name was chosen
+        """
+        self.names.add(dest_file)
+        new_dest = self._next_name(dest_file, result.source)
+        self.names.add(new_dest)
+        self.stats.count("collisions")
+        logging.error("A file has appeared at {}...renaming to: {}".format(dest_file, new_dest))
+        if self.dup_index is not None:
+            self.dup_index.taken(dest_file, new_dest)
+        result.destination = new_dest
+        result.renamed = True
+        return new_dest
+
+    def _placed(self, record, dest_file, verified_hash=None):
+        """
+        record a finished transfer, and add it to the catalog with record (the source, its stat, date, tags and hash).
+        verified_hash is the hash of the contents computed while copying, if the copy was verified
+        """
+        self.stats.count("files_placed")
+        try:
+            self.stats.count("bytes_placed", os.stat(dest_file).st_size)
+        except OSError:
+            pass
+        if verified_hash is not None:
+            self.stats.count("files_verified")
+        if self.dup_index is not None:
+            self.dup_index.placed(dest_file, verified_hash)
+        if record is not None:
+            src_file, source_stat, date, keys, content_hash = record
+            self.catalog.add(
+                dest_file, src_file, source_stat, date, keys, self.copy_files, verified_hash or content_hash
+            )
+
+
+class ExifToolPool(object):
+    """
+    Keeps a number of long-lived ExifTool processes open (using -stay_open) and hands out batches of files to them.
+
+    If a reader is given, each file is first passed to it (on the same worker threads), and only the files it returns
+    None for are passed to ExifTool.  Results are always returned in the order the batches were submitted, regardless
+    of which process finished first.  If stats (a run_stats.RunStats) is given, the time spent reading natively and in
+    each ExifTool batch is recorded in it.
+
+    Each batch is split up for ExifTool by a BatchSizer, so that batches of slow or large files are smaller.  If
+    ExifTool spends longer than file_timeout seconds on a single file, or dies, that file is reported as an error and the
+    rest of its batch is read by a fresh ExifTool.
+
+    If devices (a devices.DeviceLimiter) is given, each batch waits for a reader of the device its files are on, so
+    batches should only hold files from a single device (see iter_device_batches).
+    """
+
+    def __init__(self, jobs=1, params=None, reader=None, stats=None, file_timeout=60.0, devices=None):
+        self.jobs = max(1, int(jobs))
+        self.params = params
+        self.reader = reader
+        self.stats = stats
+        self.file_timeout = file_timeout or None
+        self.devices = devices
+        self.sizer = exiftool_process.BatchSizer()
+        self.native_files = 0
+        self.exiftool_files = 0
+        self._idle = Queue()
+        self._tools = []
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+        return self
+
+    def start_tools(self):
+        """start the ExifTool processes, which is otherwise only done once there is a batch that needs them"""
+        if self._tools:
+            return
+        for _ in range(self.jobs):
+            et = exiftool_process.ExifToolProcess(exiftool_command())
+            et.start()
+            self._tools.append(et)
+            self._idle.put(et)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._executor.shutdown(wait=True)
+        for et in self._tools:
+            et.terminate()
+        self._tools = []
+        if self.reader is not None:
+            logging.info(
+                "Read metadata for {} files natively and {} with ExifTool.".format(
+                    self.native_files, self.exiftool_files
+                )
+            )
+
+    def _reading(self, batch):
+        """get a context holding a reader of the batch's device while the batch is read"""
+        if self.devices is None or not batch:
+            return contextlib.nullcontext()
+        return self.devices.reading(batch[0])
+
+    def _read_native(self, batch):
+        """read what the reader can, returning the metadata found and the files still to pass to ExifTool"""
+        if self.reader is None:
+            return [], batch
+        with self._reading(batch):
+            return self._read_native_batch(batch)
+
+    def _read_native_batch(self, batch):
+        """read what the reader can of a batch, recording how long it took"""
+        start = time.perf_counter()
+        found = []
+        remaining = []
+        for f in batch:
+            data = self.reader(f)
+            if data is None:
+                remaining.append(f)
+            else:
+                found.append(data)
+        if self.stats is not None:
+            self.stats.add_time("native", time.perf_counter() - start, len(batch))
+        return found, remaining
+
+    def _run_batch(self, batch):
+        """get the metadata for a single batch on whichever ExifTool process is free"""
+        if not batch:
+            return []
+        with self._reading(batch):
+            return self._run_exiftool(batch)
+
+    def _run_exiftool(self, batch):
+        """pass a batch to whichever ExifTool process is free"""
+        et = self._idle.get()
+        try:
+            result = []
+            for files in self.sizer.split(batch):
+                start = time.perf_counter()
+                result += exiftool_process.read_isolated(
+                    et, files, self.params, self.file_timeout, on_failure=self._file_failed
+                )
+                seconds = time.perf_counter() - start
+                self.sizer.observe(files, seconds)
+                if self.stats is not None:
+                    self.stats.add_time("exiftool", seconds, len(files))
+                    self.stats.observe("exiftool_batch_seconds", seconds)
+            return result
+        finally:
+            self._idle.put(et)
+
+    def _file_failed(self, path, reason):
+        """report a file ExifTool hung or died on"""
+        logging.error("ExifTool {} on {}, so it will be left where it is.".format(reason, path))
+        if self.stats is not None:
+            self.stats.count("files_failed")
+
+    def map_batches(self, batches):
+        """
+        Yields the metadata for each batch in submission order.
+
+        Batches go through the reader and then ExifTool, with at most two batches per process in flight at each stage,
+        so the batches can be supplied lazily.  The ExifTool processes are only started once a file needs them.
+        """
+        reading = collections.deque()
+        extracting = collections.deque()
+
+        def pass_to_exiftool():
+            found, remaining = reading.popleft().result()
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                for data in found:
+                    logging.info("Read metadata for {} natively.".format(data["SourceFile"]))
+                for f in remaining:
+                    logging.info("Passing {} to ExifTool.".format(f))
+            self.native_files += len(found)
+            self.exiftool_files += len(remaining)
+            if remaining:
+                self.start_tools()
+            extracting.append((found, self._executor.submit(self._run_batch, remaining)))
+
+        for batch in batches:
+            reading.append(self._executor.submit(self._read_native, batch))
+            if len(reading) >= 2 * self.jobs:
+                pass_to_exiftool()
+            if len(extracting) >= 2 * self.jobs:
+                found, future = extracting.popleft()
+                yield found + future.result()
+        while reading:
+            pass_to_exiftool()
+        while extracting:
+            found, future = extracting.popleft()
+            yield found + future.result()
+
+
 # #  this class is based on code from Sven Marnach (http://stackoverflow.com/questions/10075115/call-exiftool-from-a-python-script)
 # class ExifTool(object):
 #     """used to run ExifTool from Python and keep it open"""
@@ -211,14 +1125,46 @@ def sortPhotos(
     use_only_groups=None,
     use_only_tags=None,
     keep_filename=False,
+    *,
+    jobs=1,
+    use_cache=True,
+    rebuild_cache=False,
+    cache_file=None,
+    cache_size=None,
+    extensions=None,
+    ignore_extensions=None,
+    walk_threads=1,
+    rebuild_duplicate_index=False,
+    io_jobs=1,
+    fast=0,
+    native=True,
+    watch=False,
+    watch_settle=2.0,
+    watch_poll_interval=10.0,
+    plan_file=None,
+    resume=False,
+    report_file=None,
+    prometheus_file=None,
+    prometheus_interval=15.0,
+    exiftool_timeout=60.0,
+    remove_empty_dirs=False,
+    remove_junk_files=False,
+    use_catalog=True,
+    device_jobs=None,
+    verify=None,
 ):
     """
     This function is a convenience wrapper around ExifTool based on common usage scenarios for sortphotos.py
 
+    Only the parameters up to keep_filename can be given by position; the others must be given by keyword, so that
+    adding one never shifts the rest.  For sorting many times from a program, see sorter.Sorter.
+
     Parameters
     ---------------
-    src_dir : str
-        directory containing files you want to process
+    src_dir : str or list(str)
+        directory containing files you want to process, or a list of them.  The files in every directory are sorted
+        together, into the same destination, with the directories on each device (SD card, disk, network share) read
+        at the same time as those on the others
     dest_dir : str
         directory where you want to move/copy the files to
     sort_format : str
@@ -235,9 +1181,74 @@ def sortPhotos(
     test : bool
         True if you just want to simulate how the files will be moved without actually doing any moving/copying
     remove_duplicates : bool
-        True to remove files that are exactly the same in name and a file hash
+        True to skip files whose content is identical to a file already in dest_dir, whatever its name or folder
     keep_filename : bool
         True to append original filename in case of duplicates instead of increasing number
+    jobs : int
+        number of ExifTool processes to run in parallel when extracting metadata
+    use_cache : bool
+        True to remember the time stamps of each file between runs, so unchanged files are not passed to ExifTool again
+    rebuild_cache : bool
+        True to discard everything in the cache before starting
+    cache_file : str
+        path to the cache database.  Defaults to sortphotos/metadata.sqlite in the user cache directory
+    cache_size : int
+        maximum number of files remembered in the cache.  Defaults to metadata_cache.DEFAULT_MAX_ENTRIES
+    extensions : list(str)
+        only files with these extensions (case insensitive) are sorted.  None to sort every file
+    ignore_extensions : list(str)
+        files with these extensions (case insensitive) are left where they are
+    walk_threads : int
+        number of threads used to read sibling directories in parallel when searching src_dir
+    rebuild_duplicate_index : bool
+        True to discard the duplicate index kept in dest_dir and index the destination again from scratch
+    io_jobs : int
+        number of files to copy or move at once.  Moves within a file system are always a single rename
+    fast : int
+        1 to pass -fast to ExifTool, which stops reading at the first IFD, or 2 for -fast2, which also skips maker
+        notes.  0 to read the whole file
+    native : bool
+        True to read the time stamps of common formats (JPEG, TIFF, HEIC, MP4) directly, only passing other files to
+        ExifTool
+    watch : bool
+        True to keep running after the files in src_dir have been sorted, sorting new files as they arrive
+    watch_settle : float
+        seconds a new file must stay the same size and modification time before it is sorted, when watching
+    watch_poll_interval : float
+        seconds between searches of src_dir when watching, where inotify is not available
+    plan_file : str
+        if given, nothing is moved or copied (as for test), and what would be done is written to this file instead,
+        so that it can be done later with apply_plan
+    resume : bool
+        True to finish a run into dest_dir which was interrupted.  The transfers it had begun are checked and finished
+        (or redone), and the files it had already placed are skipped.  Without this, an interrupted run is an error
+    report_file : str
+        if given, a JSON report of the run (the number of files found, placed, duplicated and so on, and the time spent
+        and rate of each stage) is written to this file at the end
+    prometheus_file : str
+        if given, the same figures are written to this file in the Prometheus text format, for the node_exporter
+        textfile collector, every prometheus_interval seconds while files are being sorted and at the end
+    prometheus_interval : float
+        least number of seconds between writes of prometheus_file
+    exiftool_timeout : float
+        most seconds ExifTool may spend reading a single file.  A file which takes longer (or which ExifTool dies on)
+        is left where it is, and the rest of its batch is still read.  0 or None for no limit
+    remove_empty_dirs : bool
+        True to remove the folders in src_dir which files were moved out of, once they are empty (and then their parents
+        in turn).  src_dir itself is kept, and nothing is removed when copying or testing
+    remove_junk_files : bool
+        True to also remove folders holding nothing but junk files (.DS_Store, Thumbs.db, desktop.ini) with
+        remove_empty_dirs, along with the junk files
+    use_catalog : bool
+        True to record each file placed in the catalog kept in dest_dir (see catalog.Catalog), and to skip files which
+        an earlier run already copied there and which haven't changed since
+    device_jobs : int
+        most batches of files read by ExifTool, and most files copied or moved, from any one source device at once.
+        None for no limit (beyond jobs and io_jobs)
+    verify : str
+        transfer.VERIFY_FSYNC or transfer.VERIFY_READBACK to hash each file as it is copied and sync the copy to disk
+        (and with readback, read it back once and check it), recording the hash for finding duplicates and in the
+        catalog.  None to copy as fast as possible without checking
     day_begins : int
         what hour of the day you want the day to begin (only for classification purposes).  Defaults at 0 as midnight.
         Can be used to group early morning photos with the previous day.  must be a number between 0-23
@@ -254,150 +1265,481 @@ def sortPhotos(
 
     """
 
-    # some error checking
-    if not os.path.exists(src_dir):
-        raise Exception("Source directory does not exist")
+    # a directory given twice is only searched once
+    unique_dirs = {}
+    for d in [src_dir] if isinstance(src_dir, (str, os.PathLike)) else src_dir:
+        unique_dirs.setdefault(os.path.realpath(d), d)
+    src_dirs = list(unique_dirs.values())
 
-    # setup arguments to exiftool
-    args = ["-j", "-a", "-G"]
+    # some error checking
+    if not src_dirs:
+        raise Exception("No source directory given")
+    for d in src_dirs:
+        if not os.path.exists(d):
+            raise Exception("Source directory does not exist: {}".format(d))
+    if plan_file is not None and watch:
+        raise Exception("A plan can't be written while watching for new files")
+    if watch and len(src_dirs) > 1:
+        raise Exception("Only a single source directory can be watched")
+
+    # a plan is a test run that records what it would have done
+    if plan_file is not None:
+        test = True
+
+    # setup arguments to exiftool, so that only the tags needed are extracted
+    args = exiftool_params(use_only_groups, use_only_tags, fast)
 
     # setup tags to ignore
     if use_only_tags is not None:
         additional_groups_to_ignore = []
         additional_tags_to_ignore = []
-        for t in use_only_tags:
-            args += ["-" + t]
-
     elif use_only_groups is not None:
         additional_groups_to_ignore = []
-        for g in use_only_groups:
-            args += ["-" + g + ":Time:All"]
-
-    else:
-        args += ["-time:all"]
-
-    if recursive:
-        args += ["-r"]
-
-    args += [src_dir]
 
-    # Get all files
-    files = get_all_files(pathlib.Path(src_dir), recursive=recursive)
-
-    # get all metadata
+    # photos read natively (or cached from a native read) may only have EXIF:DateTimeOriginal, which is no use if it is
+    # ignored, so then they are passed to ExifTool and cached separately
+    query = " ".join(args)
+    prefers_original = TimestampSelector(additional_groups_to_ignore, additional_tags_to_ignore).prefers_original
+    if not prefers_original:
+        query += " (complete)"
+
+    # create the destination up front, so that it can be skipped if it is inside the source directory
+    if not test and not os.path.exists(dest_dir):
+        os.makedirs(dest_dir)
+
+    # every move or copy is journalled, so that a run which is killed part way can be resumed
+    journal = _submodule("journal")
+    journal_path = journal.default_journal_path(dest_dir)
+    started, finished = {}, {}
+    if not test:
+        started, finished = read_interrupted_run(dest_dir, copy_files, resume)
+
+    # each stage below is a generator, so files are read, passed to ExifTool and placed a batch at a time rather than
+    # materialising the whole library at each step
+    stats = _submodule("run_stats").RunStats(prometheus_file, prometheus_interval)
+    # the folders files were moved out of, which may be empty once the moves are done, by source directory
+    source_dirs = collections.defaultdict(set)
+    # the device each source directory is on, with the directories on each device walked one after another
+    source_devices = devices.group_by_device(src_dirs)
+    device_limiter = devices.DeviceLimiter(device_jobs) if device_jobs else None
     recursive_text = "recursively " if recursive else ""
-    logging.info("Getting metadata {}from {}".format(recursive_text, src_dir))
-    metadata = []
-    with exiftool.ExifTool() as et:
-        scalar = 100
-        iterator = (files[i : i + scalar] for i in range(0, len(files), scalar))
-        for each in tqdm(iterator, total=len(files) / scalar, unit_scale=scalar):
-            metadata.extend(et.get_metadata_batch(each))
-
-    excluded = [x for x in metadata if "ExifTool:Error" in x.keys()]
-    metadata = [x for x in metadata if "ExifTool:Error" not in x.keys()]
+    logging.info("Getting metadata {}from {}".format(recursive_text, ", ".join(str(d) for d in src_dirs)))
+    with contextlib.ExitStack() as stack:
+        # the reports are written last, even if the run fails, once everything else has been closed
+        stack.callback(write_run_reports, stats, report_file)
+        cache = None
+        if use_cache:
+            metadata_cache = _submodule("metadata_cache")
+            if cache_size is None:
+                cache_size = metadata_cache.DEFAULT_MAX_ENTRIES
+            cache = stack.enter_context(
+                metadata_cache.MetadataCache(cache_file, max_entries=cache_size, rebuild=rebuild_cache, query=query)
+            )
+            stats.add_source(lambda: {"cache_hits": cache.hits, "cache_misses": cache.misses})
+        reader = make_native_reader(use_only_groups, use_only_tags, prefers_original) if native else None
+        pool = stack.enter_context(
+            ExifToolPool(
+                jobs=jobs,
+                params=args,
+                reader=reader,
+                stats=stats,
+                file_timeout=exiftool_timeout,
+                devices=device_limiter,
+            )
+        )
+        stats.add_source(lambda: {"files_native": pool.native_files, "files_exiftool": pool.exiftool_files})
+        dup_index = None
+        if remove_duplicates:
+            dup_index = stack.enter_context(
+                duplicate_index.DuplicateIndex(
+                    duplicate_index.default_index_path(dest_dir), persist=not test, rebuild=rebuild_duplicate_index
+                )
+            )
+            if dup_index.is_new and os.path.exists(dest_dir):
+                dup_index.build(iter_all_files(dest_dir, recursive=True))
+        dest_catalog = None
+        if use_catalog:
+            catalog = _submodule("catalog")
+            dest_catalog = stack.enter_context(
+                catalog.Catalog(catalog.default_catalog_path(dest_dir), persist=not test)
+            )
+        if started:
+            finished.update(finish_interrupted_transfers(started, verify))
+        record_interrupted_transfers(finished, dup_index, dest_catalog)
+        executor = transfer.TransferExecutor(io_jobs, stats=stats, devices=device_limiter, verify=verify)
+        if test:
+            transfers = stack.enter_context(executor)
+        else:
+            transfers = stack.enter_context(
+                journal.JournaledTransfers(executor, journal_path, copy_files, finished=finished)
+            )
+        plan = None
+        if plan_file is not None:
+            plan = stack.enter_context(_submodule("move_plan").PlanWriter(plan_file, dest_dir, copy_files))
+
+        placer = FilePlacer(
+            dest_dir,
+            sort_format,
+            rename_format,
+            copy_files=copy_files,
+            test=test,
+            day_begins=day_begins,
+            ignore_groups=additional_groups_to_ignore,
+            ignore_tags=additional_tags_to_ignore,
+            keep_filename=keep_filename,
+            transfers=transfers,
+            dup_index=dup_index,
+            plan=plan,
+            stats=stats,
+            catalog=dest_catalog,
+        )
+
+        def already_placed(src_file):
+            """check if an earlier run copied the file into the destination, and it hasn't changed since"""
+            dest_file = dest_catalog.already_placed(src_file)
+            if dest_file is None:
+                return False
+            stats.count("files_already_placed")
+            logging.info("{} was already copied to {}.".format(src_file, dest_file))
+            return True
+
+        def sort_files(files, progress=True, batched=False):
+            """get the metadata for each file and move or copy it into place"""
+            from tqdm import tqdm
+
+            for data in tqdm(extract_metadata(files, pool, cache, batched=batched), unit="files", disable=not progress):
+                result = placer.place(data)
+                if result.status == PLACED and remove_empty_dirs and not copy_files and not test:
+                    folder = os.path.dirname(result.source)
+                    source_dirs[source_root(folder)].add(folder)
+
+        def source_root(folder):
+            """get the source directory a folder was found in, which is the deepest one it is inside"""
+            if len(src_dirs) == 1:
+                return src_dirs[0]
+            folder = os.path.abspath(folder)
+            inside = [d for d in src_dirs if os.path.commonpath([folder, os.path.abspath(d)]) == os.path.abspath(d)]
+            return max(inside, key=lambda d: len(os.path.abspath(d)))
+
+        def remove_source_dirs():
+            """remove the folders files were moved out of, if they are now empty"""
+            if not source_dirs:
+                return
+            transfers.drain()
+            for root, folders in source_dirs.items():
+                removed = delete_empty_folders.remove_empty_parents(folders, root, remove_junk=remove_junk_files)
+                stats.count("dirs_removed", removed)
+                logging.info("Removed {} empty folders from {}.".format(removed, root))
+            source_dirs.clear()
+
+        def walk(directories):
+            """find the files in the source directories on a single device, one directory after another"""
+            for d in directories:
+                # the destination is skipped so that files which have already been moved are not found again, and the
+                # other source directories so that files in one inside another are only found once
+                yield from iter_all_files(
+                    d,
+                    recursive=recursive,
+                    exclude=[dest_dir] + [other for other in src_dirs if other is not d],
+                    extensions=extensions,
+                    ignore_extensions=ignore_extensions,
+                    threads=walk_threads,
+                )
+
+        def unplaced(files):
+            """leave out the files an interrupted or earlier run has already placed"""
+            if finished:
+                # files copied by the interrupted run are still in the source directory
+                files = (f for f in files if os.path.abspath(f) not in finished)
+            if dest_catalog is not None and copy_files:
+                # moved files are gone from the source, so only copies can be found there again
+                files = (f for f in files if not already_placed(f))
+            return files
+
+        # each device is walked on its own thread, and its files are read in batches taken from each device in turn
+        streams = [unplaced(prefetch(stats.timed_iter("walk", walk(d)))) for d in source_devices.values()]
+        if not watch:
+            if len(streams) == 1:
+                sort_files(streams[0])
+            else:
+                logging.info("Reading from {} devices at once.".format(len(streams)))
+                sort_files(iter_device_batches(streams, 100), batched=True)
+            remove_source_dirs()
+        else:
+            # new files are sorted in bursts as they arrive, keeping ExifTool and the indexes open in between
+            src_dir = src_dirs[0]
+            files = streams[0]
+            watcher = stack.enter_context(
+                _submodule("directory_watch").DirectoryWatcher(
+                    src_dir,
+                    functools.partial(
+                        scan_directory,
+                        recursive=recursive,
+                        extensions=_normalise_extensions(extensions),
+                        ignore_extensions=_normalise_extensions(ignore_extensions),
+                        exclude=_directory_keys([dest_dir, src_dir]),
+                    ),
+                    functools.partial(wanted_file, extensions=extensions, ignore_extensions=ignore_extensions),
+                    settle=watch_settle,
+                    poll_interval=watch_poll_interval,
+                )
+            )
+            sort_files(watcher.existing_files(files))
+            while True:
+                if test:
+                    transfers.drain()
+                else:
+                    remove_source_dirs()
+                    transfers.checkpoint()
+                if cache is not None:
+                    cache.flush()
+                if dup_index is not None:
+                    dup_index.flush()
+                if dest_catalog is not None:
+                    dest_catalog.flush()
+                log_run_summary(stats)
+                if stats.prometheus_file is not None:
+                    stats.write_prometheus()
+                new_files = watcher.wait()
+                logging.info("Sorting {} new files.".format(len(new_files)))
+                if dest_catalog is not None and copy_files:
+                    new_files = [f for f in new_files if not already_placed(f)]
+                # other programs may have changed the destination since the last burst
+                placer.reset()
+                sort_files(new_files, progress=False)
+
+    if plan is not None:
+        logging.info("Wrote {} files to the plan {}.".format(plan.entries, plan_file))
+
+
+def log_run_summary(stats):
+    """log the number of files found and the rate they were sorted at"""
+    report = stats.report()
+    counters = report["counters"]
+    found = counters.get("files_found", 0)
+    ignored = counters.get("files_ignored", 0)
+    logging.info("Found {} files, of which {} were parsed (ignoring {}).".format(found, found - ignored, ignored))
+    if counters.get("files_already_placed"):
+        logging.info("Skipped {} files already copied by an earlier run.".format(counters["files_already_placed"]))
     logging.info(
-        "Found {} files, of which {} will be parsed (ignoring {}).".format(len(files), len(metadata), len(excluded))
+        "Placed {} files in {:.1f} seconds ({:.1f} files/s, {:.1f} MB/s).".format(
+            counters.get("files_placed", 0),
+            report["seconds"],
+            report["files_per_second"] or 0,
+            (report["bytes_per_second"] or 0) / 1e6,
+        )
     )
-    for i in excluded:
-        logging.info("Ignoring {}".format(i["SourceFile"]))
-
-    if test:
-        test_file_dict = {}
-    # parse output extracting oldest relevant date
-    for data in tqdm(metadata):
-
-        # extract timestamp date for photo
-        src_file, date, keys = get_oldest_timestamp(data, additional_groups_to_ignore, additional_tags_to_ignore)
+    if counters.get("files_verified"):
+        logging.info("Verified {} copies.".format(counters["files_verified"]))
 
-        # fixes further errors when using unicode characters like "\u20AC"
-        src_file.encode("utf-8")
-
-        # check if no valid date found
-        if not date:
-            logging.info("No valid dates were found using the specified tags.  File will remain where it is.")
 
-        # ignore hidden files
-        if os.path.basename(src_file).startswith("."):
-            logging.info("hidden file.  will be skipped")
-            continue
-
-        logging.info("Date/Time: {}".format(date))
-        logging.info("Corresponding Tags: " + ", ".join(keys))
+def write_run_reports(stats, report_file=None):
+    """log a summary of the run, and write the JSON report and the Prometheus file if they were asked for"""
+    log_run_summary(stats)
+    if report_file is not None:
+        stats.write_report(report_file)
+    if stats.prometheus_file is not None:
+        stats.write_prometheus()
 
-        # early morning photos can be grouped with previous day (depending on user setting)
-        date = check_for_early_morning_photos(date, day_begins)
 
-        # create folder structure
-        dir_structure = date.strftime(sort_format)
-        dirs = dir_structure.split("/")
-        dest_file = dest_dir
-        for thedir in dirs:
-            dest_file = os.path.join(dest_file, thedir)
-            if not test and not os.path.exists(dest_file):
-                os.makedirs(dest_file)
+def read_interrupted_run(dest_dir, copy_files, resume=False):
+    """
+    Reads the journal an interrupted run into dest_dir left behind, returning the transfers it started and those it
+    finished (see journal.read_journal), which are both empty if there was no interrupted run.  Raises an exception if
+    there was one and resume is False, or if it can't be resumed with copy_files.
+    """
+    journal = _submodule("journal")
+    journal_path = journal.default_journal_path(dest_dir)
+    header, started, finished = journal.read_journal(journal_path)
+    if started or finished:
+        if not resume:
+            raise Exception(
+                "A run into {} was interrupted.  Use --resume to finish it, or delete {} to start again".format(
+                    dest_dir, journal_path
+                )
+            )
+        if header["copy"] != copy_files:
+            raise Exception(
+                "The interrupted run {} files, so it must be resumed the same way".format(
+                    "copied" if header["copy"] else "moved"
+                )
+            )
+    return started, finished
+
+
+def finish_interrupted_transfers(started, verify=None):
+    """
+    Checks the transfers which an interrupted run had begun (start records from its journal), finishing each one, or
+    redoing it if it didn't complete (verifying the copy if verify is given, see transfer.copy_file).  Returns the
+    transfers which are now finished, as a dict of their start records by source.  A transfer which can't be finished
+    is logged, and its source is left to be sorted again.
+    """
+    move_plan = _submodule("move_plan")
+    finished = {}
+    for entry in started.values():
+        src_file, dest_file = entry["src"], entry["dest"]
 
-        # rename file if necessary
-        filename = os.path.basename(src_file)
+        # a copy which was cut short leaves only its temporary file behind
+        try:
+            os.unlink(transfer.partial_path(dest_file))
+        except OSError:
+            pass
 
-        if rename_format is not None and date is not None:
-            _, ext = os.path.splitext(filename)
-            filename = date.strftime(rename_format) + ext.lower()
+        state = move_plan.entry_state(entry)
+        try:
+            if state == move_plan.DONE and os.path.exists(src_file):
+                # the copy (or the copy half of a move between file systems) finished, but may not have reached the disk
+                if duplicate_index.hash_file(src_file) == duplicate_index.hash_file(dest_file):
+                    if entry["action"] == "move":
+                        os.unlink(src_file)
+                else:
+                    logging.error("{} does not match {}, so it will be placed again.".format(dest_file, src_file))
+                    os.unlink(dest_file)
+                    state = move_plan.PENDING
+            if state == move_plan.PENDING:
+                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+                transfer.transfer_file(src_file, dest_file, entry["action"] == "copy", verify)
+                state = move_plan.DONE
+        except OSError as e:
+            logging.error(
+                "Could not finish placing {} at {} ({}), so it will be sorted again.".format(src_file, dest_file, e)
+            )
+            continue
+        if state == move_plan.DONE:
+            finished[src_file] = entry
+        elif state == move_plan.CONFLICT:
+            logging.error("{} already exists, so {} will be sorted again.".format(dest_file, src_file))
+        elif state == move_plan.MISSING:
+            logging.error("{} was being moved to {}, but neither exists.".format(src_file, dest_file))
+        elif state == move_plan.CHANGED:
+            logging.error("{} has changed since it was being placed, so it will be sorted again.".format(src_file))
 
-        # setup destination file
-        dest_file = os.path.join(dest_file, filename)
-        root, ext = os.path.splitext(dest_file)
+    logging.info("Finished {} of the {} transfers left by the interrupted run.".format(len(finished), len(started)))
+    return finished
 
-        name = "Destination "
-        if copy_files:
-            name += "(copy): "
-        else:
-            name += "(move): "
-        logging.info(name + dest_file)
 
-        # check for collisions
-        append = 1
-        fileIsIdentical = False
+def record_interrupted_transfers(finished, dup_index=None, dest_catalog=None):
+    """
+    Adds the transfers an interrupted run finished (start records by source, see journal.read_journal) to the duplicate
+    index and catalog of the destination, as they may not have been saved before the interruption.
+    """
+    for src_file, entry in finished.items():
+        dest_file = entry["dest"]
+        if dup_index is not None:
+            dup_index.add(dest_file)
+        # journals written before dates were recorded in them can't be cataloged
+        if dest_catalog is None or entry.get("date") is None or dest_catalog.contains(dest_file):
+            continue
+        # the source as it was when the transfer began, which is what a later run compares it with
+        source_stat = os.stat_result((0, 0, 0, 0, 0, 0, entry["size"], 0, 0, 0), {"st_mtime_ns": entry["mtime_ns"]})
+        dest_catalog.add(
+            dest_file,
+            src_file,
+            source_stat,
+            datetime.fromisoformat(entry["date"]),
+            entry["tags"],
+            entry["action"] == "copy",
+        )
+
+
+def apply_plan(plan_file, io_jobs=1, verify=None):
+    """
+    Moves or copies the files in a plan written by sortPhotos, without extracting any metadata again, verifying the
+    copies if verify is given (see transfer.copy_file).
 
-        while True:
+    Entries which have already been applied are skipped, so an interrupted apply can simply be run again.  Entries whose
+    source has changed or gone since the plan was made, or whose destination has been taken by another file, are left
+    alone and logged.  Returns a Counter of the entries in each state (see move_plan.entry_state).
+    """
+    move_plan = _submodule("move_plan")
+    header, entries = move_plan.read_plan(plan_file)
+    dest_dir = header["dest_dir"]
+    entries = [(entry, move_plan.entry_state(entry)) for entry in entries]
+
+    # create the directories of the entries to be placed up front, rather than checking for each file
+    directories = DestinationDirectories(dest_dir, None)
+    directories.create_all(os.path.dirname(entry["dest"]) for entry, state in entries if state == move_plan.PENDING)
+
+    from tqdm import tqdm
+
+    counts = collections.Counter()
+    with contextlib.ExitStack() as stack:
+        # keep the duplicate index of the destination up to date, if it has one
+        dup_index = None
+        index_path = duplicate_index.default_index_path(dest_dir)
+        if os.path.exists(index_path):
+            dup_index = stack.enter_context(duplicate_index.DuplicateIndex(index_path))
+        # and its catalog
+        dest_catalog = None
+        catalog = _submodule("catalog")
+        catalog_path = catalog.default_catalog_path(dest_dir)
+        if os.path.exists(catalog_path):
+            dest_catalog = stack.enter_context(catalog.Catalog(catalog_path))
+        transfers = stack.enter_context(transfer.TransferExecutor(io_jobs, verify=verify))
+
+        for entry, state in tqdm(entries, unit="files"):
+            src_file, dest_file = entry["src"], entry["dest"]
+            counts[state] += 1
+            if state == move_plan.DONE and entry["action"] == "move" and os.path.exists(src_file):
+                # a move between file systems was interrupted after the copy, before the source was removed
+                if duplicate_index.hash_file(src_file) == duplicate_index.hash_file(dest_file):
+                    os.unlink(src_file)
+            elif state == move_plan.CONFLICT:
+                logging.error("{} already exists, so {} was not placed.".format(dest_file, src_file))
+            elif state == move_plan.MISSING:
+                logging.error("{} no longer exists.".format(src_file))
+            elif state == move_plan.CHANGED:
+                logging.error("{} has changed since the plan was made, so it was not placed.".format(src_file))
+            if state != move_plan.PENDING:
+                continue
+            logging.info("Destination ({}): {}".format(entry["action"], dest_file))
+            content_hash = None
+            if dup_index is not None:
+                content_hash = dup_index.add(dest_file, source=src_file)
+            record = None
+            if dest_catalog is not None:
+                record = (
+                    src_file,
+                    os.stat(src_file),
+                    datetime.fromisoformat(entry["date"]),
+                    entry["tags"],
+                    content_hash,
+                )
+            callback = functools.partial(_plan_entry_placed, entry["action"] == "copy", dup_index, dest_catalog, record)
+            transfers.submit(
+                src_file,
+                dest_file,
+                entry["action"] == "copy",
+                callback=callback,
+                on_exists=functools.partial(_plan_entry_taken, src_file, dup_index),
+            )
 
-            if (not test and os.path.isfile(dest_file)) or (
-                test and dest_file in test_file_dict.keys()
-            ):  # check for existing name
-                if test:
-                    dest_compare = test_file_dict[dest_file]
-                else:
-                    dest_compare = dest_file
-                if remove_duplicates and filecmp.cmp(src_file, dest_compare):  # check for identical files
-                    fileIsIdentical = True
-                    logging.error("Identical file already exists at {}.  Duplicate will be ignored.".format(src_file))
-                    break
-
-                else:  # name is same, but file is different
-                    if keep_filename:
-                        orig_filename = os.path.splitext(os.path.basename(src_file))[0]
-                        dest_file = root + "_" + orig_filename + "_" + str(append) + ext
-                    else:
-                        dest_file = root + "_" + str(append) + ext
-                    append += 1
-                    logging.error("Same name already exists...renaming to: {}".format(dest_file))
+    logging.info(
+        "Applied {} files from the plan ({} already done, {} duplicates skipped, {} left alone).".format(
+            counts[move_plan.PENDING],
+            counts[move_plan.DONE],
+            counts[move_plan.SKIPPED],
+            counts[move_plan.CONFLICT] + counts[move_plan.MISSING] + counts[move_plan.CHANGED],
+        )
+    )
+    return counts
 
-            else:
-                break
 
-        # finally move or copy the file
-        if test:
-            test_file_dict[dest_file] = src_file
+def _plan_entry_taken(src_file, dup_index, dest_file):
+    """leave a file from a plan where it is, as another file has appeared at its destination since the plan was read"""
+    logging.error("{} already exists, so {} was not placed.".format(dest_file, src_file))
+    if dup_index is not None:
+        dup_index.taken(dest_file)
+    return None
 
-        else:
 
-            if fileIsIdentical:
-                continue  # ignore identical files
-            else:
-                if copy_files:
-                    shutil.copy2(src_file, dest_file)
-                else:
-                    shutil.move(src_file, dest_file)
+def _plan_entry_placed(copied, dup_index, dest_catalog, record, dest_file, verified_hash=None):
+    """record a finished transfer from a plan in the duplicate index and catalog of the destination, if it has them"""
+    if dup_index is not None:
+        dup_index.placed(dest_file, verified_hash)
+    if dest_catalog is not None:
+        src_file, source_stat, date, keys, content_hash = record
+        dest_catalog.add(dest_file, src_file, source_stat, date, keys, copied, verified_hash or content_hash)
 
 
 def main():
@@ -408,8 +1750,14 @@ def main():
         formatter_class=argparse.RawTextHelpFormatter,
         description="Sort files (primarily photos and videos) into folders by date\nusing EXIF and other metadata",
     )
-    parser.add_argument("src_dir", type=str, help="source directory")
-    parser.add_argument("dest_dir", type=str, help="destination directory")
+    parser.add_argument(
+        "dirs",
+        type=str,
+        nargs="*",
+        metavar="src_dir",
+        help="source directory (or several, e.g. one for each card), followed by the destination directory",
+    )
+    parser.add_argument("-V", "--version", action="version", version="sortphotos {}".format(__version__))
     parser.add_argument("-r", "--recursive", action="store_true", help="search src_dir recursively")
     parser.add_argument("-c", "--copy", action="store_true", help="copy files instead of move")
     parser.add_argument("-v", "--verbose", action="store_true", help="use verbose logging")
@@ -448,6 +1796,25 @@ def main():
     parser.add_argument(
         "--remove-duplicates", dest="remove_duplicates", action="store_true", help="If file is a duplicate ignore it."
     )
+    parser.add_argument(
+        "--remove-empty-dirs",
+        action="store_true",
+        help="after moving files, remove the folders in src_dir they were moved out of\n\
+    once they are empty (src_dir itself is kept).",
+    )
+    parser.add_argument(
+        "--remove-junk-files",
+        action="store_true",
+        help="with --remove-empty-dirs, also remove folders holding nothing but\n\
+    .DS_Store, Thumbs.db or desktop.ini files, along with those files.",
+    )
+    parser.add_argument(
+        "--no-catalog",
+        dest="use_catalog",
+        action="store_false",
+        help="do not record the files placed in the catalog kept in dest_dir,\n\
+    or skip files an earlier run already copied there.",
+    )
     parser.add_argument(
         "--day-begins",
         type=int,
@@ -489,6 +1856,174 @@ def main():
         help="specify a restricted set of tags to search for date information\n\
     e.g., EXIF:CreateDate",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of ExifTool processes used to extract metadata in parallel.\n\
+    defaults to 1.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="do not read or write the metadata cache, so every file is passed to ExifTool",
+    )
+    parser.add_argument(
+        "--rebuild-cache", action="store_true", help="discard everything in the metadata cache before starting"
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=str,
+        default=None,
+        help="path to the metadata cache.\n\
+    defaults to sortphotos/metadata.sqlite in the user cache directory (e.g., ~/.cache)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=None,
+        help="maximum number of files remembered in the metadata cache.\n\
+    the least recently used files are forgotten first.",
+    )
+    parser.add_argument(
+        "--extensions",
+        type=str,
+        nargs="+",
+        default=None,
+        help="only sort files with these extensions (not case sensitive), e.g., jpg mov.\n\
+    by default every file is sorted",
+    )
+    parser.add_argument(
+        "--ignore-extensions",
+        type=str,
+        nargs="+",
+        default=None,
+        help="leave files with these extensions where they are (not case sensitive), e.g., txt xmp",
+    )
+    parser.add_argument(
+        "--walk-threads",
+        type=int,
+        default=1,
+        help="number of threads used to read directories when searching src_dir.\n\
+    values above 1 mostly help on network file systems.",
+    )
+    parser.add_argument(
+        "--rebuild-duplicate-index",
+        action="store_true",
+        help="re-index the files already in dest_dir before looking for duplicates.\n\
+    only needed if files have been added to dest_dir by something other than sortphotos.",
+    )
+    parser.add_argument(
+        "--io-jobs",
+        type=int,
+        default=1,
+        help="number of files to copy or move at once.\n\
+    values above 1 help when copying to network storage or between disks.",
+    )
+    parser.add_argument(
+        "--device-jobs",
+        type=int,
+        default=None,
+        help="most batches of files read by ExifTool, and most files copied or moved,\n\
+    from any one source device at once.  with several sources, set --jobs and\n\
+    --io-jobs to allow for every device.  defaults to no limit.",
+    )
+    parser.add_argument(
+        "--verify",
+        choices=transfer.VERIFY_MODES,
+        default=None,
+        help="verify each copy, hashing the file as it is copied and syncing the copy to disk.\n\
+    fsync trusts the synced copy, readback also reads it back once and checks\n\
+    its hash.  the hashes are kept for finding duplicates and in the catalog.\n\
+    slower, but for archival imports.  defaults to no verification.",
+    )
+    parser.add_argument(
+        "--fast",
+        action="count",
+        default=0,
+        help="ask ExifTool to read less of each file (-fast).  Use twice (-fast2) to also skip maker notes.\n\
+    much quicker for large videos, but dates stored at the end of a file may be missed.",
+    )
+    parser.add_argument(
+        "--no-native",
+        dest="native",
+        action="store_false",
+        help="pass every file to ExifTool, rather than reading JPEG, TIFF, HEIC and MP4 headers directly",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running after sorting src_dir, and sort new files as they arrive.\n\
+    uses inotify on Linux, and otherwise searches src_dir for new files every --watch-poll-interval seconds.",
+    )
+    parser.add_argument(
+        "--watch-settle",
+        type=float,
+        default=2.0,
+        help="seconds a new file must stay the same before it is sorted, so files still being written are left alone.\n\
+    defaults to 2.",
+    )
+    parser.add_argument(
+        "--watch-poll-interval",
+        type=float,
+        default=10.0,
+        help="seconds between searches of src_dir for new files, where inotify is not available.\n\
+    defaults to 10.",
+    )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        default=None,
+        metavar="PLAN_FILE",
+        help="don't move or copy anything, but write what would be done to PLAN_FILE (JSON Lines),\n\
+    so it can be done later with --apply.",
+    )
+    parser.add_argument(
+        "--apply",
+        type=str,
+        default=None,
+        metavar="PLAN_FILE",
+        help="move or copy the files in a plan written with --plan, instead of sorting src_dir.\n\
+    an interrupted apply can be run again, and carries on where it stopped.",
+    )
+    parser.add_argument(
+        "--exiftool-timeout",
+        type=float,
+        default=60.0,
+        help="most seconds ExifTool may spend on a single file.  a file which takes longer\n\
+    (or which ExifTool crashes on) is left where it is, without losing the rest of its batch.\n\
+    0 for no limit.  default is 60",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        metavar="REPORT_FILE",
+        help="write a JSON report of the run to REPORT_FILE: counts of files found, placed,\n\
+    duplicated and renamed, and the time spent in and throughput of each stage.",
+    )
+    parser.add_argument(
+        "--prometheus-file",
+        type=str,
+        default=None,
+        help="write the same figures in the Prometheus text format to this file while running,\n\
+    for the node_exporter textfile collector.",
+    )
+    parser.add_argument(
+        "--prometheus-interval",
+        type=float,
+        default=15.0,
+        help="seconds between writes of --prometheus-file.  default is 15",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="finish a run into dest_dir which was interrupted.  moves and copies it had begun\n\
+    are checked and finished, and files it had already placed are skipped.\n\
+    if there is nothing to resume, this is an ordinary run.",
+    )
 
     # parse command line arguments
     args = parser.parse_args()
@@ -498,21 +2033,55 @@ def main():
         logging.getLogger().setLevel(40)
     else:
         logging.getLogger().setLevel(30)
+    if args.watch:
+        # stop cleanly when the service is stopped, so that pending moves finish and the indexes are saved
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if args.apply is not None:
+        apply_plan(args.apply, args.io_jobs, args.verify)
+        return
+    if len(args.dirs) < 2:
+        parser.error("src_dir and dest_dir are required, unless a plan is applied with --apply")
     sortPhotos(
-        args.src_dir,
-        args.dest_dir,
-        args.sort,
-        args.rename,
-        args.recursive,
-        args.copy,
-        args.test,
-        args.remove_duplicates,
-        args.day_begins,
-        args.ignore_groups,
-        args.ignore_tags,
-        args.use_only_groups,
-        args.use_only_tags,
-        args.keep_filename,
+        src_dir=args.dirs[:-1] if len(args.dirs) > 2 else args.dirs[0],
+        dest_dir=args.dirs[-1],
+        sort_format=args.sort,
+        rename_format=args.rename,
+        recursive=args.recursive,
+        copy_files=args.copy,
+        test=args.test,
+        remove_duplicates=args.remove_duplicates,
+        day_begins=args.day_begins,
+        additional_groups_to_ignore=args.ignore_groups,
+        additional_tags_to_ignore=args.ignore_tags,
+        use_only_groups=args.use_only_groups,
+        use_only_tags=args.use_only_tags,
+        keep_filename=args.keep_filename,
+        jobs=args.jobs,
+        use_cache=args.use_cache,
+        rebuild_cache=args.rebuild_cache,
+        cache_file=args.cache_file,
+        cache_size=args.cache_size,
+        extensions=args.extensions,
+        ignore_extensions=args.ignore_extensions,
+        walk_threads=args.walk_threads,
+        rebuild_duplicate_index=args.rebuild_duplicate_index,
+        io_jobs=args.io_jobs,
+        fast=args.fast,
+        native=args.native,
+        watch=args.watch,
+        watch_settle=args.watch_settle,
+        watch_poll_interval=args.watch_poll_interval,
+        plan_file=args.plan,
+        resume=args.resume,
+        report_file=args.report,
+        prometheus_file=args.prometheus_file,
+        prometheus_interval=args.prometheus_interval,
+        exiftool_timeout=args.exiftool_timeout,
+        remove_empty_dirs=args.remove_empty_dirs,
+        remove_junk_files=args.remove_junk_files,
+        use_catalog=args.use_catalog,
+        device_jobs=args.device_jobs,
+        verify=args.verify,
     )
 
 
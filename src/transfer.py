@@ -0,0 +1,433 @@
+"""
+Copies and moves files into the destination, using the cheapest method the file systems involved support.
+
+Moves within a file system are a single rename.  Copies are tried as a reflink (FICLONE) first, then with
+os.copy_file_range (which lets the kernel, or an NFS server, do the copy) and os.sendfile, before falling back to a
+plain read/write loop.
+
+Copies can also be verified, for archival imports.  The source is then read once, through a single buffer per thread,
+and hashed as it is written (with the same hash as duplicate_index.hash_file, so the hash can be reused to find
+duplicates).  The copy is then either synced to disk and trusted (VERIFY_FSYNC), or synced, dropped from the page
+cache and read back once to check that its hash matches (VERIFY_READBACK).
+"""
+
+import collections
+import errno
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from . import duplicate_index
+except ImportError:
+    import duplicate_index
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request number for FICLONE on Linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# ways of verifying copies: trust the copy once it has been synced to disk, or also read it back and check its hash
+VERIFY_FSYNC = "fsync"
+VERIFY_READBACK = "readback"
+VERIFY_MODES = (VERIFY_FSYNC, VERIFY_READBACK)
+
+# the size of the buffer each thread reads verified copies through
+VERIFY_BUFFER_SIZE = 8 * 1024 * 1024
+
+_buffers = threading.local()
+
+# errors that mean a fast copy method is not supported here, rather than that the copy failed
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOTTY}
+
+
+def _reflink(fsrc, fdst) -> bool:
+    """
+    Clones the source file into the destination, sharing the same blocks on disk (btrfs, XFS, ...).
+
+    :param fsrc: the open source file
+    :param fdst: the open (empty) destination file
+
+    :return: true if the file was cloned
+    :rtype: bool
+    """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError as e:
+        if e.errno in _UNSUPPORTED_ERRNOS or e.errno == errno.EBADF:
+            return False
+        raise
+    return True
+
+
+def _copy_contents(fsrc, fdst) -> None:
+    """
+    Copies the contents of the source file to the destination inside the kernel where possible.
+
+    :param fsrc: the open source file
+    :param fdst: the open (empty) destination file
+
+    :return: None
+    :rtype: None
+    """
+    in_fd = fsrc.fileno()
+    out_fd = fdst.fileno()
+    copied = 0
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while True:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(in_fd, out_fd, COPY_CHUNK_SIZE)
+                else:
+                    n = os.sendfile(out_fd, in_fd, None, COPY_CHUNK_SIZE)
+                if n == 0:
+                    return
+                copied += n
+        except OSError as e:
+            # only fall back if nothing has been written yet, otherwise the error is real
+            if copied or e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+    shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+
+
+def _buffer() -> memoryview:
+    """get this thread's buffer for verified copies, which is allocated once and reused for every file"""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _buffers.buffer = memoryview(bytearray(VERIFY_BUFFER_SIZE))
+    return buffer
+
+
+def _copy_hashed(fsrc, fdst) -> str:
+    """
+    Copies the contents of the source file to the destination, hashing them on the way through.
+
+    :param fsrc: the open source file (unbuffered)
+    :param fdst: the open (empty) destination file (unbuffered)
+
+    :return: the hex digest of the contents (see duplicate_index.hash_file)
+    :rtype: str
+    """
+    buffer = _buffer()
+    digest = duplicate_index.new_hash()
+    copied = 0
+    while True:
+        n = fsrc.readinto(buffer)
+        if not n:
+            break
+        chunk = buffer[:n]
+        digest.update(chunk)
+        while chunk:
+            chunk = chunk[fdst.write(chunk) :]
+        copied += n
+    if copied != os.fstat(fsrc.fileno()).st_size:
+        raise IOError("{} changed while it was being copied".format(fsrc.name))
+    return digest.hexdigest()
+
+
+def _hash_from_disk(path: str) -> str:
+    """
+    Hashes the contents of a synced file as they are on disk, dropping them from the page cache first where possible.
+
+    :param str path: the path to the file
+
+    :return: the hex digest of the contents (see duplicate_index.hash_file)
+    :rtype: str
+    """
+    buffer = _buffer()
+    digest = duplicate_index.new_hash()
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(buffer[:n])
+    return digest.hexdigest()
+
+
+def _sync_directory(path: str) -> None:
+    """sync a directory, so that a file renamed into it is on disk under its new name (not possible on Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def partial_path(dest: str) -> str:
+    """
+    Gets the hidden temporary file a copy to dest is written to before it is complete.
+
+    :param str dest: the path being copied to
+
+    :return: the path of the temporary file
+    :rtype: str
+    """
+    directory, name = os.path.split(dest)
+    return os.path.join(directory, ".{}.partial".format(name))
+
+
+def _place(path: str, dest: str) -> None:
+    """
+    Renames path to dest, raising FileExistsError rather than replacing a file already there (which another program, or
+    a file differing only in case, may have put there since the name was chosen).
+
+    :param str path: the file to rename
+    :param str dest: the path to rename it to
+
+    :return: None
+    :rtype: None
+    """
+    try:
+        if os.link in os.supports_follow_symlinks:
+            # like rename, link a symbolic link itself rather than what it points to
+            os.link(path, dest, follow_symlinks=False)
+        else:
+            os.link(path, dest)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            raise
+        # the file system has no hard links (e.g. FAT, or some network shares), so check before renaming (which never
+        # replaces a file on Windows)
+        if os.path.lexists(dest):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+        os.rename(path, dest)
+        return
+    try:
+        os.unlink(path)
+    except OSError:
+        os.unlink(dest)
+        raise
+
+
+def copy_file(src: str, dest: str, verify: str = None) -> str:
+    """
+    Copies the file and its metadata (like shutil.copy2), using the fastest method the file system supports.
+
+    The copy is written to a temporary file and only renamed to dest once it is complete, so dest never holds part of
+    a file, even if the copy is interrupted.  A file already at dest is never replaced: FileExistsError is raised
+    instead.  If verify is given, the contents are instead hashed as they are copied, and the copy is synced to disk
+    (and with VERIFY_READBACK, read back and checked) before it is renamed.
+
+    :param str src: the file to copy
+    :param str dest: the path to copy to
+    :param str verify: VERIFY_FSYNC or VERIFY_READBACK to verify the copy, or None not to
+
+    :return: the hex digest of the contents (see duplicate_index.hash_file) if the copy was verified, otherwise None
+    :rtype: str
+    """
+    partial = partial_path(dest)
+    content_hash = None
+    try:
+        if verify is None:
+            with open(src, "rb") as fsrc, open(partial, "wb") as fdst:
+                if not _reflink(fsrc, fdst):
+                    _copy_contents(fsrc, fdst)
+        else:
+            with open(src, "rb", buffering=0) as fsrc, open(partial, "wb", buffering=0) as fdst:
+                content_hash = _copy_hashed(fsrc, fdst)
+                os.fsync(fdst.fileno())
+            if verify == VERIFY_READBACK and _hash_from_disk(partial) != content_hash:
+                raise IOError("The copy of {} to {} does not match when read back".format(src, dest))
+        shutil.copystat(src, partial)
+        _place(partial, dest)
+        if verify is not None:
+            _sync_directory(os.path.dirname(os.path.abspath(dest)))
+        return content_hash
+    except BaseException:
+        try:
+            os.unlink(partial)
+        except OSError:
+            pass
+        raise
+
+
+def move_file(src: str, dest: str, verify: str = None) -> str:
+    """
+    Moves the file, with a single rename if the source and destination are on the same file system.  A file already
+    at dest is never replaced: FileExistsError is raised instead.
+
+    :param str src: the file to move
+    :param str dest: the path to move to
+    :param str verify: VERIFY_FSYNC or VERIFY_READBACK to verify the copy made when moving between file systems (before
+        the source is removed), or None not to
+
+    :return: the hex digest of the contents if they were copied and verified, otherwise None
+    :rtype: str
+    """
+    try:
+        _place(src, dest)
+        return None
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    content_hash = copy_file(src, dest, verify)
+    os.unlink(src)
+    return content_hash
+
+
+def transfer_file(src: str, dest: str, copy: bool, verify: str = None) -> str:
+    """
+    Copies or moves the file, raising FileExistsError if a file is already at dest.
+
+    :param str src: the file to transfer
+    :param str dest: the path to transfer to
+    :param bool copy: if true, copy rather than move
+    :param str verify: VERIFY_FSYNC or VERIFY_READBACK to verify copies, or None not to
+
+    :return: the hex digest of the contents if they were copied and verified, otherwise None
+    :rtype: str
+    """
+    if copy:
+        return copy_file(src, dest, verify)
+    return move_file(src, dest, verify)
+
+
+class TransferExecutor(object):
+    """
+    Runs file transfers on a bounded pool of threads.
+
+    Transfers may finish in any order, but their callbacks are always run in the submitting thread, in the order the
+    transfers were submitted, with where the file was placed and its hash if it was copied and verified.  If another
+    file has taken the destination by the time a file is placed, the transfer's on_exists is asked (again in the
+    submitting thread) for another destination, which the file is then placed at.  With a concurrency of 1 each
+    transfer is run immediately in the calling thread.
+    """
+
+    def __init__(self, concurrency: int = 1, stats=None, devices=None, verify: str = None):
+        """
+        :param int concurrency: the number of transfers to run at once
+        :param stats: if given, a run_stats.RunStats the time of each transfer is recorded in
+        :param devices: if given, a devices.DeviceLimiter limiting the transfers reading from each source device at once
+        :param str verify: VERIFY_FSYNC or VERIFY_READBACK to verify copies (see copy_file), or None not to
+        """
+        if verify is not None and verify not in VERIFY_MODES:
+            raise ValueError("Unknown way of verifying copies: {}".format(verify))
+        self.concurrency = max(1, int(concurrency))
+        self.stats = stats
+        self.devices = devices
+        self.verify = verify
+        self._executor = None
+        self._pending = collections.deque()
+
+    def __enter__(self):
+        if self.concurrency > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.drain()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def submit(self, src: str, dest: str, copy: bool, callback=None, details=None, on_exists=None) -> None:
+        """
+        Queues a transfer, blocking while too many transfers are already waiting.
+
+        :param str src: the file to transfer
+        :param str dest: the path to transfer to
+        :param bool copy: if true, copy rather than move
+        :param callback: called once the transfer has finished, with the path the file was placed at and the hash of its
+            contents if it was copied and verified, otherwise None
+        :param dict details: more about the file, which is only used by journal.JournaledTransfers
+        :param on_exists: called with the destination if another file is found there, returning the path to place the
+            file at instead, or None to leave the file where it is (and not call callback).  If not given,
+            FileExistsError is raised
+
+        :return: None
+        :rtype: None
+        """
+        if self._executor is None:
+            try:
+                content_hash = self._transfer(src, dest, copy)
+            except FileExistsError:
+                dest, content_hash = self._place_elsewhere(src, dest, copy, on_exists)
+            if callback is not None and dest is not None:
+                callback(dest, content_hash)
+            return
+        while len(self._pending) >= 2 * self.concurrency:
+            self._finish_next()
+        future = self._executor.submit(self._transfer, src, dest, copy)
+        self._pending.append((src, dest, copy, future, callback, on_exists))
+
+    def drain(self) -> None:
+        """
+        Waits for all queued transfers to finish.
+
+        :return: None
+        :rtype: None
+        """
+        while self._pending:
+            self._finish_next()
+
+    def _transfer(self, src: str, dest: str, copy: bool) -> str:
+        """transfer a single file, waiting for a reader of its device if they are limited"""
+        if self.devices is None:
+            return self._timed_transfer(src, dest, copy)
+        with self.devices.reading(src):
+            return self._timed_transfer(src, dest, copy)
+
+    def _timed_transfer(self, src: str, dest: str, copy: bool) -> str:
+        """transfer a single file, recording how long it took, and return its hash if it was verified"""
+        if self.stats is None:
+            return transfer_file(src, dest, copy, self.verify)
+        start = time.perf_counter()
+        content_hash = transfer_file(src, dest, copy, self.verify)
+        seconds = time.perf_counter() - start
+        self.stats.add_time("transfer", seconds)
+        self.stats.observe("transfer_seconds", seconds)
+        return content_hash
+
+    def _place_elsewhere(self, src: str, dest: str, copy: bool, on_exists) -> tuple:
+        """
+        transfer a file whose destination was taken to the one on_exists gives instead, until one is free, returning
+        where it was placed (None if on_exists gave up) and its hash
+        """
+        while True:
+            if on_exists is None:
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+            dest = on_exists(dest)
+            if dest is None:
+                return None, None
+            try:
+                return dest, self._transfer(src, dest, copy)
+            except FileExistsError:
+                pass
+
+    def _finish_next(self) -> None:
+        """wait for the oldest transfer and run its callback, raising any error from the transfer"""
+        src, dest, copy, future, callback, on_exists = self._pending.popleft()
+        try:
+            try:
+                content_hash = future.result()
+            except FileExistsError:
+                dest, content_hash = self._place_elsewhere(src, dest, copy, on_exists)
+        except Exception:
+            logging.error("Failed to transfer file to {}.".format(dest))
+            raise
+        if callback is not None and dest is not None:
+            callback(dest, content_hash)
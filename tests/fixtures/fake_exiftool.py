@@ -0,0 +1,48 @@
+"""
+A stand-in for ExifTool in -stay_open mode, for testing exiftool_process.
+
+Each file is reported as ExifTool does with -j -progress, except that it hangs on a file with "hang" in its name and
+exits on one with "die" in its name.  With --no-progress the files aren't named on stderr.
+"""
+import json
+import os
+import sys
+import time
+
+
+def main():
+    progress = "--no-progress" not in sys.argv
+    files = []
+    while True:
+        line = sys.stdin.buffer.readline()
+        if not line:
+            return
+        arg = os.fsdecode(line.rstrip(b"\r\n"))
+        if arg == "-stay_open" and sys.stdin.buffer.readline().strip() == b"False":
+            return
+        if arg.startswith("-execute"):
+            read(files, arg[len("-execute") :], progress)
+            files = []
+        elif not arg.startswith("-"):
+            files.append(arg)
+
+
+def read(files, count, progress):
+    sys.stdout.write("[")
+    for i, f in enumerate(files):
+        if progress:
+            sys.stderr.write("======== {} [{}/{}]\n".format(f, i + 1, len(files)))
+            sys.stderr.flush()
+        name = os.path.basename(f)
+        if "hang" in name:
+            time.sleep(3600)
+        if "die" in name:
+            sys.exit(1)
+        sys.stdout.write("{}{}".format("," if i else "", json.dumps({"SourceFile": f, "File:FileName": name})))
+        sys.stdout.flush()
+    sys.stdout.write("]\n{{ready{}}}\n".format(count))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from src import sortphotos
+
+
+class TestDestinationNames(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self._tmp.name, "2010", "01-Jan")
+        os.makedirs(self.directory)
+        open(os.path.join(self.directory, "IMG.JPG"), "w").close()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_case_sensitive(self):
+        with mock.patch.object(sortphotos, "is_case_insensitive", return_value=False):
+            names = sortphotos.DestinationNames()
+            self.assertTrue(names.exists(self._path("IMG.JPG")))
+            self.assertFalse(names.exists(self._path("img.jpg")))
+
+    def test_case_insensitive(self):
+        with mock.patch.object(sortphotos, "is_case_insensitive", return_value=True):
+            names = sortphotos.DestinationNames()
+            self.assertTrue(names.exists(self._path("img.jpg")))
+            self.assertEqual(names.next_free(self._path("img"), ".jpg"), self._path("img_1.jpg"))
+            names.add(self._path("img_1.jpg"))
+            self.assertTrue(names.exists(self._path("IMG_1.JPG")))
+            self.assertEqual(names.next_free(self._path("IMG"), ".JPG"), self._path("IMG_2.JPG"))
+
+    def test_is_case_insensitive(self):
+        # the temporary directory is on a case-sensitive file system on Linux, and a case-insensitive one by default on
+        # macOS and Windows
+        parent = os.path.dirname(self.directory)
+        expected = os.path.exists(os.path.join(parent, "01-JAN"))
+        self.assertEqual(sortphotos.is_case_insensitive(self.directory), expected)
+        self.assertEqual(sortphotos.is_case_insensitive(os.path.join(self.directory, "new", "Folder")), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
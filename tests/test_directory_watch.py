@@ -0,0 +1,58 @@
+import os
+import tempfile
+import time
+import unittest
+
+from src import directory_watch
+
+
+def scan(directory):
+    files = []
+    subdirs = []
+    for entry in os.scandir(directory):
+        (subdirs if entry.is_dir() else files).append(entry.path)
+    return files, subdirs
+
+
+class TestPollingWatcher(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.watcher = directory_watch.DirectoryWatcher(
+            self._tmp.name, scan, lambda path: True, settle=0.2, poll_interval=0.05, use_inotify=False, max_reported=2
+        )
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.close()
+        self._tmp.cleanup()
+
+    def _write(self, name, contents, age=0.0):
+        path = os.path.join(self._tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(contents)
+        if age:
+            modified = time.time() - age
+            os.utime(path, (modified, modified))
+        return path
+
+    def test_reported_once_until_changed(self):
+        # copied in with its modification time kept, so it has settled when it is found again below
+        photo = self._write("photo.jpg", b"photo", age=1.0)
+        self.assertEqual(self.watcher.wait(), [photo])
+        # a file found again (e.g. by searching the tree again) is only reported if it has changed
+        self.assertEqual(list(self.watcher.existing_files([photo])), [])
+        other = self._write("other.jpg", b"other")
+        self.assertEqual(self.watcher.wait(), [other])
+        self._write("photo.jpg", b"photo, edited")
+        self.assertEqual(self.watcher.wait(), [photo])
+
+    def test_reported_files_are_bounded(self):
+        files = [self._write("{}.jpg".format(i), b"photo", age=1.0) for i in range(3)]
+        self.assertEqual(list(self.watcher.existing_files(files)), files)
+        self.assertEqual(list(self.watcher._reported), files[1:])
+        # the files the watcher still remembers are not reported again
+        self.assertEqual(list(self.watcher.existing_files(files[1:])), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+from src import duplicate_index
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dest = self._tmp.name
+        self.path = duplicate_index.default_index_path(self.dest)
+        self.existing = self._write(os.path.join(self.dest, "2010", "photo.jpg"), b"photo" * 1000)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, path, contents):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def _build(self, rebuild=False):
+        with duplicate_index.DuplicateIndex(self.path, rebuild=rebuild) as index:
+            if index.is_new:
+                index.build([self.existing])
+
+    def test_test_run_before_first_run_leaves_no_index(self):
+        with duplicate_index.DuplicateIndex(self.path, persist=False) as index:
+            self.assertTrue(index.is_new)
+            index.build([self.existing])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_test_run_keeps_saved_index(self):
+        # the .sortphotos directory exists (e.g. for the catalog), but the index hasn't been built yet
+        os.makedirs(os.path.dirname(self.path))
+        with duplicate_index.DuplicateIndex(self.path, persist=False) as index:
+            self.assertTrue(index.is_new)
+            index.build([self.existing])
+
+        duplicate = self._write(os.path.join(self.dest, "incoming", "copy.jpg"), b"photo" * 1000)
+        with duplicate_index.DuplicateIndex(self.path) as index:
+            self.assertTrue(index.is_new)
+            index.build([self.existing])
+        with duplicate_index.DuplicateIndex(self.path) as index:
+            self.assertFalse(index.is_new)
+            self.assertEqual(index.find_duplicate(duplicate), os.path.abspath(self.existing))
+
+    def test_test_run_uses_but_does_not_change_saved_index(self):
+        self._build()
+        duplicate = self._write(os.path.join(self.dest, "incoming", "copy.jpg"), b"photo" * 1000)
+        other = self._write(os.path.join(self.dest, "incoming", "other.jpg"), b"other" * 1000)
+
+        with duplicate_index.DuplicateIndex(self.path, persist=False) as index:
+            self.assertFalse(index.is_new)
+            self.assertEqual(index.find_duplicate(duplicate), os.path.abspath(self.existing))
+            index.add(other)
+        with duplicate_index.DuplicateIndex(self.path, persist=False, rebuild=True) as index:
+            self.assertTrue(index.is_new)
+
+        with duplicate_index.DuplicateIndex(self.path) as index:
+            self.assertFalse(index.is_new)
+            self.assertEqual(index.find_duplicate(duplicate), os.path.abspath(self.existing))
+            self.assertIsNone(index.find_duplicate(self._write(other + ".2", b"other" * 1000)))
+
+    def test_placed_file_with_rounded_time(self):
+        source = self._write(os.path.join(self._tmp.name, "incoming", "new.jpg"), b"new" * 1000)
+        os.utime(source, ns=(1500000001123456789, 1500000001123456789))
+        dest = os.path.join(self.dest, "2017", "new.jpg")
+        with duplicate_index.DuplicateIndex(self.path) as index:
+            index.build([self.existing])
+            index.add(dest, source=source)
+            # copied onto a FAT card, which keeps only even seconds
+            self._write(dest, b"new" * 1000)
+            os.utime(dest, ns=(1500000002000000000, 1500000002000000000))
+            index.placed(dest)
+
+        duplicate = self._write(os.path.join(self._tmp.name, "incoming", "again.jpg"), b"new" * 1000)
+        with duplicate_index.DuplicateIndex(self.path) as index:
+            self.assertEqual(index.find_duplicate(duplicate), os.path.abspath(dest))
+            self.assertEqual(index.find_duplicate(duplicate), os.path.abspath(dest))
+
+
+if __name__ == "__main__":
+    unittest.main()
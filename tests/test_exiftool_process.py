@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from src import exiftool_process
+
+FAKE_EXIFTOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "fake_exiftool.py")
+
+
+class TestReadIsolated(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tool = None
+
+    def tearDown(self):
+        if self.tool is not None:
+            self.tool.kill()
+        self._tmp.cleanup()
+
+    def _files(self, names):
+        paths = []
+        for name in names:
+            path = os.path.join(self._tmp.name, name)
+            with open(path, "wb") as f:
+                f.write(b"photo")
+            paths.append(path)
+        return paths
+
+    def _read(self, files, progress=True, file_timeout=None, sizer=None):
+        """read files with the fake ExifTool, returning the metadata by file and the files reported as failed"""
+        self.tool = exiftool_process.ExifToolProcess(
+            [sys.executable, FAKE_EXIFTOOL] + ([] if progress else ["--no-progress"])
+        )
+        failed = []
+        results = []
+        for batch in sizer.split(files) if sizer is not None else [files]:
+            results += exiftool_process.read_isolated(
+                self.tool, batch, [], file_timeout, on_failure=lambda f, _: failed.append(f)
+            )
+        return {data["SourceFile"]: data for data in results}, failed
+
+    def _check(self, files, bad, metadata, failed):
+        self.assertEqual(failed, [bad])
+        self.assertEqual(sorted(metadata), sorted(files))
+        for f in files:
+            with self.subTest(file=os.path.basename(f)):
+                if f == bad:
+                    self.assertTrue(metadata[f][exiftool_process.FAILED_KEY])
+                    self.assertIn("ExifTool:Error", metadata[f])
+                else:
+                    self.assertEqual(metadata[f], {"SourceFile": f, "File:FileName": os.path.basename(f)})
+
+    def test_hang(self):
+        files = self._files(["a.jpg", "b.jpg", "c.jpg", "hang.jpg", "d.jpg", "e.jpg"])
+        metadata, failed = self._read(files, file_timeout=0.5)
+        self._check(files, files[3], metadata, failed)
+
+    def test_exit(self):
+        files = self._files(["a.jpg", "b.jpg", "die.jpg", "c.jpg", "d.jpg"])
+        metadata, failed = self._read(files)
+        self._check(files, files[2], metadata, failed)
+
+    def test_exit_without_progress(self):
+        # the file to blame can only be found by splitting the batch
+        files = self._files(["a.jpg", "b.jpg", "c.jpg", "d.jpg", "e.jpg", "die.jpg", "f.jpg"])
+        metadata, failed = self._read(files, progress=False)
+        self._check(files, files[5], metadata, failed)
+
+    def test_batches(self):
+        files = self._files(["a.jpg", "b.mov", "c.jpg", "d.mov", "hang.mov", "e.jpg", "f.mov"])
+        sizer = exiftool_process.BatchSizer(max_files=3)
+        self.assertEqual(sizer.split(files), [files[:3], files[3:6], files[6:]])
+        metadata, failed = self._read(files, file_timeout=0.5, sizer=sizer)
+        self._check(files, files[4], metadata, failed)
+
+
+class TestBatchSizer(unittest.TestCase):
+    def test_slow_type_gets_smaller_batches(self):
+        sizer = exiftool_process.BatchSizer(target_seconds=1.0)
+        files = ["{}.jpg".format(i) for i in range(10)] + ["{}.mov".format(i) for i in range(10)]
+        self.assertEqual(sizer.split(files), [files])
+        sizer.observe(files[10:12], 1.0)
+        self.assertAlmostEqual(sizer.estimate("x.MOV"), 0.5)
+        self.assertEqual(
+            sizer.split(files), [files[:11], files[11:13], files[13:15], files[15:17], files[17:19], files[19:]]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
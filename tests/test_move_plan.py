@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src import move_plan
+
+
+class TestEntryState(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self._tmp.name, "photo.jpg")
+        self.dest = os.path.join(self._tmp.name, "sorted", "photo.jpg")
+        os.makedirs(os.path.dirname(self.dest))
+        with open(self.src, "wb") as f:
+            f.write(b"photo" * 1000)
+        # a time which isn't a whole number of seconds, as on most local file systems
+        os.utime(self.src, ns=(1500000000123456789, 1500000001123456789))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _entry(self, action="copy"):
+        st = os.stat(self.src)
+        return {"src": self.src, "dest": self.dest, "action": action, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def test_pending(self):
+        self.assertEqual(move_plan.entry_state(self._entry()), move_plan.PENDING)
+
+    def test_done(self):
+        entry = self._entry()
+        shutil.copy2(self.src, self.dest)
+        self.assertEqual(move_plan.entry_state(entry), move_plan.DONE)
+
+    def test_done_with_time_rounded_to_2_seconds(self):
+        # FAT and exFAT memory cards only keep even seconds
+        entry = self._entry()
+        shutil.copy2(self.src, self.dest)
+        for rounded in (1500000000000000000, 1500000002000000000):
+            os.utime(self.dest, ns=(rounded, rounded))
+            self.assertEqual(move_plan.entry_state(entry), move_plan.DONE)
+        moved = self._entry("move")
+        os.unlink(self.src)
+        self.assertEqual(move_plan.entry_state(moved), move_plan.DONE)
+
+    def test_conflict(self):
+        entry = self._entry()
+        shutil.copy2(self.src, self.dest)
+        os.utime(self.dest, ns=(1600000000000000000, 1600000000000000000))
+        self.assertEqual(move_plan.entry_state(entry), move_plan.CONFLICT)
+        with open(self.dest, "wb") as f:
+            f.write(b"other")
+        os.utime(self.dest, ns=(1500000001123456789, 1500000001123456789))
+        self.assertEqual(move_plan.entry_state(entry), move_plan.CONFLICT)
+
+    def test_missing_and_changed(self):
+        entry = self._entry()
+        with open(self.src, "ab") as f:
+            f.write(b"more")
+        self.assertEqual(move_plan.entry_state(entry), move_plan.CHANGED)
+        os.unlink(self.src)
+        self.assertEqual(move_plan.entry_state(entry), move_plan.MISSING)
+
+    def test_skip(self):
+        self.assertEqual(move_plan.entry_state({"action": "skip"}), move_plan.SKIPPED)
+
+
+if __name__ == "__main__":
+    unittest.main()
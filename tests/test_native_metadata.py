@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import unittest
+
+from src import native_metadata, sortphotos
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PHOTOS = ["photo.jpg", "photo.tif", "photo.heic"]
+MOVIES = ["video.mp4"]
+
+
+@unittest.skipIf(shutil.which("perl") is None, "ExifTool needs perl")
+class TestNativeMetadata(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _copy(self, name, length=None, changes=None):
+        """copy a fixture (or its first length bytes, with the bytes in changes replaced) to the temporary directory"""
+        with open(os.path.join(FIXTURES, name), "rb") as f:
+            data = bytearray(f.read())
+        for pos, value in (changes or {}).items():
+            data[pos] = value
+        root, ext = os.path.splitext(name)
+        label = "_".join("{}-{}".format(pos, value) for pos, value in (changes or {}).items())
+        path = os.path.join(
+            self._tmp.name, "{}_{}{}{}".format(root, len(data) if length is None else length, label, ext)
+        )
+        with open(path, "wb") as f:
+            f.write(data[:length])
+        # an access time after the modification time isn't updated by reading the file (with relatime), so that the File
+        # group dates are the same for ExifTool and the native readers
+        now = time.time()
+        os.utime(path, (now, now - 3600))
+        return path
+
+    def _exiftool(self, paths):
+        """get ExifTool's time stamps of each file, without SourceFile, as sortphotos asks for them"""
+        output = subprocess.run(
+            ["perl", sortphotos.exiftool_location, "-q", "-q", "-j", "-G", "-n", "-time:all"] + paths,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        ).stdout
+        found = {data.pop("SourceFile"): data for data in json.loads(output or b"[]")}
+        return [found.get(path, {}) for path in paths]
+
+    def _check(self, paths):
+        """check the tags the native readers find in each file are those ExifTool reports"""
+        native = [native_metadata.read_time_tags(path) for path in paths]
+        read = [(path, tags, complete) for path, (tags, complete) in zip(paths, native) if tags is not None]
+        if not read:
+            return
+        for (path, tags, complete), exiftool in zip(read, self._exiftool([path for path, _, _ in read])):
+            with self.subTest(path=os.path.basename(path)):
+                if complete:
+                    self.assertEqual(tags, exiftool)
+                else:
+                    self.assertEqual(tags, {key: exiftool.get(key) for key in tags})
+
+    def test_photos(self):
+        for name in PHOTOS:
+            path = self._copy(name)
+            tags, complete = native_metadata.read_time_tags(path)
+            self.assertFalse(complete)
+            self.assertEqual(tags, {"EXIF:DateTimeOriginal": self._exiftool([path])[0]["EXIF:DateTimeOriginal"]})
+
+    def test_movies(self):
+        for name in MOVIES:
+            path = self._copy(name)
+            tags, complete = native_metadata.read_time_tags(path)
+            self.assertTrue(complete)
+            self.assertEqual(tags, self._exiftool([path])[0])
+
+    def test_truncated(self):
+        for name in PHOTOS + MOVIES:
+            size = os.path.getsize(os.path.join(FIXTURES, name))
+            # ExifTool is needed for the files which are read natively, which are few, as headers cut short aren't
+            paths = [self._copy(name, length) for length in range(size)]
+            self._check(paths)
+            # every fixture is cut off in the middle of its headers half way through
+            self.assertEqual(native_metadata.read_time_tags(paths[size // 2]), (None, False))
+
+    def test_corrupt(self):
+        for name in PHOTOS + MOVIES:
+            size = os.path.getsize(os.path.join(FIXTURES, name))
+            # each byte in turn is cleared or set, which often leaves a file ExifTool reads differently (or not at all)
+            self._check([self._copy(name, changes={pos: value}) for pos in range(size) for value in (0x00, 0xFF)])
+
+    def test_bad_offsets(self):
+        # the offset of the EXIF IFD, in the EXIF APP1 segment after the JFIF one
+        jpeg = self._copy("photo.jpg", changes={20 + 10 + 8 + 2 + 12 + 8 + 1: 0xFF})
+        # the size of the moov box, after ftyp
+        movie = self._copy("video.mp4", changes={28 + 2: 0xFF})
+        for path in (jpeg, movie):
+            self.assertEqual(native_metadata.read_time_tags(path), (None, False))
+            self.assertIsNone(sortphotos.read_native_metadata(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
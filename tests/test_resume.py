@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from src import catalog, duplicate_index, journal, sortphotos, transfer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DATE = "2019-07-14T09:30:05"
+TAGS = ["EXIF:DateTimeOriginal"]
+
+
+@unittest.skipIf(shutil.which("perl") is None, "ExifTool needs perl")
+class TestResume(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.src = os.path.join(self._tmp.name, "src")
+        self.dest = os.path.join(self._tmp.name, "dest")
+        with open(os.path.join(FIXTURES, "photo.jpg"), "rb") as f:
+            self.photo = f.read()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, path, name):
+        """write a copy of the photo fixture, made different from the others by its name after the end of the image"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(self.photo + name.encode())
+        return path
+
+    def _sort(self, src, copy):
+        sortphotos.sortPhotos(src, self.dest, "%Y/%m", None, copy_files=copy, resume=True, use_cache=False)
+
+    def _interrupted_run(self, copy):
+        """
+        leave the destination as a run killed part way leaves it: its index and catalog saved before the run began,
+        start records in the journal but no done records, and the file being copied when it was killed half written
+        """
+        # an earlier run saves the index and catalog
+        self._sort(os.path.dirname(self._write(os.path.join(self._tmp.name, "earlier", "z.jpg"), "z.jpg")), copy)
+        names = ["placed.jpg", "partial.jpg", "begun.jpg", "new.jpg"]
+        sources = [self._write(os.path.join(self.src, name), name) for name in names]
+        dests = [os.path.join(self.dest, "2019", "07", name) for name in names]
+        os.makedirs(os.path.dirname(dests[0]), exist_ok=True)
+        with open(journal.default_journal_path(self.dest), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"journal_version": journal.JOURNAL_VERSION, "copy": copy, "created": DATE}) + "\n")
+            # the last file wasn't reached, so it isn't in the journal
+            for src_file, dest_file in zip(sources[:3], dests[:3]):
+                st = os.stat(src_file)
+                record = {
+                    "op": "start",
+                    "src": os.path.abspath(src_file),
+                    "dest": os.path.abspath(dest_file),
+                    "action": "copy" if copy else "move",
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "date": DATE,
+                    "tags": TAGS,
+                }
+                f.write(json.dumps(record) + "\n")
+        # the first file was placed, the second cut short and the third not begun
+        if copy:
+            shutil.copy2(sources[0], dests[0])
+        else:
+            os.rename(sources[0], dests[0])
+        with open(transfer.partial_path(dests[1]), "wb") as f:
+            f.write(self.photo[: len(self.photo) // 2])
+        return names, dests
+
+    def _check_resumed(self, names, dests, copy):
+        placed = []
+        for root, _, files in os.walk(self.dest):
+            if ".sortphotos" not in root.split(os.sep):
+                placed += [os.path.join(root, name) for name in files]
+        self.assertEqual(sorted(placed), sorted(dests + [os.path.join(self.dest, "2019", "07", "z.jpg")]))
+        for name, dest_file in zip(names, dests):
+            with open(dest_file, "rb") as f:
+                self.assertEqual(f.read(), self.photo + name.encode())
+        self.assertEqual(sorted(os.listdir(self.src)), sorted(names) if copy else [])
+        self.assertFalse(os.path.exists(journal.default_journal_path(self.dest)))
+        with catalog.Catalog(catalog.default_catalog_path(self.dest)) as dest_catalog:
+            for dest_file in dests:
+                self.assertTrue(dest_catalog.contains(dest_file))
+        index_path = duplicate_index.default_index_path(self.dest)
+        with duplicate_index.DuplicateIndex(index_path) as dup_index:
+            self.assertFalse(dup_index.is_new)
+            for name, dest_file in zip(names, dests):
+                probe = self._write(os.path.join(self._tmp.name, "probe", name), name)
+                self.assertEqual(dup_index.find_duplicate(probe), os.path.abspath(dest_file))
+
+    def test_resume_moves(self):
+        names, dests = self._interrupted_run(False)
+        self._sort(self.src, False)
+        self._check_resumed(names, dests, False)
+
+    def test_resume_copies(self):
+        names, dests = self._interrupted_run(True)
+        self._sort(self.src, True)
+        self._check_resumed(names, dests, True)
+
+
+if __name__ == "__main__":
+    unittest.main()
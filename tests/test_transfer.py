@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from src import transfer
+
+
+class TestNoOverwrite(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.src = self._write("src.jpg", b"new")
+        self.dest = self._write("dest.jpg", b"old")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, name, contents):
+        path = os.path.join(self._tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_copy_does_not_overwrite(self):
+        with self.assertRaises(FileExistsError):
+            transfer.copy_file(self.src, self.dest)
+        self.assertEqual(self._read(self.dest), b"old")
+        self.assertFalse(os.path.exists(transfer.partial_path(self.dest)))
+
+    def test_move_does_not_overwrite(self):
+        with self.assertRaises(FileExistsError):
+            transfer.move_file(self.src, self.dest)
+        self.assertEqual(self._read(self.src), b"new")
+        self.assertEqual(self._read(self.dest), b"old")
+
+    def test_on_exists_gives_another_destination(self):
+        other = os.path.join(self._tmp.name, "dest_1.jpg")
+        for concurrency in (1, 2):
+            for copy in (True, False):
+                placed = []
+                with transfer.TransferExecutor(concurrency) as transfers:
+                    transfers.submit(
+                        self.src,
+                        self.dest,
+                        copy,
+                        callback=lambda dest, _: placed.append(dest),
+                        on_exists=lambda _: other,
+                    )
+                self.assertEqual(placed, [other])
+                self.assertEqual(self._read(self.dest), b"old")
+                self.assertEqual(self._read(other), b"new")
+                self.assertEqual(os.path.exists(self.src), copy)
+                os.rename(other, self.src)
+
+    def test_on_exists_gives_up(self):
+        placed = []
+        with transfer.TransferExecutor() as transfers:
+            transfers.submit(self.src, self.dest, False, callback=placed.append, on_exists=lambda _: None)
+        self.assertEqual(placed, [])
+        self.assertEqual(self._read(self.src), b"new")
+        self.assertEqual(self._read(self.dest), b"old")
+
+
+if __name__ == "__main__":
+    unittest.main()